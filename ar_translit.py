@@ -5,7 +5,7 @@
 import re, unicodedata
 import arabiclib
 from arabiclib import *
-from blib import remove_links, msg
+from blib import remove_links, msg, char_translation_table
 
 # FIXME!! To do:
 #
@@ -184,12 +184,16 @@ before_diacritic_checking_subs = [
 # FORCE_TRANSLATE causes even non-vocalized text to be transliterated
 # (normally the function checks for non-vocalized text and returns nil,
 # since such text is ambiguous in transliteration).
-def tr(text, lang=None, sc=None, omit_i3raab=False, gray_i3raab=False,
+#
+# This is the reference implementation of tr(), which tr() below must agree
+# with; used by check_translit_fast_paths.py to check the compiled version and
+# time it.
+def tr_reference(text, lang=None, sc=None, omit_i3raab=False, gray_i3raab=False,
     force_translate=False, msgfun=msg):
   for sub in before_diacritic_checking_subs:
     text = rsub(text, sub[0], sub[1])
 
-  if not force_translate and not has_diacritics(text):
+  if not force_translate and not has_diacritics_reference(text):
     return None
 
   ############# transformations after checking for diacritics ##############
@@ -276,6 +280,123 @@ def tr(text, lang=None, sc=None, omit_i3raab=False, gray_i3raab=False,
 
   return text
 
+# Compile a list of [FROM, TO] substitutions as done by rsub() into a list of
+# (GUARD, REGEX, TO) triples, where TO is converted to a function if it's a
+# dictionary. GUARDS is a list of the same length giving for each substitution
+# a string that every match contains, or None; tr() skips the substitution
+# when the text doesn't contain the string, which saves a scan of the text by
+# the regex for most substitutions and most texts.
+def compile_subs(subs, guards):
+  assert len(subs) == len(guards)
+  def dict_replacement(to):
+    def rsub_replace(m):
+      g = m.group(1) if m.re.groups else m.group(0)
+      return to.get(g, g)
+    return rsub_replace
+  return [(guard, re.compile(fr), dict_replacement(to) if type(to) is dict else to)
+    for (fr, to), guard in zip(subs, guards)]
+
+# Compiled regexes and tables used by tr().
+tr_gray_span = "<span style=\"color: #888888\">"
+compiled_before_diacritic_checking_subs = compile_subs(
+  before_diacritic_checking_subs,
+  ["[[", None, "لله", "\u0651", "\u064F\u0648\u0627", "\u0648\u0652\u0627",
+   "\u064B", "\u064B", "\u0629", "\u0627", "\u0670", "\u0625", "\u0670",
+   "\u0651", "\u0671", "\u0644", "\u0671", "l-"])
+tr_alif_before_vowel_re = re.compile("\u0627([\u064E\u064F\u0650])")
+tr_long_u_re = re.compile("\u064F\u0648([^\u064B\u064C\u064D\u064E\u064F\u0650\u0651\u0652\u0670])")
+tr_final_long_u_re = re.compile("\u064F\u0648$")
+tr_long_i_re = re.compile("\u0650\u064A([^\u064B\u064C\u064D\u064E\u064F\u0650\u0651\u0652\u0670ū])")
+tr_final_long_i_re = re.compile("\u0650\u064A$")
+tr_shadda_re = re.compile("(.)\u0651")
+tr_gray_al_taa_marbuuta_re = re.compile("((?:^|\\s)a?l-[^\\s]+)\u0629([\u064B\u064C\u064D\u064E\u064F\u0650])")
+tr_taa_marbuuta_vowel_re = re.compile("\u0629([\u064E\u064F\u0650])")
+tr_taa_marbuuta_tanwin_re = re.compile("\u0629([\u064B\u064C\u064D])")
+tr_gray_tanwin_table = char_translation_table({
+  "\u064B":tr_gray_span + "an</span>",
+  "\u064D":tr_gray_span + "in</span>",
+  "\u064C":tr_gray_span + "un</span>"
+})
+tr_short_vowel_space_re = re.compile("([\u064E\u064F\u0650])\\s")
+tr_gray_short_vowel_space_tab = {
+  "\u064E":tr_gray_span + "a</span> ",
+  "\u0650":tr_gray_span + "i</span> ",
+  "\u064F":tr_gray_span + "u</span> "
+}
+tr_final_short_vowel_re = re.compile("[\u064E\u064F\u0650]$")
+tr_gray_final_short_vowel_tab = {
+  "\u064E":tr_gray_span + "a</span>",
+  "\u0650":tr_gray_span + "i</span>",
+  "\u064F":tr_gray_span + "u</span>"
+}
+tr_tanwin_re = re.compile("[\u064B\u064C\u064D]")
+tr_short_vowel_before_space_re = re.compile("[\u064E\u064F\u0650]\\s")
+tr_final_alif_taa_marbuuta_re = re.compile("([\u0627\u0622])\u0629$")
+tr_final_taa_marbuuta_re = re.compile("\u0629$")
+tr_taa_marbuuta_space_re = re.compile("\u0629\\s")
+tr_initial_tatwil_re = re.compile("^ـ")
+tr_tatwil_after_space_re = re.compile("\\sـ")
+tr_final_tatwil_re = re.compile("ـ$")
+tr_tatwil_before_space_re = re.compile("ـ\\s")
+tr_elided_al_re = re.compile("([aiuāīū](?:</span>)?) a([" + sun_letters_tr + "]-)")
+tr_allaah_re = re.compile("(^|\\s)(a?)l-lāh")
+tt_table = char_translation_table(tt)
+
+# Transliterate the word(s) in TEXT. LANG (the language) and SC (the script)
+# are ignored. OMIT_I3RAAB means leave out final short vowels (ʾiʿrāb).
+# GRAY_I3RAAB means render transliterate short vowels (ʾiʿrāb) in gray.
+# FORCE_TRANSLATE causes even non-vocalized text to be transliterated
+# (normally the function checks for non-vocalized text and returns nil,
+# since such text is ambiguous in transliteration). This does the same as
+# tr_reference() but with precompiled regexes and str.translate() in place
+# of a per-character rsub(); see there for comments on the individual steps.
+def tr(text, lang=None, sc=None, omit_i3raab=False, gray_i3raab=False,
+    force_translate=False, msgfun=msg):
+  for guard, regex, to in compiled_before_diacritic_checking_subs:
+    if guard is None or guard in text:
+      text = regex.sub(to, text)
+
+  if not force_translate and not has_diacritics(text):
+    return None
+
+  text = tr_alif_before_vowel_re.sub("\u0671\\1", text)
+  text = tr_long_u_re.sub("ū\\1", text)
+  text = tr_final_long_u_re.sub("ū", text)
+  text = tr_long_i_re.sub("ī\\1", text)
+  text = tr_final_long_i_re.sub("ī", text)
+  text = tr_shadda_re.sub("\\1\\1", text)
+  if not omit_i3raab and gray_i3raab:
+    text = tr_gray_al_taa_marbuuta_re.sub(
+      "\\1" + tr_gray_span + "t</span>\\2", text)
+    text = tr_taa_marbuuta_vowel_re.sub("t\\1", text)
+    text = tr_taa_marbuuta_tanwin_re.sub(tr_gray_span + "t</span>\\1", text)
+    text = text.translate(tr_gray_tanwin_table)
+    text = tr_short_vowel_space_re.sub(
+      lambda m: tr_gray_short_vowel_space_tab[m.group(1)], text)
+    text = tr_final_short_vowel_re.sub(
+      lambda m: tr_gray_final_short_vowel_tab[m.group(0)], text)
+    text = text.replace("</span>" + tr_gray_span, "")
+  elif omit_i3raab:
+    text = tr_tanwin_re.sub("", text)
+    text = tr_short_vowel_before_space_re.sub(" ", text)
+    text = tr_final_short_vowel_re.sub("", text)
+  text = tr_final_alif_taa_marbuuta_re.sub("\\1h", text)
+  text = tr_final_taa_marbuuta_re.sub("", text)
+  if not omit_i3raab:
+    text = tr_taa_marbuuta_space_re.sub("(t) ", text)
+  else:
+    text = text.replace("\u0629", "(t)")
+  text = tr_initial_tatwil_re.sub("-", text)
+  text = tr_tatwil_after_space_re.sub(" -", text)
+  text = tr_final_tatwil_re.sub("-", text)
+  text = tr_tatwil_before_space_re.sub("- ", text)
+  text = text.translate(tt_table)
+  text = text.replace("aā", "ā")
+  text = tr_elided_al_re.sub("\\1 \\2", text)
+  text = tr_allaah_re.sub("\\1\\2llāh", text)
+
+  return text
+
 has_diacritics_subs = [
   # FIXME! What about lam-alif ligature?
   # remove punctuation and shadda
@@ -311,11 +432,41 @@ has_diacritics_subs = [
   ["[^\u0600-\u06FF\u0750-\u077F\u08A1-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]", ""]
 ]
 
-def has_diacritics(text):
+# Reference implementation of has_diacritics(), used by tr_reference().
+def has_diacritics_reference(text):
   for sub in has_diacritics_subs:
     text = rsub(text, sub[0], sub[1])
   return len(text) == 0
 
+# Compiled regexes and tables used by has_diacritics().
+hd_punctuation_table = char_translation_table(
+  dict([(c, "") for c in punctuation + "\u0651"] + [("-", " "), ("–", " ")]))
+hd_final_consonant_re = re.compile("[" + lconsonants + "]$")
+hd_consonant_before_space_re = re.compile("[" + lconsonants + "]\\s")
+hd_consonant_before_diacritic_re = re.compile(
+  "[" + lconsonants + "\u0627]([\u064B\u064C\u064D\u064E\u064F\u0650\u0652\u0670])")
+hd_fatha_alif_re = re.compile("[\u064B\u064E][\u0627\u0649]")
+hd_diacritic_number_table = char_translation_table(
+  dict((c, "") for c in "\u064B\u064C\u064D\u064E\u064F\u0650\u0652\u0670" + numbers + "ٱ" + "آ"))
+hd_non_arabic_re = re.compile(
+  "[^\u0600-\u06FF\u0750-\u077F\u08A1-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]")
+
+# Return true if TEXT is fully vocalized. This does the same as
+# has_diacritics_reference() but with precompiled regexes, str.translate() for
+# the substitutions of single characters and str.replace() for those of fixed
+# strings; see has_diacritics_subs for comments on the individual steps.
+def has_diacritics(text):
+  text = text.translate(hd_punctuation_table)
+  text = hd_final_consonant_re.sub("", text)
+  text = hd_consonant_before_space_re.sub(" ", text)
+  text = hd_consonant_before_diacritic_re.sub("\\1", text)
+  text = text.replace("\u064F\u0648", "")
+  text = text.replace("\u0650\u064A", "")
+  text = hd_fatha_alif_re.sub("", text)
+  text = text.translate(hd_diacritic_number_table)
+  text = hd_non_arabic_re.sub("", text)
+  return len(text) == 0
+
 
 ############################################################################
 #           Transliterate from Latin to Arabic           #
@@ -557,6 +708,9 @@ for alt in build_canonicalize_latin:
   if canon != "multiple":
     tt_canonicalize_latin[alt] = canon
 
+# str.translate() version of tt_canonicalize_latin.
+tt_canonicalize_latin_table = char_translation_table(tt_canonicalize_latin)
+
 # A list of Latin characters that are allowed to have particular unmatched
 # Arabic characters following. This is used to allow short Latin vowels
 # to correspond to long Arabic vowels. The value is the list of possible
@@ -775,7 +929,7 @@ def canonicalize_latin_arabic(latin, arabic, msgfun=msg):
     def quote_subst(m):
       return m.group(0).replace("'", multi_single_quote_subst)
     latin = re.sub(r"''+", quote_subst, latin)
-    latin = rsub(latin, ".", tt_canonicalize_latin)
+    latin = latin.translate(tt_canonicalize_latin_table)
     latin_chars = "[a-zA-Zāēīōūčḍḏḡḥḵṣšṭṯẓžʿʾ]"
     # Convert 3 to ʿ if next to a letter or letter symbol. This tries
     # to avoid converting 3 in numbers.
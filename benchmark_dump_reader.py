@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmark the pull-based dump reader used by blib.parse_dump() against the older xml.sax-based reader, checking that
+# both return the same pages. Use either an existing dump (--dump, plain or .bz2) or a synthetic fixture dump
+# (--synthetic NUM-PAGES), which is written to a temporary file.
+
+import blib
+from blib import msg
+
+import argparse, os, tempfile, time
+
+def write_synthetic_dump(fp, num_pages):
+  langs = ["English", "Latin", "Russian", "Italian", "Spanish"]
+  fp.write('<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">\n')
+  fp.write('  <siteinfo>\n    <sitename>Wiktionary</sitename>\n  </siteinfo>\n')
+  for i in range(1, num_pages + 1):
+    ns = 10 if i % 20 == 0 else 0
+    title = "Template:test %s" % i if ns == 10 else "word &amp; %s" % i
+    sections = []
+    for j in range(1 + i % 3):
+      lang = langs[(i + j) % len(langs)]
+      sections.append(
+        "==%s==\n\n===Etymology===\n{{der|la|grc|λόγος}} &lt;ref&gt;&quot;x&quot;&lt;/ref&gt;\n\n===Noun===\n"
+        "{{head|xx|noun}}\n\n# {{l|en|word}} %s\n\n[[Category:Test %s]]\n" % (lang, i, j))
+    text = "\n----\n\n".join(sections)
+    fp.write("  <page>\n    <title>%s</title>\n    <ns>%s</ns>\n    <id>%s</id>\n    <revision>\n"
+      "      <id>%s</id>\n      <model>wikitext</model>\n      <format>text/x-wiki</format>\n"
+      '      <text bytes="%s" xml:space="preserve">%s</text>\n    </revision>\n  </page>\n' % (
+        title, ns, i, 100000 + i, len(text), text))
+  fp.write("</mediawiki>\n")
+
+def read_pages(filename, use_sax, text_prefilter=None):
+  pages = []
+  def process_page(index, title, text):
+    pages.append((index, title, text))
+  with blib.open_dump(filename) as fp:
+    tstart = time.time()
+    blib.parse_dump(fp, process_page, use_sax=use_sax, text_prefilter=text_prefilter)
+    elapsed = time.time() - tstart
+  return pages, elapsed
+
+parser = argparse.ArgumentParser(description="Benchmark blib dump readers.")
+parser.add_argument("--dump", help="Dump file to read (plain XML or .bz2).")
+parser.add_argument("--synthetic", type=int, help="Number of pages in a synthetic fixture dump to generate.")
+parser.add_argument("--only-lang", help="Also benchmark prefiltering on this language (e.g. 'Latin').")
+args = parser.parse_args()
+
+if not args.dump and not args.synthetic:
+  raise ValueError("One of --dump or --synthetic must be given")
+
+tempname = None
+if args.dump:
+  filename = args.dump
+else:
+  fd, tempname = tempfile.mkstemp(suffix=".xml")
+  with os.fdopen(fd, "w", encoding="utf-8") as fp:
+    write_synthetic_dump(fp, args.synthetic)
+  filename = tempname
+
+try:
+  sax_pages, sax_elapsed = read_pages(filename, use_sax=True)
+  new_pages, new_elapsed = read_pages(filename, use_sax=False)
+  msg("SAX reader: %s pages in %.2f secs (%.1f pages/sec)" % (
+    len(sax_pages), sax_elapsed, len(sax_pages) / sax_elapsed if sax_elapsed else 0.0))
+  msg("Pull-based reader: %s pages in %.2f secs (%.1f pages/sec)" % (
+    len(new_pages), new_elapsed, len(new_pages) / new_elapsed if new_elapsed else 0.0))
+  if new_elapsed:
+    msg("Speedup: %.2fx" % (sax_elapsed / new_elapsed))
+  if sax_pages != new_pages:
+    for sax_page, new_page in zip(sax_pages, new_pages):
+      if sax_page != new_page:
+        msg("WARNING: Readers differ: SAX page %s %s, pull-based page %s %s" % (
+          sax_page[0], sax_page[1], new_page[0], new_page[1]))
+        break
+    else:
+      msg("WARNING: Readers returned different numbers of pages")
+  else:
+    msg("Both readers returned identical pages")
+  if args.only_lang:
+    text_prefilter = "==%s==" % args.only_lang
+    filtered_pages, filtered_elapsed = read_pages(filename, use_sax=False, text_prefilter=text_prefilter)
+    expected_pages = [page for page in sax_pages if text_prefilter in page[2]]
+    msg("Pull-based reader with prefilter '%s': %s pages in %.2f secs" % (
+      text_prefilter, len(filtered_pages), filtered_elapsed))
+    if filtered_pages != expected_pages:
+      msg("WARNING: Prefiltered pages differ from filtering the SAX output")
+finally:
+  if tempname:
+    os.unlink(tempname)
@@ -5,7 +5,7 @@
 import re
 import unicodedata
 
-from blib import remove_links, msg
+from blib import remove_links, msg, char_translation_table
 
 # FIXME:
 # 1. Converts grave-и to и with both acute and grave.
@@ -49,9 +49,9 @@ tt = {
 
 bulgarian_vowels = "АОУЯЮИЕЪЬѢѪаоуяюиеъьѣѫAEIOUĚǪaeiouěǫʹ"
 
-# Transliterates text, which should be a single word or phrase. It should
-# include stress marks, which are then preserved in the transliteration.
-def tr(text, lang=None, sc=None, msgfun=msg):
+# Reference implementation of tr(), which tr() below must agree with; used by
+# check_translit_fast_paths.py to check the compiled version and time it.
+def tr_reference(text, lang=None, sc=None, msgfun=msg):
     text = remove_links(text)
     text = tr_canonicalize_bulgarian(text)
 
@@ -68,6 +68,36 @@ def tr(text, lang=None, sc=None, msgfun=msg):
 
     return text
 
+# Compiled regexes and tables used by tr().
+tr_final_hard_sign_re = re.compile("[Ъъ]($|[- \]])")
+tr_soft_sign_before_o_re = re.compile("ь(?=[Оо])")
+tr_capital_soft_sign_before_o_re = re.compile("Ь(?=[Оо])")
+tr_latin_accent_re = re.compile("[aeiouyAEIOUY][" + AC + GR + "]")
+tt_table = char_translation_table(tt)
+
+# Transliterates text, which should be a single word or phrase. It should
+# include stress marks, which are then preserved in the transliteration.
+# This does the same as tr_reference() but with precompiled regexes and
+# str.translate() in place of a per-character rsub().
+def tr(text, lang=None, sc=None, msgfun=msg):
+    text = remove_links(text)
+    text = tr_canonicalize_bulgarian(text)
+
+    # Remove word-final hard sign
+    text = tr_final_hard_sign_re.sub(r"\1", text)
+
+    # ьо becomes jo, Ьо becomes Jo
+    text = tr_soft_sign_before_o_re.sub(r"j", text)
+    text = tr_capital_soft_sign_before_o_re.sub(r"J", text)
+    text = text.translate(tt_table)
+
+    # compose accented characters
+    if AC in text or GR in text:
+        text = tr_latin_accent_re.sub(
+            lambda m: tr_latin_accent_tab.get(m.group(0), m.group(0)), text)
+
+    return text
+
 ############################################################################
 #                    Transliterate from Latin to Bulgarian                 #
 ############################################################################
@@ -397,6 +427,9 @@ for frm, to in build_canonicalize_latin.items():
     if to != "multiple":
         tt_canonicalize_latin[frm] = to
 
+# str.translate() version of tt_canonicalize_latin.
+tt_canonicalize_latin_table = char_translation_table(tt_canonicalize_latin)
+
 if debug_tables:
     for x,y in build_canonicalize_latin.items():
         msg("%s = %s" % (x, y))
@@ -501,17 +534,21 @@ def pre_canonicalize_latin(text, bulgarian=None, msgfun=msg):
     debprint("pre_canonicalize_latin: Exit, text=%s" % text)
     return text
 
+# Composed equivalents of vowels followed by an acute or grave accent.
+tr_latin_accent_tab = {
+    "a"+AC:"á", "e"+AC:"é", "i"+AC:"í",
+    "o"+AC:"ó", ""+AC:"ú", "y"+AC:"ý", "n"+AC:"ń",
+    "A"+AC:"Á", "E"+AC:"É", "I"+AC:"Í",
+    "O"+AC:"Ó", "U"+AC:"Ú", "Y"+AC:"Ý", "N"+AC:"Ń",
+    "a"+GR:"à", "e"+GR:"è", "i"+GR:"ì",
+    "o"+GR:"ò", ""+GR:"ù", "y"+GR:"ỳ",
+    "A"+GR:"À", "E"+GR:"È", "I"+GR:"Ì",
+    "O"+GR:"Ò", "U"+GR:"Ù", "Y"+GR:"Ỳ",
+}
+
 def tr_canonicalize_latin(text):
     # recompose accented letters
-    text = rsub(text, "[aeiouyAEIOUY][" + AC + GR + "]",
-        {"a"+AC:"á", "e"+AC:"é", "i"+AC:"í",
-         "o"+AC:"ó", ""+AC:"ú", "y"+AC:"ý", "n"+AC:"ń",
-         "A"+AC:"Á", "E"+AC:"É", "I"+AC:"Í",
-         "O"+AC:"Ó", "U"+AC:"Ú", "Y"+AC:"Ý", "N"+AC:"Ń",
-         "a"+GR:"à", "e"+GR:"è", "i"+GR:"ì",
-         "o"+GR:"ò", ""+GR:"ù", "y"+GR:"ỳ",
-         "A"+GR:"À", "E"+GR:"È", "I"+GR:"Ì",
-         "O"+GR:"Ò", "U"+GR:"Ù", "Y"+GR:"Ỳ",})
+    text = rsub(text, "[aeiouyAEIOUY][" + AC + GR + "]", tr_latin_accent_tab)
 
     return text
 
@@ -549,7 +586,7 @@ def canonicalize_latin_bulgarian(latin, bulgarian, msgfun=msg):
         def quote_subst(m):
             return m.group(0).replace("'", multi_single_quote_subst)
         latin = re.sub(r"''+", quote_subst, latin)
-        latin = rsub(latin, ".", tt_canonicalize_latin)
+        latin = latin.translate(tt_canonicalize_latin_table)
         latin = latin.replace(multi_single_quote_subst, "'")
         latin = post_canonicalize_latin(latin, msgfun)
     return (latin, bulgarian)
@@ -3,16 +3,98 @@
 
 # Author: Benwing; bits and pieces taken from code written by CodeCat/Rua for MewBot
 
-import pywikibot, mwparserfromhell, re, string, sys, urllib, datetime, json, argparse, time
-from collections import defaultdict
+import mwparserfromhell, re, string, sys, urllib, datetime, json, argparse, time
+import io, contextlib, bz2, html, os, struct, zlib, mmap, sqlite3, pickle
+from collections import defaultdict, deque
 import xml.sax
 import difflib
 import traceback
 import unicodedata
 import multiprocessing as mp
+import threading, queue, atexit, importlib, random, itertools
+import cProfile, pstats, heapq, fcntl
+import concurrent.futures
 from json.decoder import JSONDecodeError
 
-site = pywikibot.Site()
+# Error raised on attempts to access the server in offline mode.
+class OfflineError(Exception):
+  pass
+
+# If set (using --offline or the BLIB_OFFLINE environment variable), any attempt to access the server raises an
+# OfflineError rather than connecting; this is useful for scripts processing dumps or find_regex.py output, which
+# should never need the server.
+offline = bool(os.environ.get("BLIB_OFFLINE"))
+
+# A module imported the first time one of its attributes is accessed. Pywikibot takes a significant fraction of a
+# second to import and configure itself, which is wasted when processing pages from stdin or a dump.
+class LazyModule(object):
+  def __init__(self, name):
+    self._lazy_name = name
+    self._lazy_module = None
+    self._lazy_on_import = []
+
+  # Call `fun` once the module has been imported.
+  def on_import(self, fun):
+    if self._lazy_module is None:
+      self._lazy_on_import.append(fun)
+    else:
+      fun()
+
+  def __getattr__(self, attr):
+    if self._lazy_module is None:
+      self._lazy_module = importlib.import_module(self._lazy_name)
+      for fun in self._lazy_on_import:
+        fun()
+    return getattr(self._lazy_module, attr)
+
+pywikibot = LazyModule("pywikibot")
+
+# Stand-in for the pywikibot Site object, which creates the site (logging in if necessary) the first time it's actually
+# used, rather than when blib is imported. Scripts can continue to do `from blib import site` and pass `site` to
+# pywikibot functions: attribute accesses, comparisons and isinstance() checks are passed on to the real site.
+class LazySite(object):
+  def __init__(self):
+    object.__setattr__(self, "_site", None)
+
+  def _get_site(self):
+    real_site = object.__getattribute__(self, "_site")
+    if real_site is None:
+      if offline:
+        raise OfflineError("Attempt to access the server in offline mode")
+      real_site = pywikibot.Site()
+      object.__setattr__(self, "_site", real_site)
+    return real_site
+
+  def __getattr__(self, attr):
+    return getattr(self._get_site(), attr)
+
+  def __setattr__(self, attr, value):
+    setattr(self._get_site(), attr, value)
+
+  @property
+  def __class__(self):
+    return self._get_site().__class__
+
+  def __eq__(self, other):
+    if type(other) is LazySite:
+      other = other._get_site()
+    return self._get_site() == other
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return hash(self._get_site())
+
+  def __str__(self):
+    return str(self._get_site())
+
+  def __repr__(self):
+    if object.__getattribute__(self, "_site") is None:
+      return "LazySite()"
+    return repr(self._get_site())
+
+site = LazySite()
 
 appendix_only_langnames = [
   "Adûni",
@@ -149,6 +231,12 @@ def remove_redundant_links(text):
   # remove redundant link surrounding entire text
   return re.sub(r"^\[\[([^\[\]|]*)\]\]$", r"\1", text)
 
+# Convert a dictionary mapping characters to replacement strings, as used with rsub(text, ".", TABLE) in the
+# transliteration modules, into a table for str.translate(), which does the same thing much faster. Multicharacter
+# keys are dropped because they can never match "."; so is newline, which "." doesn't match.
+def char_translation_table(table):
+  return str.maketrans({k: v for k, v in table.items() if len(k) == 1 and k != "\n"})
+
 def escape_newline(text):
   text = re.sub(r"\\([\\n])", lambda m: r"\\\\" if m.group(1) == "\\" else r"\\n", text)
   return text.replace("\n", r"\n")
@@ -158,6 +246,8 @@ def undo_escape_newline(text):
 
 def msg(text):
   print(text)
+  if event_log is not None:
+    event_log.log_message(text)
 
 def msgn(text):
   print(text, end='', flush=True)
@@ -188,11 +278,135 @@ def ucfirst(txt):
     return txt
   return txt[0].upper() + txt[1:]
 
-def parse_text(text):
-  return mwparserfromhell.parser.Parser().parse(text, skip_style_tags=True)
+# Cache of parse trees used by parse_text(text, cached=True) while a page is being processed (see page_parse_cache()),
+# so that callers parsing the same text don't each do a full parse. The cache is None when not processing a page. A
+# cache hit returns the same tree object to every caller passing `cached=True`, so such a caller must either not modify
+# the tree or be finished with any use of it by earlier callers (as with parse() and then process_one_page_links()
+# within `process`). A cached tree is reused only if it still converts back to exactly the same text, so a tree that
+# has been modified in place is never handed out again. Copying the tree on a hit isn't done since it is slower than
+# parsing again. Without `cached=True`, parse_text() always returns a fresh tree (and doesn't add it to the cache).
+parse_cache = None
+parse_cache_max_size = 8
+# Similar cache of the results of split_text_into_sections(), keyed by text.
+section_split_cache = None
+parse_cache_stats = {"hits": 0, "misses": 0}
+
+def parse_text(text, cached=False):
+  cached = cached and parse_cache is not None
+  if cached:
+    parsed = parse_cache.get(text)
+    if parsed is not None and str(parsed) == text:
+      parse_cache_stats["hits"] += 1
+      return parsed
+    parse_cache_stats["misses"] += 1
+  with metrics_phase("parse_text"):
+    parsed = mwparserfromhell.parser.Parser().parse(text, skip_style_tags=True)
+  if cached:
+    if len(parse_cache) >= parse_cache_max_size:
+      parse_cache.clear()
+    parse_cache[text] = parsed
+  return parsed
+
+# Context manager within which parse_text(text, cached=True) reuses the parse trees of identical texts and
+# split_text_into_sections() (and hence find_modifiable_lang_section() and find_lang_section()) reuses the split of
+# identical texts. do_pagefile_cats_refs() uses this around the processing of each page. Nested uses (e.g. for a
+# page fetched using Pywikibot and then processed as text) keep using the outer caches.
+@contextlib.contextmanager
+def page_parse_cache():
+  global parse_cache, section_split_cache
+  if parse_cache is not None:
+    yield
+    return
+  old_parse_cache, old_section_split_cache = parse_cache, section_split_cache
+  parse_cache = {}
+  section_split_cache = {}
+  try:
+    yield
+  finally:
+    parse_cache, section_split_cache = old_parse_cache, old_section_split_cache
 
+# Parse the text of `page`, using the per-page parse cache (see parse_text()). do_edit() uses this to make the `parsed`
+# argument passed to `process`, which is often ignored in favor of parsing the text passed in, so that parse is
+# normally a cache hit.
 def parse(page):
-  return parse_text(page.text)
+  with metrics_phase("fetch"):
+    text = page.text
+  return parse_text(text, cached=True)
+
+# Fast check for which of a set of templates can occur in a text, used to skip parsing texts that can't contain any
+# template of interest. `names` is a list of template names; `aliases` is an optional dictionary mapping alternative
+# names (e.g. redirects) to names in `names`. If `include_redirects` is given, redirects to the templates are also
+# fetched from the server and treated as aliases. The scan uses a single precompiled regex, which matches template names
+# as MediaWiki does (first letter case-insensitive, spaces and underscores equivalent, optional "Template:",
+# "subst:" or "safesubst:" prefix). It errs on the side of reporting templates: a text whose templates have names
+# built from other templates or parameters is reported as possibly containing all of them.
+class TemplatePrefilter(object):
+  def __init__(self, names, aliases=None, include_redirects=False):
+    self.canonical = {name: name for name in names}
+    if aliases:
+      self.canonical.update(aliases)
+    if include_redirects:
+      given_names = {self.normalize_name(name): name for name in names}
+      for redirect, target in template_redirects(names).items():
+        self.canonical[redirect] = given_names.get(self.normalize_name(target), target)
+    self.by_normalized_name = {}
+    for name, canonical in self.canonical.items():
+      self.by_normalized_name[self.normalize_name(name)] = canonical
+    alternatives = [self.name_regex(name) for name in sorted(self.canonical, key=lambda name: -len(name))]
+    self.regex = re.compile(
+      r"\{\{\s*(?:(?:safe)?subst:\s*)?(?:[Tt]emplate\s*:\s*)?(%s)(?=\s*(?:\||\}\}|<!--|\Z))" %
+      "|".join(alternatives))
+    self.dynamic_name_regex = re.compile(r"\{\{\s*(?:(?:safe)?subst:\s*)?(?:[Tt]emplate\s*:\s*)?\{")
+
+  @staticmethod
+  def normalize_name(name):
+    name = re.sub("[ _]+", " ", name.strip())
+    return name[:1].upper() + name[1:]
+
+  @staticmethod
+  def name_regex(name):
+    name = re.sub("[ _]+", " ", name.strip())
+    first = name[:1]
+    rest = re.sub(r"\\ ", "[ _]+", re.escape(name[1:]))
+    if first.upper() != first.lower():
+      return "[%s%s]%s" % (re.escape(first.upper()), re.escape(first.lower()), rest)
+    return re.escape(first) + rest
+
+  # Return True if any of the templates can occur in `text`.
+  def matches(self, text):
+    if "{{" not in text:
+      return False
+    return bool(self.regex.search(text) or self.dynamic_name_regex.search(text))
+
+  # Return the set of names in `names` (the canonical names of any aliases found) of the templates that can occur in
+  # `text`.
+  def scan(self, text):
+    if "{{" not in text:
+      return set()
+    if self.dynamic_name_regex.search(text):
+      return set(self.canonical.values())
+    return set(self.by_normalized_name[self.normalize_name(m.group(1))] for m in self.regex.finditer(text))
+
+# Return a dictionary mapping the names of the redirects to the templates named in `names` to the name of the
+# template they redirect to.
+def template_redirects(names):
+  redirects = {}
+  names = list(names)
+  for i in range(0, len(names), 50):
+    batch = names[i:i + 50]
+    params = {"action": "query", "prop": "redirects", "rdnamespace": 10, "rdlimit": "max", "formatversion": 2,
+              "titles": "|".join("Template:" + name for name in batch)}
+    while True:
+      data = try_repeatedly(lambda: pywikibot.data.api.Request(site=site, parameters=params).submit(), errandmsg,
+                            "fetch redirects to %s" % ",".join(batch))
+      for page in data["query"].get("pages", []):
+        target = re.sub("^Template:", "", page["title"])
+        for redirect in page.get("redirects", []):
+          redirects[re.sub("^Template:", "", redirect["title"])] = target
+      if "continue" not in data:
+        break
+      params.update(data["continue"])
+  return redirects
 
 def getparam(template, param):
   if template.has(param):
@@ -499,23 +713,209 @@ def changelog_to_string(comment, comment_tag=None):
     return comment + comment_suffix
   return comment
 
+# SequenceMatcher whose opcodes are computed by comparing lines by their integer IDs (assigned so that equal lines
+# have the same ID) after removing the common leading and trailing lines, which are typically almost all of a page.
+# SequenceMatcher's running time depends on how often the lines of one text recur in the other; if the number of
+# pairs of equal lines in the remaining lines (not counting lines too frequent to be considered) is more than
+# `max_work`, which takes several seconds to compare, it gives up and treats the remaining lines as a single
+# replacement.
+class LineHashMatcher(difflib.SequenceMatcher):
+  def __init__(self, a, b, max_work=10**7):
+    self.a = a
+    self.b = b
+    self.max_work = max_work
+    self.gave_up = False
+    self.opcodes = None
+
+  def get_opcodes(self):
+    if self.opcodes is not None:
+      return self.opcodes
+    line_ids = {}
+    a_ids = [line_ids.setdefault(line, len(line_ids)) for line in self.a]
+    b_ids = [line_ids.setdefault(line, len(line_ids)) for line in self.b]
+    prefix = 0
+    max_prefix = min(len(a_ids), len(b_ids))
+    while prefix < max_prefix and a_ids[prefix] == b_ids[prefix]:
+      prefix += 1
+    suffix = 0
+    max_suffix = max_prefix - prefix
+    while suffix < max_suffix and a_ids[-1 - suffix] == b_ids[-1 - suffix]:
+      suffix += 1
+    a_end = len(a_ids) - suffix
+    b_end = len(b_ids) - suffix
+    opcodes = []
+    if prefix:
+      opcodes.append(("equal", 0, prefix, 0, prefix))
+    if self.estimate_work(a_ids[prefix:a_end], b_ids[prefix:b_end]) > self.max_work:
+      self.gave_up = True
+      opcodes.append(("replace", prefix, a_end, prefix, b_end))
+    elif prefix < a_end or prefix < b_end:
+      matcher = difflib.SequenceMatcher(None, a_ids[prefix:a_end], b_ids[prefix:b_end])
+      for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        opcodes.append((tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix))
+    if suffix:
+      opcodes.append(("equal", a_end, len(a_ids), b_end, len(b_ids)))
+    self.opcodes = opcodes
+    return opcodes
+
+  @staticmethod
+  def estimate_work(a_ids, b_ids):
+    counts = defaultdict(int)
+    for line_id in b_ids:
+      counts[line_id] += 1
+    # Same as SequenceMatcher's "autojunk" heuristic.
+    max_count = len(b_ids) // 100 + 1 if len(b_ids) >= 200 else len(b_ids)
+    return sum(counts[line_id] for line_id in a_ids if counts.get(line_id, 0) <= max_count)
+
+# Counts of diffs done by linehash_unified_diff() and of those where it gave up on finding the exact differences.
+diff_stats = {"diffs": 0, "gave_up": 0}
+
+# Same as difflib.unified_diff() but using LineHashMatcher, which is much faster on long texts with few changes and
+# gives up on finding the exact differences when there are very many.
+def linehash_unified_diff(a, b, n=3, max_work=10**7):
+  matcher = LineHashMatcher(a, b, max_work=max_work)
+  diff_stats["diffs"] += 1
+  started = False
+  for group in matcher.get_grouped_opcodes(n):
+    if not started:
+      started = True
+      yield "--- \n"
+      yield "+++ \n"
+    first, last = group[0], group[-1]
+    yield "@@ -%s +%s @@\n" % (difflib._format_range_unified(first[1], last[2]),
+                               difflib._format_range_unified(first[3], last[4]))
+    for tag, i1, i2, j1, j2 in group:
+      if tag == "equal":
+        for line in a[i1:i2]:
+          yield " " + line
+        continue
+      if tag in ("replace", "delete"):
+        for line in a[i1:i2]:
+          yield "-" + line
+      if tag in ("replace", "insert"):
+        for line in b[j1:j2]:
+          yield "+" + line
+  if matcher.gave_up:
+    diff_stats["gave_up"] += 1
+
+# Functions that can be used by show_diff() to produce a unified diff of two lists of lines; selected using
+# --diff-engine.
+diff_engines = {
+  "linehash": linehash_unified_diff,
+  "difflib": difflib.unified_diff,
+}
+diff_engine = "linehash"
+
 def show_diff(existing_text, newtext):
+  with metrics_phase("diff"):
+    do_show_diff(existing_text, newtext)
+
+def do_show_diff(existing_text, newtext):
   oldlines = existing_text.splitlines(True)
   newlines = newtext.splitlines(True)
-  diff = difflib.unified_diff(oldlines, newlines)
+  diff = diff_engines[diff_engine](oldlines, newlines)
   dangling_newline = False
+  output = []
   for line in diff:
     dangling_newline = not line.endswith('\n')
-    sys.stdout.write(line)
+    output.append(line)
     if dangling_newline:
-      sys.stdout.write("\n")
+      output.append("\n")
   if dangling_newline:
-    sys.stdout.write("\\ No newline at end of file\n")
+    output.append("\\ No newline at end of file\n")
+  output = "".join(output)
+  sys.stdout.write(output)
+  if event_log is not None:
+    event_log.log_diff(output)
   #pywikibot.showDiff(existing_text, new, context=3)
 
+# Return the ranges of `a` and `b` (lists of lines or other units) that are the same, as a list of tuples
+# (A_START, A_END, B_START) in order.
+def find_equal_ranges(a, b):
+  return [(i1, i2, j1) for tag, i1, i2, j1, j2 in LineHashMatcher(a, b).get_opcodes() if tag == "equal"]
+
+# Do a three-way merge of lists of units (e.g. lines), combining the changes made from `orig` to `edited` with those
+# made from `orig` to `current`, in the manner of diff3. Return a tuple (MERGED, CONFLICTS) where MERGED is the merged
+# list and CONFLICTS is a list of the places where both `edited` and `current` changed the same units of `orig` in
+# different ways, each a tuple (ORIG_START, ORIG_UNITS, EDITED_UNITS, CURRENT_UNITS), where ORIG_START is the index
+# in `orig` of the first unit involved. Where there are conflicts, MERGED has the units from `current`. Changes to
+# adjacent units conflict, as with diff3, unless `merge_parallel_changes` is given and both `edited` and `current`
+# replace the units one for one, in which case each unit is merged separately; this is useful when the units are
+# sections.
+def merge3(orig, edited, current, merge_parallel_changes=False):
+  edited_ranges = find_equal_ranges(orig, edited)
+  current_ranges = find_equal_ranges(orig, current)
+  # Find the ranges of `orig` unchanged in both `edited` and `current`.
+  stable = []
+  ie = ic = 0
+  while ie < len(edited_ranges) and ic < len(current_ranges):
+    e_start, e_end, e_other = edited_ranges[ie]
+    c_start, c_end, c_other = current_ranges[ic]
+    start = max(e_start, c_start)
+    end = min(e_end, c_end)
+    if start < end:
+      stable.append((start, end, e_other + start - e_start, c_other + start - c_start))
+    if e_end < c_end:
+      ie += 1
+    else:
+      ic += 1
+  stable.append((len(orig), len(orig), len(edited), len(current)))
+
+  merged = []
+  conflicts = []
+  o = e = c = 0
+  for start, end, e_start, c_start in stable:
+    orig_units = orig[o:start]
+    edited_units = edited[e:e_start]
+    current_units = current[c:c_start]
+    if edited_units == orig_units or edited_units == current_units:
+      merged.extend(current_units)
+    elif current_units == orig_units:
+      merged.extend(edited_units)
+    elif merge_parallel_changes and len(orig_units) == len(edited_units) == len(current_units):
+      for i, (orig_unit, edited_unit, current_unit) in enumerate(zip(orig_units, edited_units, current_units)):
+        if edited_unit == orig_unit or edited_unit == current_unit:
+          merged.append(current_unit)
+        elif current_unit == orig_unit:
+          merged.append(edited_unit)
+        else:
+          conflicts.append((o + i, [orig_unit], [edited_unit], [current_unit]))
+          merged.append(current_unit)
+    else:
+      conflicts.append((o, orig_units, edited_units, current_units))
+      merged.extend(current_units)
+    merged.extend(orig[start:end])
+    o = end
+    e = e_start + end - start
+    c = c_start + end - start
+  return merged, conflicts
+
+# Split `text` into units for merge_text(): lines if `granularity` is "line", or sections (each header together with
+# the text up to the next header of any level) if `granularity` is "section".
+def split_text_for_merge(text, granularity):
+  if granularity == "line":
+    return text.splitlines(True)
+  elif granularity == "section":
+    return [x for x in re.split(r"(?=^==+[^=\n]+==+[ \t]*$)", text, 0, re.M) if x]
+  else:
+    raise ValueError("Unrecognized merge granularity: %s" % granularity)
+
+# Do a three-way merge of the texts `orig`, `edited` and `current` (see merge3()), where `granularity` is "line" or
+# "section". Changes to different lines or sections are combined, while changes to the same or adjacent lines, or to
+# the same section, conflict unless they are identical. Return a tuple (MERGED, CONFLICTS) where MERGED is the
+# merged text and CONFLICTS is as for merge3() except that the units are joined into strings.
+def merge_text(orig, edited, current, granularity="line"):
+  merged, conflicts = merge3(split_text_for_merge(orig, granularity), split_text_for_merge(edited, granularity),
+                             split_text_for_merge(current, granularity),
+                             merge_parallel_changes=granularity == "section")
+  return "".join(merged), [(orig_start, "".join(orig_units), "".join(edited_units), "".join(current_units))
+                           for orig_start, orig_units, edited_units, current_units in conflicts]
+
 def normalize_text_for_save(text):
   # MediaWiki strips newlines from the end of the page and converts to NFC; we convert to NFC for comparison but we
   # can't strip newlines because we might be dealing with a partial page when using --find-regex.
+  if text.isascii() or unicodedata.is_normalized("NFC", text):
+    return text
   return unicodedata.normalize("NFC", text)
 
 def handle_process_page_retval(retval, existing_text, pagemsg, verbose, do_diff):
@@ -530,9 +930,14 @@ def handle_process_page_retval(retval, existing_text, pagemsg, verbose, do_diff)
   if new:
     new = str(new)
 
-    existing_text = normalize_text_for_save(existing_text)
-    new = normalize_text_for_save(new)
-    has_changed = existing_text != new
+    if new is existing_text or new == existing_text:
+      # Fast path for the common case of no changes; the texts are the same when normalized as well.
+      new = normalize_text_for_save(new)
+      has_changed = False
+    else:
+      existing_text = normalize_text_for_save(existing_text)
+      new = normalize_text_for_save(new)
+      has_changed = existing_text != new
     if has_changed:
       if do_diff:
         pagemsg("Diff:")
@@ -544,10 +949,177 @@ def handle_process_page_retval(retval, existing_text, pagemsg, verbose, do_diff)
   comment = changelog_to_string(comment)
   return new, comment, has_changed
 
+# Persistent cache of the results of expand_text(), stored in an SQLite database. Entries are keyed by the template call
+# and the page title it is expanded on, and record the templates and modules used in the expansion (found using
+# action=parse with prop=templates) along with their revision IDs at the time. An entry is used only if all of these
+# pages are still at the same revision, so the cache never returns results from outdated modules. The current
+# revision IDs are fetched in bulk the first time a page is needed and then reused for `revid_ttl` seconds. Error
+# results and volatile results (e.g. those depending on the current time) aren't cached. A cache miss costs two extra
+# requests (a server-side parse to find the templates and modules used, and a query of their revision IDs), so the cache
+# is only used when requested with --expand-cache, for runs where the same calls recur across runs.
+class ExpandTextCache(object):
+  def __init__(self, path, revid_ttl=3600):
+    self.path = path
+    self.revid_ttl = revid_ttl
+    self.conn = None
+    self.conn_pid = None
+    # Map from page title to (REVID, TIME FETCHED); REVID is 0 for nonexistent pages.
+    self.revids = {}
+    self.stats = {"hits": 0, "misses": 0, "outdated": 0, "uncacheable": 0}
+
+  def connect(self):
+    # Don't use a connection inherited from the parent process after a fork.
+    if self.conn is None or self.conn_pid != os.getpid():
+      dirname = os.path.dirname(self.path)
+      if dirname:
+        os.makedirs(dirname, exist_ok=True)
+      self.conn = sqlite3.connect(self.path, timeout=60)
+      self.conn_pid = os.getpid()
+      self.conn.execute("CREATE TABLE IF NOT EXISTS expansions (pagetitle TEXT, tempcall TEXT, result TEXT, deps TEXT, PRIMARY KEY (pagetitle, tempcall))")
+    return self.conn
+
+  # Return a dictionary mapping each of `titles` to the current revision ID of the page, fetching those not recently
+  # fetched in batches of 50.
+  def current_revids(self, titles):
+    now = time.time()
+    to_fetch = [title for title in titles if title not in self.revids or now - self.revids[title][1] > self.revid_ttl]
+    for i in range(0, len(to_fetch), 50):
+      batch = to_fetch[i:i + 50]
+      def do_fetch():
+        return pywikibot.data.api.Request(site=site, action="query", prop="info", titles="|".join(batch),
+                                          formatversion=2).submit()
+      data = try_repeatedly(do_fetch, errandmsg, "fetch revision IDs of %s" % ",".join(batch))
+      for title in batch:
+        self.revids[title] = (0, now)
+      for page in data["query"].get("pages", []):
+        self.revids[page["title"]] = (page.get("lastrevid", 0), now)
+    return {title: self.revids[title][0] for title in titles}
+
+  # Return the titles of the templates and modules used when expanding `tempcall` on `pagetitle`.
+  def dependencies(self, tempcall, pagetitle):
+    def do_parse():
+      return pywikibot.data.api.Request(site=site, action="parse", text=tempcall, title=pagetitle,
+                                        contentmodel="wikitext", prop="templates", formatversion=2).submit()
+    data = try_repeatedly(do_parse, errandmsg, "find templates used by: %s" % tempcall)
+    return sorted(template["title"] for template in data["parse"]["templates"])
+
+  # Return the cached expansion of `tempcall` on `pagetitle`, or None if not cached or outdated.
+  def lookup(self, tempcall, pagetitle):
+    row = self.connect().execute("SELECT result, deps FROM expansions WHERE pagetitle = ? AND tempcall = ?",
+                                 (pagetitle, tempcall)).fetchone()
+    if row is None:
+      self.stats["misses"] += 1
+      return None
+    result, deps = row
+    deps = json.loads(deps)
+    current = self.current_revids([title for title, _ in deps])
+    if any(current[title] != revid for title, revid in deps):
+      self.stats["outdated"] += 1
+      return None
+    self.stats["hits"] += 1
+    return result
+
+  # Expand `tempcall` on `pagetitle` and store the result in the cache if possible. Return the same value as
+  # site.expand_text().
+  def expand_and_store(self, tempcall, pagetitle, pagemsg):
+    def do_expand():
+      data = pywikibot.data.api.Request(site=site, action="expandtemplates", text=tempcall, title=pagetitle,
+                                        prop="wikitext|volatile", formatversion=2).submit()
+      return data["expandtemplates"]["wikitext"], data["expandtemplates"].get("volatile", False)
+    retval = try_repeatedly(do_expand, pagemsg, "expand text: %s" % tempcall, bad_value_ret=None)
+    if retval is None:
+      return '<strong class="error">Invalid title</strong>'
+    result, volatile = retval
+    if volatile or result.startswith('<strong class="error">'):
+      self.stats["uncacheable"] += 1
+      return result
+    self.store([(tempcall, result)], pagetitle, self.dependencies(tempcall, pagetitle))
+    return result
+
+  # Store the expansions in `tempcalls_results`, a list of (TEMPCALL, RESULT) tuples expanded on `pagetitle`, along
+  # with `deps`, the titles of the templates and modules used.
+  def store(self, tempcalls_results, pagetitle, deps):
+    revids = self.current_revids(deps)
+    deps = json.dumps([[title, revids[title]] for title in deps])
+    conn = self.connect()
+    conn.executemany("INSERT OR REPLACE INTO expansions VALUES (?, ?, ?, ?)",
+                     [(pagetitle, tempcall, result, deps) for tempcall, result in tempcalls_results])
+    conn.commit()
+
+# The ExpandTextCache used by expand_text(), if any, set using --expand-cache. The location defaults to
+# `default_expand_cache_path` and can be changed using --expand-cache-file or the BLIB_EXPAND_CACHE environment
+# variable.
+default_expand_cache_path = (os.environ.get("BLIB_EXPAND_CACHE") or
+                             os.path.join(os.path.expanduser("~"), ".cache", "blib", "expand_text.sqlite3"))
+expand_text_cache = None
+
+def start_expand_cache(path=None):
+  global expand_text_cache
+  expand_text_cache = ExpandTextCache(path or default_expand_cache_path)
+
+# Local Scribunto backend (a scribunto.LocalScribunto) used by expand_text() to expand calls without contacting the
+# server, set using --local-lua. Calls that can't be expanded locally, or whose local expansion is an error, are
+# expanded by the server. If `local_lua_parity` is set (--local-lua-parity), calls are also expanded by the server and
+# a warning is output if the local expansion differs.
+local_lua_backend = None
+local_lua_parity = False
+local_lua_stats = {"local": 0, "fallback": 0, "parity_mismatches": 0}
+
+def start_local_lua(module_dirs=None, page_store=None, parity=False):
+  global local_lua_backend, local_lua_parity
+  import scribunto
+  local_lua_backend = scribunto.LocalScribunto(module_dirs=module_dirs, page_store=page_store)
+  local_lua_parity = parity
+
+# Try to expand `tempcall` on `pagetitle` using the local Scribunto backend. Return the raw result, or None if the
+# call should be expanded by the server.
+def expand_text_locally(tempcall, pagetitle, pagemsg, verbose):
+  import scribunto
+  try:
+    result = local_lua_backend.expand_text(tempcall, pagetitle)
+  except scribunto.LocalExpansionUnsupported as e:
+    if verbose:
+      pagemsg("Can't expand locally, using server: %s" % e)
+    local_lua_stats["fallback"] += 1
+    return None
+  if result.startswith('<strong class="error">'):
+    if verbose:
+      pagemsg("Got error expanding locally, using server: %s" % result)
+    local_lua_stats["fallback"] += 1
+    return None
+  local_lua_stats["local"] += 1
+  return result
+
 def expand_text(tempcall, pagetitle, pagemsg, verbose, suppress_errors=False):
+  with metrics_phase("expand_text"):
+    return do_expand_text(tempcall, pagetitle, pagemsg, verbose, suppress_errors=suppress_errors)
+
+def do_expand_text(tempcall, pagetitle, pagemsg, verbose, suppress_errors=False):
   if verbose:
     pagemsg("Expanding text: %s" % tempcall)
-  result = try_repeatedly(lambda: site.expand_text(tempcall, title=pagetitle), pagemsg, "expand text: %s" % tempcall, bad_value_ret='<strong class="error">Invalid title</strong>')
+  result = None
+  local_result = None
+  if local_lua_backend is not None:
+    local_result = expand_text_locally(tempcall, pagetitle, pagemsg, verbose)
+    if local_result is not None and not local_lua_parity:
+      return check_expand_text_result(tempcall, local_result, pagemsg, verbose, suppress_errors)
+  if expand_text_cache is not None:
+    result = expand_text_cache.lookup(tempcall, pagetitle)
+    if result is None:
+      result = expand_text_cache.expand_and_store(tempcall, pagetitle, pagemsg)
+    elif verbose:
+      pagemsg("Using cached expansion")
+  else:
+    result = try_repeatedly(lambda: site.expand_text(tempcall, title=pagetitle), pagemsg, "expand text: %s" % tempcall, bad_value_ret='<strong class="error">Invalid title</strong>')
+  if local_result is not None and local_result != result:
+    local_lua_stats["parity_mismatches"] += 1
+    pagemsg("WARNING: Local expansion of %s differs from server expansion:\n%s" % (tempcall,
+      "\n".join(difflib.unified_diff(result.split("\n"), local_result.split("\n"), "server", "local", lineterm=""))))
+  return check_expand_text_result(tempcall, result, pagemsg, verbose, suppress_errors)
+
+# Convert the raw result of expanding `tempcall` into the return value of expand_text(): False (after outputting a
+# warning unless `suppress_errors`) if the expansion is an error, otherwise the expansion itself.
+def check_expand_text_result(tempcall, result, pagemsg, verbose, suppress_errors=False):
   if verbose:
     pagemsg("Raw result is %s" % result)
   if result.startswith('<strong class="error">'):
@@ -559,6 +1131,99 @@ def expand_text(tempcall, pagetitle, pagemsg, verbose, suppress_errors=False):
     return False
   return result
 
+# Counts of calls and requests made by expand_many(), reported by elapsed_time().
+expand_many_stats = {"calls": 0, "requests": 0}
+
+# Separator placed between the calls expanded together by expand_many(). The newlines keep each call at the beginning
+# of a line, as it is when expanded alone (this matters for templates whose output begins with *, #, :, ; or {|).
+expand_many_separator = "\nBLIB-EXPAND-MANY-SEPARATOR-6f1d3e9a2c\n"
+
+# Error output by Scribunto when the time limit for running Lua code, which applies to the whole request, runs out.
+# Calls failing this way when expanded together with others are expanded again in smaller batches.
+scribunto_timeout_error = "The time allocated for running scripts has expired"
+
+# Expand the calls in `tempcalls` (a list of template calls or other wikitext) on `pagetitle` and return a list of the
+# results, each the same as expand_text() would return for that call (False after outputting a warning, unless
+# `suppress_errors`, if the call produces an error). Rather than making one request per call, as many calls as fit
+# in a request of `max_request_size` characters (and at most `max_batch_size` calls) are joined using a separator and
+# expanded together, and the result is split back up. Calls found in the expand_text() cache aren't expanded again,
+# and the new expansions are added to the cache.
+def expand_many(tempcalls, pagetitle, pagemsg, verbose=False, suppress_errors=False, max_request_size=50000,
+    max_batch_size=200):
+  raw_results = [None] * len(tempcalls)
+  to_expand = []
+  for i, tempcall in enumerate(tempcalls):
+    if verbose:
+      pagemsg("Expanding text: %s" % tempcall)
+    if local_lua_backend is not None and not local_lua_parity:
+      raw_results[i] = expand_text_locally(tempcall, pagetitle, pagemsg, verbose)
+      if raw_results[i] is not None:
+        continue
+    if expand_text_cache is not None:
+      raw_results[i] = expand_text_cache.lookup(tempcall, pagetitle)
+      if raw_results[i] is not None:
+        if verbose:
+          pagemsg("Using cached expansion")
+        continue
+    to_expand.append(i)
+
+  def expand_batch(batch):
+    text = expand_many_separator.join(tempcalls[i] for i in batch)
+    def do_expand():
+      data = pywikibot.data.api.Request(site=site, action="expandtemplates", text=text, title=pagetitle,
+                                        prop="wikitext|volatile", formatversion=2).submit()
+      return data["expandtemplates"]["wikitext"], data["expandtemplates"].get("volatile", False)
+    with metrics_phase("expand_text"):
+      retval = try_repeatedly(do_expand, pagemsg, "expand text: %s" % text, bad_value_ret=None)
+    expand_many_stats["requests"] += 1
+    if retval is None:
+      for i in batch:
+        raw_results[i] = '<strong class="error">Invalid title</strong>'
+      return
+    result, volatile = retval
+    pieces = result.split(expand_many_separator)
+    if len(pieces) != len(batch):
+      # A call swallowed or produced a separator (e.g. an unclosed template or comment); expand the calls in halves.
+      if len(batch) == 1:
+        raw_results[batch[0]] = result
+      else:
+        expand_batch(batch[:len(batch) // 2])
+        expand_batch(batch[len(batch) // 2:])
+      return
+    timed_out = []
+    cacheable = []
+    for i, piece in zip(batch, pieces):
+      if scribunto_timeout_error in piece and len(batch) > 1:
+        timed_out.append(i)
+        continue
+      raw_results[i] = piece
+      if not volatile and not piece.startswith('<strong class="error">'):
+        cacheable.append((tempcalls[i], piece))
+    if cacheable and expand_text_cache is not None:
+      # The templates and modules used by the batch as a whole are recorded for each expansion. This may invalidate
+      # some entries unnecessarily, but saves a request per call.
+      expand_text_cache.store(cacheable, pagetitle, expand_text_cache.dependencies(text, pagetitle))
+    if timed_out:
+      for j in range(0, len(timed_out), max(1, len(batch) // 2)):
+        expand_batch(timed_out[j:j + max(1, len(batch) // 2)])
+
+  batch = []
+  batch_size = 0
+  for i in to_expand:
+    call_size = len(tempcalls[i]) + len(expand_many_separator)
+    if batch and (batch_size + call_size > max_request_size or len(batch) >= max_batch_size):
+      expand_batch(batch)
+      batch = []
+      batch_size = 0
+    batch.append(i)
+    batch_size += call_size
+  if batch:
+    expand_batch(batch)
+  expand_many_stats["calls"] += len(to_expand)
+
+  return [check_expand_text_result(tempcall, result, pagemsg, verbose, suppress_errors)
+          for tempcall, result in zip(tempcalls, raw_results)]
+
 # For use inside of expand_text in EditParams below.
 def blib_expand_text(tempcall, pagetitle, pagemsg, verbose):
   return expand_text(tempcall, pagetitle, pagemsg, verbose)
@@ -616,7 +1281,297 @@ def new_do_edit(index, page, func=None, null=False, save=False, verbose=False, d
 
     break
 
-def do_edit(page, index, func=None, null=False, save=False, verbose=False, diff=False):
+# Return True if the live revision ID of the page titled `pagetitle` is `base_revid`. Used when the text being edited
+# came from somewhere other than the live page (e.g. a page store), to avoid overwriting later changes.
+def page_has_revid(pagetitle, base_revid, errandpagemsg):
+  live_revid = try_repeatedly(lambda: pywikibot.Page(site, pagetitle).latest_revision_id, errandpagemsg,
+                              "fetch latest revision ID")
+  return live_revid == base_revid
+
+# Error messages that look like the server is overloaded or throttling us. Only used to annotate the warning logged
+# for errors that classify_exception() can't otherwise identify as throttling; such errors are not backed off for.
+save_throttle_error_regex = re.compile(
+  r"maxlag|ratelimited|Retry-After|\b50[234]\b|Service Unavailable|Bad Gateway|Gateway Time-?out|timed? ?out",
+  re.I)
+
+# Background writer used when --save-queue is given. Instead of saving inline, do_edit() adds changed pages to the
+# queue and a single writer thread saves them in order, so processing of the following pages continues while the
+# server handles each save. Saves are spaced at least 60/`edits_per_minute` seconds apart; when the server reports
+# maxlag, rate limiting or a 5xx error (see classify_exception()), the spacing is doubled (up to `max_delay` seconds)
+# and the save retried, up to `max_tries` tries in all, and it is halved again after each successful save. Other
+# errors are retried as by try_repeatedly(), up to `max_error_tries` tries in all, unless retrying won't help. If the edited text was
+# based on a known revision (`base_revid`), the save is skipped if the live page has moved on; otherwise Pywikibot's
+# own edit-conflict detection applies. At most `max_queued` saves can be pending; after that, do_edit() waits for the
+# writer.
+class SaveQueue(object):
+  def __init__(self, edits_per_minute=None, max_queued=100, max_tries=8, max_delay=300, max_error_tries=2,
+      error_sleep_time=5):
+    self.min_interval = 60.0 / edits_per_minute if edits_per_minute else 0.0
+    self.delay = self.min_interval
+    self.max_tries = max_tries
+    self.max_error_tries = max_error_tries
+    self.error_sleep_time = error_sleep_time
+    self.max_delay = max_delay
+    self.last_save_time = 0.0
+    self.counts = {"saved": 0, "conflicted": 0, "failed": 0}
+    # Titles of the pages whose last queued save failed or conflicted.
+    self.unsaved_titles = set()
+    self.queue = queue.Queue(maxsize=max_queued)
+    self.finished = True
+    self.start()
+
+  # Start the writer thread, if it isn't running. finish() is called by elapsed_time() at the end of each call of
+  # do_pagefile_cats_refs(), so the thread is started again for the saves of a later call.
+  def start(self):
+    if not self.finished:
+      return
+    self.finished = False
+    self.thread = threading.Thread(target=self.run, name="SaveQueue", daemon=True)
+    self.thread.start()
+
+  def put(self, page, index, newtext, comment, base_revid=None):
+    self.start()
+    self.queue.put((page, index, newtext, comment, base_revid))
+
+  # Call `fun` from the writer thread once the saves queued before it are done, passing False if the last save of the
+  # page titled `pagetitle` since the previous such call for it failed or was skipped because of an edit conflict, and
+  # True otherwise (including if there was no save).
+  def call_after_saves(self, fun, pagetitle):
+    def call():
+      saved = pagetitle not in self.unsaved_titles
+      self.unsaved_titles.discard(pagetitle)
+      fun(saved)
+    self.start()
+    self.queue.put(call)
+
+  def run(self):
+    while True:
+      item = self.queue.get()
+      try:
+        if item is None:
+          return
+        if callable(item):
+          item()
+          continue
+        title = str(item[0].title())
+        saved = False
+        try:
+          saved = self.save_one(*item)
+        finally:
+          if saved:
+            self.unsaved_titles.discard(title)
+          else:
+            self.unsaved_titles.add(title)
+      except Exception as e:
+        self.counts["failed"] += 1
+        errandmsg("WARNING: Save queue: Error saving page: %s" % e)
+        traceback.print_exc(file=sys.stdout)
+      finally:
+        self.queue.task_done()
+
+  # Save `page`; return True if it was saved.
+  def save_one(self, page, index, newtext, comment, base_revid):
+    title = str(page.title())
+    def pagemsg(txt):
+      msg("Page %s %s: %s" % (index, title, txt))
+    def errandpagemsg(txt):
+      errandmsg("Page %s %s: %s" % (index, title, txt))
+    num_tries = 0
+    while True:
+      wait = self.last_save_time + self.delay - time.time()
+      if wait > 0:
+        time.sleep(wait)
+      try:
+        if base_revid is not None and not page_has_revid(title, base_revid, errandpagemsg):
+          errandpagemsg("WARNING: Edit conflict: Page has changed since revision %s, which the changes were made to; not saving; would have saved with comment = %s"
+                        % (base_revid, comment))
+          self.counts["conflicted"] += 1
+          return False
+        page.text = newtext
+        with metrics_phase("save"):
+          page.save(summary=comment)
+      except KeyboardInterrupt:
+        raise
+      except pywikibot.exceptions.EditConflictError as e:
+        errandpagemsg("WARNING: Edit conflict, not saving; would have saved with comment = %s: %s" % (comment, e))
+        self.counts["conflicted"] += 1
+        return False
+      except Exception as e:
+        self.last_save_time = time.time()
+        num_tries += 1
+        category, description = classify_exception(e)
+        max_tries = self.max_tries if category == "throttle" else self.max_error_tries
+        if category == "skip" or num_tries >= max_tries:
+          errandpagemsg("WARNING: %s when trying to save page, skipping: %s" % (description, e))
+          self.counts["failed"] += 1
+          return False
+        if category == "throttle":
+          self.delay = min(max(self.delay * 2, 5.0), self.max_delay)
+          if rate_limiter is not None:
+            rate_limiter.slow_down(self.delay)
+          errandpagemsg("WARNING: Server busy or throttling when trying to save page (%s); retrying in %0.1f seconds"
+                        % (e, self.delay))
+        else:
+          delay = retry_policy.delay(num_tries, self.error_sleep_time, server_requested_delay(e))
+          errandpagemsg("WARNING: %s when trying to save page (%s); retrying in %0.1f seconds" % (description, e, delay))
+          time.sleep(delay)
+        continue
+      self.last_save_time = time.time()
+      self.delay = max(self.delay / 2, self.min_interval)
+      self.counts["saved"] += 1
+      if run_journal is not None:
+        run_journal.record_saved(page)
+      pagemsg("Saved with comment = %s" % comment)
+      return True
+
+  # Wait for all queued saves to finish, stop the writer thread and output a summary.
+  def finish(self):
+    if self.finished:
+      return
+    self.finished = True
+    pending = self.queue.qsize()
+    if pending:
+      msg("Waiting for %s queued saves to finish" % pending)
+    self.queue.put(None)
+    self.thread.join()
+    msg("Save queue: %s saved, %s skipped due to edit conflicts, %s failed" % (
+      self.counts["saved"], self.counts["conflicted"], self.counts["failed"]))
+
+# The active SaveQueue, if any; see start_save_queue().
+save_queue = None
+
+# Make do_edit() queue saves to a background writer thread instead of saving inline; see SaveQueue. Normally called
+# automatically when the arguments of a parser returned by create_argparser() are parsed and --save and --save-queue
+# are given. Queued saves are completed when elapsed_time() is called or, failing that, at exit.
+def start_save_queue(edits_per_minute=None, max_queued=100):
+  global save_queue
+  if save_queue is None:
+    save_queue = SaveQueue(edits_per_minute=edits_per_minute, max_queued=max_queued)
+    atexit.register(finish_save_queue)
+  return save_queue
+
+def finish_save_queue():
+  if save_queue is not None:
+    save_queue.finish()
+
+# Append-only journal of a run of do_pagefile_cats_refs() over pages fetched from the server, used by --journal and
+# --resume. Each line is a JSON object with a "type" key:
+#   "start": a run was started or resumed (with the command line in "argv");
+#   "listing": the (INDEX, TITLE) pairs of a category, references or prefix listing (in "items"), under "key";
+#   "done": the page at "index" titled "title" has been processed (and its save, if any, succeeded) in call number
+#     "pass" of do_pagefile_cats_refs() in the run (scripts may call it more than once over the same pages);
+#   "saved": the page titled "title" was saved, creating revision "revid".
+# When resuming, pages recorded as done in the same call of do_pagefile_cats_refs() are skipped without fetching them,
+# the listings are reused rather than fetched again from the server, and the `seen` set (with --track-seen) is restored
+# from the done pages and listings. Lines are flushed as they are written, so an interrupted run loses at most the page
+# being processed.
+class RunJournal(object):
+  def __init__(self, path, resume=False):
+    self.path = path
+    self.done = set()
+    self.listings = {}
+    self.saved_revids = {}
+    self.num_passes = 0
+    self.counts = {"skipped": 0, "listings_reused": 0}
+    self.lock = threading.Lock()
+    if resume:
+      if not os.path.exists(path):
+        raise ValueError("Journal %s to resume from doesn't exist" % path)
+      with open(path, "r", encoding="utf-8") as fp:
+        for lineno, line in enumerate(fp):
+          try:
+            entry = json.loads(line)
+          except JSONDecodeError:
+            # The last line may be incomplete if the previous run was killed while writing it.
+            errandmsg("WARNING: Ignoring malformed line %s in journal %s: %s" % (lineno + 1, path, line.rstrip("\n")))
+            continue
+          if entry["type"] == "done":
+            self.done.add((entry.get("pass", 1), entry["index"], entry["title"]))
+          elif entry["type"] == "listing":
+            self.listings[entry["key"]] = [tuple(item) for item in entry["items"]]
+          elif entry["type"] == "saved":
+            self.saved_revids[entry["title"]] = entry["revid"]
+      msg("Resuming from journal %s: %s pages done, %s saved, %s listings" % (
+        path, len(self.done), len(self.saved_revids), len(self.listings)))
+    self.fp = open(path, "a", encoding="utf-8")
+    self.write({"type": "start", "argv": sys.argv, "time": time.time()})
+
+  def write(self, entry):
+    with self.lock:
+      self.fp.write(json.dumps(entry, ensure_ascii=False) + "\n")
+      self.fp.flush()
+
+  # Start a call of do_pagefile_cats_refs(), returning its number, which identifies the pages done in it.
+  def start_pass(self):
+    self.num_passes += 1
+    return self.num_passes
+
+  def is_done(self, journal_pass, index, pagetitle):
+    return (journal_pass, index, pagetitle) in self.done
+
+  def record_done(self, journal_pass, index, pagetitle):
+    self.done.add((journal_pass, index, pagetitle))
+    self.write({"type": "done", "pass": journal_pass, "index": index, "title": pagetitle})
+
+  def record_saved(self, page):
+    try:
+      revid = page.latest_revision_id
+    except Exception:
+      revid = None
+    pagetitle = str(page.title())
+    self.saved_revids[pagetitle] = revid
+    self.write({"type": "saved", "title": pagetitle, "revid": revid})
+
+  # Return the (INDEX, TITLE) pairs recorded for the listing identified by `key` (a JSON-serializable value), or None.
+  def listing(self, key):
+    return self.listings.get(json.dumps(key))
+
+  def record_listing(self, key, items):
+    key = json.dumps(key)
+    self.listings[key] = items
+    self.write({"type": "listing", "key": key, "items": items})
+
+  # Titles of the pages done in call number `journal_pass` of do_pagefile_cats_refs() in previous runs, used to
+  # restore the `seen` set.
+  def seen_titles(self, journal_pass):
+    return set(pagetitle for done_pass, _, pagetitle in self.done if done_pass == journal_pass)
+
+  # Whether any pages were done in call number `journal_pass` of do_pagefile_cats_refs() in previous runs.
+  def has_done(self, journal_pass):
+    return any(done_pass == journal_pass for done_pass, _, _ in self.done)
+
+# The active RunJournal, if any; see start_run_journal().
+run_journal = None
+
+# Start writing a journal of the pages processed to `path`, first reading the entries written by a previous run if
+# `resume`; see RunJournal. Normally called automatically when the arguments of a parser returned by create_argparser()
+# are parsed and --journal or --resume is given.
+def start_run_journal(path, resume=False):
+  global run_journal
+  if run_journal is None:
+    run_journal = RunJournal(path, resume=resume)
+  return run_journal
+
+# Stand-in for a SaveQueue in the worker processes used by --parallel, collecting the saves that do_edit() would do
+# as (PAGETITLE, INDEX, NEWTEXT, COMMENT, BASE_REVID) tuples so that they can be done by the main process.
+class CollectedSaves(list):
+  def put(self, page, index, newtext, comment, base_revid=None):
+    if base_revid is None:
+      # Record the revision the changes were made to, so the main process can check that the page hasn't changed in
+      # the meantime. This is normally already loaded along with the text. Nonexistent pages have no revision.
+      try:
+        base_revid = page.latest_revision_id
+      except pywikibot.exceptions.NoPageError:
+        base_revid = None
+    self.append((str(page.title()), index, newtext, comment, base_revid))
+
+# If `base_revid` is given, `page.text` has been set from a local copy of the page at that revision (e.g. from a page
+# store), and the page is only saved if the live page is still at that revision.
+def do_edit(page, index, func=None, null=False, save=False, verbose=False, diff=False, base_revid=None):
+  with metrics_page():
+    do_edit_1(page, index, func=func, null=null, save=save, verbose=verbose, diff=diff, base_revid=base_revid)
+
+def do_edit_1(page, index, func=None, null=False, save=False, verbose=False, diff=False, base_revid=None):
   title = str(page.title())
   def pagemsg(txt):
     msg("Page %s %s: %s" % (index, title, txt))
@@ -627,14 +1582,22 @@ def do_edit(page, index, func=None, null=False, save=False, verbose=False, diff=
       if func:
         if verbose:
           pagemsg("Begin processing")
-        retval = func(page, index, parse(page))
+        parsed = parse(page)
+        with process_callback(index, title):
+          retval = func(page, index, parsed)
 
         new, comment, has_changed = handle_process_page_retval(retval, page.text, pagemsg, verbose, diff)
         if has_changed:
           def assign_changed_page():
             page.text = new
           try_repeatedly(assign_changed_page, errandpagemsg, "assign changed page to 'page.text'")
-          if save:
+          if save and save_queue is not None:
+            pagemsg("Queueing save with comment = %s" % comment)
+            save_queue.put(page, index, new, comment, base_revid)
+          elif save and base_revid is not None and not page_has_revid(title, base_revid, errandpagemsg):
+            errandpagemsg("WARNING: Page has changed since revision %s, which the changes were made to; not saving; would have saved with comment = %s"
+                          % (base_revid, comment))
+          elif save:
             pagemsg("Saving with comment = %s" % comment)
             safe_page_save(page, comment, errandpagemsg)
           else:
@@ -739,6 +1702,35 @@ def iter_pages(pageiter, startprefix = None, endprefix = None, key = None):
       errmsg(str(i) + "/" + str(endprefix) + tdisp)
 
 
+# Counts of pages and requests made by prefetch_pages(), reported by elapsed_time().
+prefetch_stats = {"pages": 0, "requests": 0}
+
+# Wrap an iterator over (INDEX, PAGE) tuples, such as is returned by references() or cat_articles(), reading up to
+# `window` items ahead and fetching the text of their pages in bulk, `batch_size` pages per request, so that the pages
+# already have their text loaded when they are processed. Pages for which `skip_page` (if given) returns True, e.g.
+# because their text comes from elsewhere, aren't fetched.
+def prefetch_pages(indexed_pages, batch_size=50, window=500, skip_page=None):
+  indexed_pages = iter(indexed_pages)
+  while True:
+    chunk = []
+    for item in indexed_pages:
+      chunk.append(item)
+      if len(chunk) >= window:
+        break
+    if not chunk:
+      return
+    pages_to_fetch = [page for _, page in chunk if not skip_page or not skip_page(page)]
+    if pages_to_fetch:
+      def do_fetch():
+        for _ in site.preloadpages(pages_to_fetch, groupsize=batch_size):
+          pass
+      with metrics_phase("fetch"):
+        try_repeatedly(do_fetch, errandmsg, "prefetch %s pages" % len(pages_to_fetch))
+      prefetch_stats["pages"] += len(pages_to_fetch)
+      prefetch_stats["requests"] += (len(pages_to_fetch) + batch_size - 1) // batch_size
+    for item in chunk:
+      yield item
+
 def references(page, startprefix = None, endprefix = None, namespaces = None,
     only_template_inclusion = False, filter_redirects = False, include_page = False):
   if isinstance(page, str):
@@ -758,6 +1750,151 @@ def get_contributions(user, startprefix=None, endprefix=None, max=None, namespac
   for i, current in iter_items(itemiter, startprefix, endprefix, get_name=lambda item: item['title']):
     yield i, current
 
+# Local snapshot of category listings, used with --cat-snapshot so that later recursive traversals of the same
+# categories don't need to list them again. The snapshot is an SQLite database holding, for each category, the titles
+# of its subcategories and (unless only the subcategories were listed) its other members, in listing order, along with
+# the time they were fetched. Listings older than `max_age` seconds are fetched again.
+class CategorySnapshot(object):
+  def __init__(self, path, max_age=24 * 3600):
+    self.path = path
+    self.max_age = max_age
+    self.conn = sqlite3.connect(path)
+    self.conn.execute("CREATE TABLE IF NOT EXISTS category_members "
+                      "(title TEXT PRIMARY KEY, subcats TEXT, articles TEXT, fetched REAL)")
+    self.counts = {"reused": 0, "fetched": 0}
+
+  # Return (SUBCATS, ARTICLES) for the category titled `title`, where ARTICLES is None if only the subcategories were
+  # listed, or None if there's no fresh listing (including ARTICLES, if `want_articles`).
+  def lookup(self, title, want_articles):
+    row = self.conn.execute("SELECT subcats, articles, fetched FROM category_members WHERE title = ?",
+                            (title,)).fetchone()
+    if row is None or row[2] < time.time() - self.max_age or (want_articles and row[1] is None):
+      return None
+    self.counts["reused"] += 1
+    return json.loads(row[0]), json.loads(row[1]) if row[1] is not None else None
+
+  def store(self, title, subcats, articles):
+    self.counts["fetched"] += 1
+    self.conn.execute("INSERT OR REPLACE INTO category_members VALUES (?, ?, ?, ?)",
+                      (title, json.dumps(subcats), json.dumps(articles) if articles is not None else None, time.time()))
+    self.conn.commit()
+
+# Number of categories listed at once by CategoryTraversal (--cat-workers), and the CategorySnapshot used, if any
+# (--cat-snapshot).
+category_traversal_workers = 4
+category_snapshot = None
+
+# Recursive traversal of a category tree, used by yield_articles() and yield_subcats(). The categories are visited
+# breadth-first, in the order they're found, but up to `num_workers` of them are listed at the same time in background
+# threads, starting as soon as they're found, and the members of each are passed on as soon as they're listed (once
+# the categories before it are done), so pages can be processed while the rest of the tree is still being listed. The
+# order of the results is the same as if the categories had been listed one at a time, so page indices are stable.
+#
+# A category is skipped without listing it if it has already been visited or is in `seen` (if not None; categories
+# visited are added to it), or if it doesn't match `filter_cats_regex` or matches `prune_cats_regex`, in which case
+# its subcategories aren't visited either (unless reachable some other way). If `want_articles` is False, only the
+# subcategories of each category are listed. Listings are taken from and added to `snapshot` (a CategorySnapshot) if
+# given, except when listing from `startprefix` (a sort key prefix), which limits the articles listed in each category
+# but not its subcategories.
+class CategoryTraversal(object):
+  def __init__(self, seen, filter_cats_regex=None, prune_cats_regex=None, startprefix=None, want_articles=True,
+      num_workers=None, snapshot=None):
+    self.seen = seen
+    self.filter_cats_regex = filter_cats_regex
+    self.prune_cats_regex = prune_cats_regex
+    self.startprefix = startprefix
+    self.want_articles = want_articles
+    self.num_workers = num_workers or category_traversal_workers
+    self.snapshot = snapshot if startprefix is None else None
+    self.cancelled = False
+
+  # List the members of the category titled `title` in a background thread, putting ("subcat", TITLE) or
+  # ("article", TITLE) for each on the queue `items` as they come in, followed by ("done", None) or ("error", EXC).
+  def list_members(self, title, items):
+    try:
+      cat = pywikibot.Category(site, title)
+      if not self.want_articles:
+        members = cat.subcategories()
+      elif self.startprefix is not None:
+        # The sort key prefix applies only to the articles; all subcategories are visited.
+        members = itertools.chain(cat.subcategories(), cat.articles(startprefix=self.startprefix))
+      else:
+        members = cat.members()
+      for member in members:
+        if self.cancelled:
+          return
+        if member.namespace() == 14:
+          items.put(("subcat", str(member.title())))
+        elif self.want_articles:
+          items.put(("article", str(member.title())))
+    except Exception as e:
+      items.put(("error", e))
+      return
+    items.put(("done", None))
+
+  # Yield ("category", TITLE) for each category visited, starting with `root` (a title), followed by
+  # ("article", TITLE) for each of its members that isn't a category (if `want_articles`).
+  def walk(self, root):
+    visited = set()
+    pending = deque()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.num_workers)
+
+    def schedule(title):
+      if title in visited:
+        return
+      visited.add(title)
+      if self.seen is not None:
+        if title in self.seen:
+          return
+        self.seen.add(title)
+      this_cat = re.sub("^Category:", "", title)
+      if self.filter_cats_regex and not re.search(self.filter_cats_regex, this_cat):
+        msg("Skipping category '%s' as it doesn't match --filter-cats regex '%s'" % (this_cat, self.filter_cats_regex))
+        return
+      if self.prune_cats_regex and re.search(self.prune_cats_regex, this_cat):
+        msg("Skipping category '%s' as it matches --prune-cats regex '%s'" % (this_cat, self.prune_cats_regex))
+        return
+      listing = self.snapshot.lookup(title, self.want_articles) if self.snapshot else None
+      if listing is not None:
+        pending.append((title, None, listing))
+      else:
+        items = queue.Queue()
+        executor.submit(self.list_members, title, items)
+        pending.append((title, items, None))
+
+    try:
+      schedule(root)
+      while pending:
+        title, items, listing = pending.popleft()
+        yield "category", title
+        if listing is not None:
+          subcats, articles = listing
+          for subcat in subcats:
+            schedule(subcat)
+          if self.want_articles:
+            for article in articles:
+              yield "article", article
+          continue
+        subcats = []
+        articles = [] if self.want_articles else None
+        while True:
+          kind, value = items.get()
+          if kind == "done":
+            break
+          if kind == "error":
+            raise value
+          if kind == "subcat":
+            subcats.append(value)
+            schedule(value)
+          else:
+            articles.append(value)
+            yield "article", value
+        if self.snapshot:
+          self.snapshot.store(title, subcats, articles)
+    finally:
+      self.cancelled = True
+      executor.shutdown(wait=False, cancel_futures=True)
+
 def yield_articles(page, seen, startprefix=None, filter_cats_regex=None, prune_cats_regex=None, recurse=False):
   if not recurse:
     # Only use when non-recursive. Has a recurse= flag but doesn't allow for prune_cats_regex, doesn't correctly
@@ -771,16 +1908,16 @@ def yield_articles(page, seen, startprefix=None, filter_cats_regex=None, prune_c
           seen.add(pagetitle)
           yield article
   else:
-    for subcat in yield_subcats(page, seen, filter_cats_regex=filter_cats_regex, prune_cats_regex=prune_cats_regex,
-                                do_this_page=True, recurse=True):
-      for article in subcat.articles(startprefix=startprefix):
-        if seen is None:
-          yield article
-        else:
-          pagetitle = str(article.title())
-          if pagetitle not in seen:
-            seen.add(pagetitle)
-            yield article
+    traversal = CategoryTraversal(seen, filter_cats_regex=filter_cats_regex, prune_cats_regex=prune_cats_regex,
+                                  startprefix=startprefix, snapshot=category_snapshot)
+    for kind, pagetitle in traversal.walk(str(page.title())):
+      if kind != "article":
+        continue
+      if seen is not None:
+        if pagetitle in seen:
+          continue
+        seen.add(pagetitle)
+      yield pywikibot.Page(site, pagetitle)
 
 def raw_cat_articles(page, seen, startprefix=None, filter_cats_regex=None, prune_cats_regex=None, recurse=False):
   if isinstance(page, str):
@@ -801,6 +1938,14 @@ def cat_articles(page, startprefix=None, endprefix=None, seen=None, filter_cats_
     yield i, current
 
 def yield_subcats(page, seen, filter_cats_regex=None, prune_cats_regex=None, do_this_page=False, recurse=False):
+  if recurse:
+    traversal = CategoryTraversal(seen, filter_cats_regex=filter_cats_regex, prune_cats_regex=prune_cats_regex,
+                                  want_articles=False, snapshot=category_snapshot)
+    root = str(page.title())
+    for kind, pagetitle in traversal.walk(root):
+      if do_this_page or pagetitle != root:
+        yield pywikibot.Category(site, pagetitle)
+    return
   if seen is not None:
     pagetitle = str(page.title())
     if pagetitle in seen:
@@ -818,21 +1963,14 @@ def yield_subcats(page, seen, filter_cats_regex=None, prune_cats_regex=None, do_
       return
   if do_this_page:
     yield page
-  subcats = page.subcategories()
-  if recurse:
-    for subcat in subcats:
-      for cat in yield_subcats(subcat, seen, filter_cats_regex=filter_cats_regex, prune_cats_regex=prune_cats_regex,
-                               do_this_page=True, recurse=True):
-        yield cat
-  else:
-    for subcat in subcats:
-      if seen is None:
+  for subcat in page.subcategories():
+    if seen is None:
+      yield subcat
+    else:
+      pagetitle = str(subcat.title())
+      if pagetitle not in seen:
+        seen.add(pagetitle)
         yield subcat
-      else:
-        pagetitle = str(subcat.title())
-        if pagetitle not in seen:
-          seen.add(pagetitle)
-          yield subcat
 
 def cat_subcats(page, startprefix=None, endprefix=None, seen=None, filter_cats_regex=None, prune_cats_regex=None,
                 do_this_page=False, recurse=False):
@@ -949,7 +2087,7 @@ class ProcessItems(object):
         should_skip = True
       if should_skip:
         if self.i % self.skipsteps == 0:
-          pywikibot.output("skipping %s" % str(self.i))
+          errmsg("skipping %s" % str(self.i))
         return False
 
     if self.endprefix != None:
@@ -962,9 +2100,9 @@ class ProcessItems(object):
     if isinstance(self.endprefix, int) and not self.t:
       self.t = datetime.datetime.now()
 
-    if self.skip_ignorable_pages and page_should_be_ignored(get_name(item)):
-      pywikibot.output("Page %s %s: page has a prefix or suffix indicating it should not be touched, skipping" % (
-        self.i, get_name(item)))
+    if self.skip_ignorable_pages and page_should_be_ignored(self.get_name(item)):
+      errmsg("Page %s %s: page has a prefix or suffix indicating it should not be touched, skipping" % (
+        self.i, self.get_name(item)))
       retval = False
     else:
       retval = self.i
@@ -979,7 +2117,7 @@ class ProcessItems(object):
         tfuture = self.t + (self.t - told) * pagesleft
         tdisp = ", est. " + tfuture.strftime("%X")
 
-      pywikibot.output(str(self.i) + "/" + str(self.endprefix) + tdisp)
+      errmsg(str(self.i) + "/" + str(self.endprefix) + tdisp)
 
     return retval
 
@@ -1008,7 +2146,7 @@ def iter_items(items, startprefix=None, endprefix=None, get_name=get_page_name,
         should_skip = True
       if should_skip:
         if i % skipsteps == 0:
-          pywikibot.output("skipping %s" % str(i))
+          errmsg("skipping %s" % str(i))
         continue
 
     if actual_startprefix is None:
@@ -1026,7 +2164,7 @@ def iter_items(items, startprefix=None, endprefix=None, get_name=get_page_name,
       t = datetime.datetime.now()
 
     if skip_ignorable_pages and page_should_be_ignored(get_name(current)):
-      pywikibot.output("Page %s %s: page has a prefix or suffix indicating it should not be touched, skipping" % (
+      errmsg("Page %s %s: page has a prefix or suffix indicating it should not be touched, skipping" % (
         index, get_name(current)))
     else:
       yield index, current
@@ -1083,7 +2221,7 @@ def iter_items(items, startprefix=None, endprefix=None, get_name=get_page_name,
         )
         tdisp = ", est. %s left" % time_left_str
 
-      pywikibot.output(str(i) + "/" + str(actual_endprefix) + tdisp)
+      errmsg(str(i) + "/" + str(actual_endprefix) + tdisp)
 
 # Parse the output of group_notes() back into individual notes. If a note is repeated, include that many copies
 # in the result.
@@ -1124,17 +2262,101 @@ def group_notes(notes):
 
 starttime = time.time()
 
+# Argument parser returned by create_argparser(), which applies arguments that affect blib globally (e.g.
+# --save-queue) once they've been parsed.
+class BlibArgumentParser(argparse.ArgumentParser):
+  def parse_known_args(self, args=None, namespace=None):
+    args, extras = super().parse_known_args(args, namespace)
+    global offline, diff_engine, category_traversal_workers, category_snapshot
+    if getattr(args, "offline", False):
+      offline = True
+    if getattr(args, "diff_engine", None):
+      diff_engine = args.diff_engine
+    if getattr(args, "save", False) and getattr(args, "save_queue", False):
+      start_save_queue(edits_per_minute=args.save_rate, max_queued=args.save_queue_size)
+    if getattr(args, "event_log", None):
+      start_event_log(args.event_log)
+    if getattr(args, "cat_workers", None):
+      category_traversal_workers = args.cat_workers
+    if getattr(args, "cat_snapshot", None):
+      category_snapshot = CategorySnapshot(args.cat_snapshot, max_age=args.cat_snapshot_max_age * 3600)
+    if getattr(args, "rate_limit", None):
+      start_rate_limiter(args.rate_limit, path=args.rate_limit_file or None)
+    if getattr(args, "metrics", False) or getattr(args, "metrics_file", None):
+      start_run_metrics(report_interval=args.metrics_interval, output_file=args.metrics_file)
+    if getattr(args, "profile", False) or getattr(args, "profile_file", None):
+      if not 0 < args.profile_sample_rate <= 1:
+        self.error("--profile-sample-rate must be greater than 0 and at most 1")
+      start_callback_profiler(sample_rate=args.profile_sample_rate, num_slowest=args.profile_slowest,
+                              output_file=args.profile_file)
+    if getattr(args, "resume", None):
+      if getattr(args, "journal", None) and args.journal != args.resume:
+        self.error("--journal and --resume must be the same file if both are given")
+      start_run_journal(args.resume, resume=True)
+    elif getattr(args, "journal", None):
+      if os.path.exists(args.journal):
+        self.error("Journal %s already exists; use --resume to resume the run it records" % args.journal)
+      start_run_journal(args.journal)
+    if getattr(args, "expand_cache", False):
+      start_expand_cache(args.expand_cache_file)
+    if getattr(args, "local_lua", False):
+      start_local_lua(module_dirs=args.local_lua_dir or None,
+        page_store=PageStore(args.page_store) if getattr(args, "page_store", None) else None,
+        parity=args.local_lua_parity)
+    return args, extras
+
 def create_argparser(desc, include_pagefile=False, include_stdin=False,
     no_beginning_line=False, suppress_start_end=False):
   if not no_beginning_line:
     msg("Beginning at %s" % time.ctime(starttime))
-  parser = argparse.ArgumentParser(description=desc)
+  parser = BlibArgumentParser(description=desc)
   if not suppress_start_end:
     parser.add_argument('start', help="Starting page index", nargs="?")
     parser.add_argument('end', help="Ending page index", nargs="?")
   parser.add_argument('-s', '--save', action="store_true", help="Save results")
   parser.add_argument('-v', '--verbose', action="store_true", help="More verbose output")
   parser.add_argument('-d', '--diff', action="store_true", help="Show diff of changes")
+  parser.add_argument("--diff-engine", choices=sorted(diff_engines),
+    help="Method used to compute diffs for --diff (default 'linehash', which is faster on large pages and gives up on finding exact differences when there are very many; 'difflib' is the old method).")
+  parser.add_argument("--save-queue", action="store_true",
+    help="With --save, save pages from a background thread while processing continues, backing off when the server is busy.")
+  parser.add_argument("--save-rate", type=float,
+    help="With --save-queue, maximum number of saves per minute (default no limit beyond Pywikibot's own throttling).")
+  parser.add_argument("--save-queue-size", type=int, default=100,
+    help="With --save-queue, maximum number of saves waiting to be done before processing pauses (default %(default)s).")
+  parser.add_argument("--expand-cache", action="store_true",
+    help="Use and update a persistent cache of template expansions done using blib.expand_text(). Each expansion not in the cache costs two extra requests, so this pays off only when the same calls recur across runs.")
+  parser.add_argument("--expand-cache-file",
+    help="With --expand-cache, file holding the cache (default $BLIB_EXPAND_CACHE or ~/.cache/blib/expand_text.sqlite3).")
+  parser.add_argument("--event-log",
+    help="Also write the messages output as a structured log of events (JSON lines) to this file, which should be named after the file the output is written to with '.events.jsonl' added so that tools reading the output can use it instead.")
+  parser.add_argument("--rate-limit", type=float, default=os.environ.get("BLIB_RATE_LIMIT"),
+    help="Make at most this many API requests per minute (default $BLIB_RATE_LIMIT if set, otherwise no limit beyond Pywikibot's own), shared with other processes using the same --rate-limit-file and slowed down automatically when the server is busy or throttling.")
+  parser.add_argument("--rate-limit-file",
+    default=os.environ.get("BLIB_RATE_LIMIT_FILE") or os.path.join(os.path.expanduser("~"), ".cache", "blib", "rate-limit.json"),
+    help="With --rate-limit, file holding the rate limiter state shared among processes (default $BLIB_RATE_LIMIT_FILE or ~/.cache/blib/rate-limit.json; '' to not share it).")
+  parser.add_argument("--metrics", action="store_true",
+    help="Time each phase of processing (fetching, parsing, processing, template expansion, diffing, saving) and count API requests by kind, outputting a breakdown every --metrics-interval pages and at the end.")
+  parser.add_argument("--metrics-interval", type=int, default=500,
+    help="With --metrics, number of pages between breakdowns, which are output to stderr (default %(default)s; 0 for only at the end).")
+  parser.add_argument("--metrics-file",
+    help="Write the metrics (implies --metrics) to this file each time a breakdown is output, as JSON or, if the file is named '*.prom', in the Prometheus text format.")
+  parser.add_argument("--profile", action="store_true",
+    help="Profile the script's processing function (including the blib functions it calls, but not the rest of blib) over all pages, outputting a report sorted by cumulative time and the slowest pages at the end and writing the profile to --profile-file.")
+  parser.add_argument("--profile-sample-rate", type=float, default=1.0,
+    help="With --profile, fraction of pages to profile, chosen at random (default %(default)s, i.e. all pages). The slowest pages are found among all pages.")
+  parser.add_argument("--profile-file",
+    help="With --profile, file to write the profile to in pstats format, for use with e.g. 'python3 -m pstats', snakeviz or flameprof (implies --profile; default SCRIPT.pstats, after the script's name).")
+  parser.add_argument("--profile-slowest", type=int, default=20,
+    help="With --profile, number of slowest pages to list (default %(default)s).")
+  parser.add_argument("--offline", action="store_true",
+    help="Don't access the server at all (and don't import Pywikibot unless needed); any attempt to do so is an error. Useful when processing dumps or find_regex.py output with --stdin, --find-regex or --dump.")
+  parser.add_argument("--local-lua", action="store_true",
+    help="Expand template calls made using blib.expand_text() by running Lua modules locally (requires the 'lupa' package), falling back to the server for calls that can't be expanded locally.")
+  parser.add_argument("--local-lua-dir", action="append",
+    help="With --local-lua, directory to load Lua modules from (default the directory containing blib.py); can be repeated. Modules not found are taken from --page-store if given.")
+  parser.add_argument("--local-lua-parity", action="store_true",
+    help="With --local-lua, also expand each call using the server and warn if the local expansion differs.")
   if include_pagefile:
     parser.add_argument("--pagefile", help="File listing pages to process.")
     parser.add_argument("--pages", help="List of pages to process, comma-separated.")
@@ -1149,6 +2371,12 @@ def create_argparser(desc, include_pagefile=False, include_stdin=False,
       help="When processing categories, do the category and subcategories instead of pages belong to the category.")
     parser.add_argument("--recursive", action="store_true",
       help="In conjunction with --cats, recursively process pages in subcategories.")
+    parser.add_argument("--cat-workers", type=int, default=4,
+      help="With --recursive, number of categories to list at the same time (default %(default)s). Categories are visited breadth-first.")
+    parser.add_argument("--cat-snapshot",
+      help="With --recursive, reuse the category listings saved in this file (an SQLite database) by earlier runs, and save those fetched, so later runs over the same categories needn't list them again.")
+    parser.add_argument("--cat-snapshot-max-age", type=float, default=24,
+      help="With --cat-snapshot, fetch again category listings saved more than this many hours ago (default %(default)s).")
     parser.add_argument("--track-seen", action="store_true",
       help="Track previously seen articles and don't visit them again.")
     parser.add_argument("--prune-cats", help="Regex to use to prune categories when processing subcategories recursively; any categories matching the regex will be skipped along with any of their subcategories (unless reachable in some other manner).")
@@ -1176,13 +2404,32 @@ def create_argparser(desc, include_pagefile=False, include_stdin=False,
     parser.add_argument("--find-regex-output", help="Output as by find_regex.py.", action="store_true")
     parser.add_argument("--no-output", help="In conjunction with --find-regex, don't output processed text.", action="store_true")
     parser.add_argument("--skip-ignorable-pages", help="Skip 'ignorable' pages (talk pages, user pages, etc.).", action="store_true")
-    # Not implemented yet.
-    #parser.add_argument("--parallel", help="Do in parallel.", action="store_true")
-    #parser.add_argument("--num-workers", help="Number of workers for use with --parallel.", type=int, default=5)
+    parser.add_argument("--prefetch", action="store_true",
+      help="Fetch the text of upcoming pages in bulk (see --prefetch-batch-size and --prefetch-window) instead of one request per page.")
+    parser.add_argument("--prefetch-batch-size", type=int, default=50,
+      help="Number of pages fetched per request when using --prefetch (at most 50, or 500 for accounts with the apihighlimits right).")
+    parser.add_argument("--prefetch-window", type=int, default=500,
+      help="Number of upcoming pages read ahead and fetched before processing them when using --prefetch.")
+    parser.add_argument("--link-index", help="Use this offline transclusion and category index (as created by build_link_index.py) for --refs, --pages-and-refs, --cats (when processing pages in the categories), --skip-cats and default references and categories, instead of querying the server. Only transclusions (direct or indirect) and explicit category links are indexed.")
+    parser.add_argument("--page-store", help="Read the text of pages from this local page store (as created by build_page_store.py) instead of fetching it from the server. Pages not in the store are fetched as usual. Saves still go to the server, but only if the live page is still at the revision in the store.")
+    parser.add_argument("--journal", help="Write a journal of the pages processed and saved to this file, so that the run can be resumed using --resume if interrupted. Category, references and prefix listings are fetched in full before processing their pages and recorded in the journal.")
+    parser.add_argument("--resume", help="Resume the run recorded in this journal (as written using --journal), skipping the pages already processed without fetching them and reusing the recorded listings; further progress is added to the journal. The other arguments should be the same as for the original run.")
+    parser.add_argument("--parallel", help="Do in parallel. Output is buffered per page and emitted in the original page order, and any saves are done by the main process.", action="store_true")
+    parser.add_argument("--num-workers", help="Number of workers for use with --parallel.", type=int, default=5)
+    parser.add_argument("--list-pages-to", default=os.environ.get("BLIB_LIST_PAGES_TO"),
+      help="Instead of processing the pages, append the index and title of each page that would be processed to this file, one JSON object per line (default $BLIB_LIST_PAGES_TO). Used by parallel_run.py.")
+    parser.add_argument("--page-batch", default=os.environ.get("BLIB_PAGE_BATCH"),
+      help="Instead of the pages given by the other arguments, process the pages in this file, as written using --list-pages-to, with their recorded indices (default $BLIB_PAGE_BATCH). Used by parallel_run.py.")
   if include_stdin:
     parser.add_argument("--find-regex", help="Read find_regex.py output from stdin.", action="store_true")
     parser.add_argument("--stdin", help="Read XML dump from stdin.", action="store_true")
     parser.add_argument("--only-lang", help="Only process the section of a page for this language (a canonical language name).")
+    parser.add_argument("--dump", help="Read an XML dump from this file (plain or .bz2) instead of from stdin.")
+    parser.add_argument("--dump-index", help="Index file of a multistream dump given using --dump (i.e. a pages-articles-multistream-index.txt[.bz2] file). The bz2 streams of the dump are decompressed in parallel, and only the streams containing pages selected by --pages, --pagefile or the start/end indices are read.")
+    parser.add_argument("--dump-workers", type=int, default=4,
+      help="Number of worker processes used to decompress a multistream dump given using --dump and --dump-index.")
+    parser.add_argument("--workers", type=int, default=1,
+      help="With --stdin or --find-regex, process pages in this many worker processes. Output is buffered per page and emitted in the original page order.")
   if include_pagefile or include_stdin:
     parser.add_argument("--ignore-embedded-page-indices", help="When processing find_regex.py or other similar output from stdin or '--pages-from-find-regex', ignore associated page indices and increment sequentially.", action="store_true")
   return parser
@@ -1252,6 +2499,10 @@ def do_handle_stdin_retval(args, retval, text, prev_comment, pagemsg, is_find_re
         final_newline = "\n"
       pagemsg("-------- begin text --------\n%s%s-------- end text --------" % (new, final_newline))
 
+# Number of calls of do_pagefile_cats_refs() so far, identifying the pages of each call in the listings written using
+# --list-pages-to.
+num_pagefile_cats_refs_calls = 0
+
 # Process a run of pages, with the set of pages specified in various possible ways, e.g. from --pagefile, --cats,
 # --refs, or (if --stdin is given) from a Wiktionary dump or find_regex.py output read from stdin. A typical workflow is
 # like this:
@@ -1323,10 +2574,27 @@ def do_handle_stdin_retval(args, retval, text, prev_comment, pagemsg, is_find_re
 # If `process_index` is given, it should be a function of one argument that will process the page index prior to
 # displaying messages with that index. The passed-in index will be an integer or string and the return value should be
 # the same. This can be used e.g. to create multi-level indices.
+#
+# If `templates` is given, it should be a list of template names or a TemplatePrefilter, and pages (or, with
+# --only-lang, language sections) that can't contain any of the templates are skipped without calling `process`.
+#
+# Within the processing of each page, blib.parse_text(text, cached=True) reuses the parse tree of an identical text
+# rather than parsing it again, and split_text_into_sections() similarly reuses its split; see page_parse_cache(). The
+# `parsed` argument passed to `process` with edit=True and the tree used by process_one_page_links() come from this
+# cache, so with stdin=True and edit=True the page is normally parsed only once for both.
+#
+# If --parallel (or --workers with pages on stdin) is given, `process` is called in worker processes, and changes it
+# makes to module-level state (e.g. counters) are lost unless `get_worker_state` and `merge_worker_state` are given;
+# see OrderedWorkerPool. The `seen` set is always maintained by the main process.
+#
+# With --list-pages-to, the pages (from a source other than stdin or a dump) are listed rather than processed, and with
+# --page-batch, the pages in such a listing are processed instead of those given by the other arguments.
+# parallel_run.py uses these to list the pages once and hand them out to its workers in batches.
 def do_pagefile_cats_refs(
     args, start, end, process, default_pages=[], default_cats=[], default_refs=[], edit=False, stdin=False,
     only_lang=None, include_comment=False, filter_pages=None, ref_namespaces=None, canonicalize_pagename=None,
-    skip_ignorable_pages=False, seen=None, process_index=lambda x: x):
+    skip_ignorable_pages=False, seen=None, process_index=lambda x: x, get_worker_state=None,
+    merge_worker_state=None, templates=None):
   args_namespaces = args.namespaces and args.namespaces.split(",") or []
   args_namespaces = [0 if x == "-" else int(x) if re.search("^[0-9]+$", x) else x for x in args_namespaces]
   args_ref_namespaces = args.ref_namespaces and args.ref_namespaces.split(",")
@@ -1336,17 +2604,50 @@ def do_pagefile_cats_refs(
   pages_to_skip = set(split_arg(args.skip_pages, canonicalize=canonicalize_pagename)) if args.skip_pages else set()
   if args.skip_page_file:
     pages_to_skip |= set(yield_items_from_file(args.skip_page_file, canonicalize=canonicalize_pagename))
+  link_index = LinkIndex(args.link_index) if getattr(args, "link_index", None) else None
   cat_pages_to_skip = set()
   if args.skip_cats:
     skip_cats = split_arg(args.skip_cats)
     for cat in skip_cats:
       errmsgn("Fetching pages in category '%s'..." % cat)
-      cat_pages_to_skip |= set(str(page.title()) for page in raw_cat_articles(cat, seen=None))
+      if link_index:
+        cat_pages_to_skip |= set(raw_cat_articles_from_index(link_index, cat, seen=None))
+      else:
+        cat_pages_to_skip |= set(str(page.title()) for page in raw_cat_articles(cat, seen=None))
       errmsg(" done.")
   if seen is None:
     seen = set() if args.track_seen else None
+  journal_pass = run_journal.start_pass() if run_journal is not None else None
+  global num_pagefile_cats_refs_calls
+  num_pagefile_cats_refs_calls += 1
+  call_number = num_pagefile_cats_refs_calls
+  reading_stdin = stdin and (args.stdin or args.find_regex or args.dump)
+  list_pages_fp = None
+  if getattr(args, "list_pages_to", None):
+    if reading_stdin:
+      raise ValueError("--list-pages-to can't be used with pages read from stdin or a dump")
+    list_pages_fp = open(args.list_pages_to, "a", encoding="utf-8")
+  page_batch = None
+  if getattr(args, "page_batch", None) and not reading_stdin:
+    page_batch = []
+    with open(args.page_batch, "r", encoding="utf-8") as fp:
+      for line in fp:
+        entry = json.loads(line)
+        if entry["call"] == call_number:
+          page_batch.append(entry)
+  if run_journal is not None and seen is not None:
+    seen |= run_journal.seen_titles(journal_pass)
+  page_store = PageStore(args.page_store) if getattr(args, "page_store", None) else None
+  if templates is not None and not isinstance(templates, TemplatePrefilter):
+    templates = TemplatePrefilter(templates)
+  if getattr(args, "parallel", False):
+    num_workers = args.num_workers
+  else:
+    num_workers = getattr(args, "workers", 1)
 
-  def page_should_be_filtered_out(pagetitle, errandpagemsg):
+  # Return True if the page with title `pagetitle` should be skipped. If `check_namespace` is False, don't check
+  # --namespaces (which may require a call to the server); this is used when prefiltering pages in a dump.
+  def page_should_be_filtered_out(pagetitle, errandpagemsg, check_namespace=True):
     if pagetitle in pages_to_skip or pagetitle in cat_pages_to_skip:
       return True
     if filter_pages or args_filter_pages or args_filter_pages_not:
@@ -1358,7 +2659,7 @@ def do_pagefile_cats_refs(
         return True
     if (skip_ignorable_pages or args.skip_ignorable_pages) and page_should_be_ignored(pagetitle):
       return True
-    if args_namespaces:
+    if args_namespaces and check_namespace:
       namespace = try_repeatedly(lambda: pywikibot.Page(site, pagetitle).namespace(), errandpagemsg, "find namespace of page")
       if namespace is None:
         return True
@@ -1389,13 +2690,22 @@ def do_pagefile_cats_refs(
     return sections, j, secbody, sectail
 
   def do_process_text_on_page(index, pagetitle, text, prev_comment, pagemsg):
+    global event_log_current_title
+    event_log_current_title = pagetitle
+    with page_parse_cache(), metrics_page():
+      return do_process_text_on_page_1(index, pagetitle, text, prev_comment, pagemsg)
+
+  def do_process_text_on_page_1(index, pagetitle, text, prev_comment, pagemsg):
     def errandpagemsg(txt):
       errandmsg("Page %s %s: %s" % (index, pagetitle, txt))
     def call_process(text_to_call):
-      if include_comment:
-        return process(index, pagetitle, text_to_call, prev_comment)
-      else:
-        return process(index, pagetitle, text_to_call)
+      if templates is not None and not templates.matches(text_to_call):
+        return None
+      with process_callback(index, pagetitle):
+        if include_comment:
+          return process(index, pagetitle, text_to_call, prev_comment)
+        else:
+          return process(index, pagetitle, text_to_call)
     if page_should_be_filtered_out(pagetitle, errandpagemsg):
       return None
     if args.only_lang:
@@ -1418,8 +2728,14 @@ def do_pagefile_cats_refs(
   # output or from a dump file). `no_check_seen` means to not check the `seen` set to see whether a page has already
   # been seen. This is set when iterating over categories because the code to do this adds to the `seen` set itself
   # (necessary because it can recursively process subcategories) so if we check the `seen` set we'll never process any
-  # pages.
-  def process_pywikibot_page(index, page, no_check_seen=False):
+  # pages. `base_revid`, if given, is the revision that the already-loaded text of `page` comes from.
+  def do_process_pywikibot_page(index, page, no_check_seen=False, base_revid=None):
+    global event_log_current_title
+    event_log_current_title = str(page.title())
+    with page_parse_cache(), metrics_page():
+      do_process_pywikibot_page_1(index, page, no_check_seen=no_check_seen, base_revid=base_revid)
+
+  def do_process_pywikibot_page_1(index, page, no_check_seen=False, base_revid=None):
     index = process_index(index)
     pagetitle = str(page.title())
     if not no_check_seen and seen is not None:
@@ -1432,6 +2748,14 @@ def do_pagefile_cats_refs(
       errandmsg("Page %s %s: %s" % (index, pagetitle, txt))
     if page_should_be_filtered_out(pagetitle, errandpagemsg):
       return
+    if page_store is not None:
+      stored = page_store.lookup(pagetitle)
+      if stored is not None:
+        # Setting the text locally means that all later accesses of `page.text` (including by `process`) see the
+        # stored text without contacting the server.
+        page.text, base_revid, _ = stored
+      elif args.verbose:
+        pagemsg("Page not in page store, fetching from server")
     def do_process_page(page, index, parsed=None):
       if stdin:
         pagetext = safe_page_text(page, errandpagemsg)
@@ -1441,11 +2765,14 @@ def do_pagefile_cats_refs(
           pagetext = safe_page_text(page, errandpagemsg)
           if "==%s==" % only_lang not in pagetext:
             return None, None
-        if edit:
-          return process(page, index, parsed)
-        else:
-          return process(page, index)
+        with process_callback(index, pagetitle):
+          if edit:
+            return process(page, index, parsed)
+          else:
+            return process(page, index)
 
+    if templates is not None and not templates.matches(safe_page_text(page, errandpagemsg)):
+      return
     if args.find_regex_output:
       # We are reading from Wiktionary but asked to output in find_regex format.
       retval = do_process_page(page, index)
@@ -1453,11 +2780,140 @@ def do_pagefile_cats_refs(
       do_handle_stdin_retval(args, retval, pagetext, None, pagemsg, is_find_regex=True, edit=edit)
     elif edit:
       do_edit(page, index, do_process_page, save=args.save, verbose=args.verbose,
-          diff=args.diff)
+          diff=args.diff, base_revid=base_revid)
     else:
       do_process_page(page, index)
 
-  if stdin and (args.stdin or args.find_regex):
+  # With --parallel, pages are processed in worker processes. Each worker creates its own Page object (using the text
+  # already fetched by --prefetch, if any) and returns the saves that would have been done, which are then done here,
+  # one at a time and in page order.
+  def process_pywikibot_page_in_worker(item):
+    global save_queue
+    index, pagetitle, text, base_revid = item
+    page = pywikibot.Page(site, pagetitle)
+    if text is not None:
+      page.text = text
+    saves = CollectedSaves()
+    save_queue = saves
+    do_process_pywikibot_page(index, page, no_check_seen=True, base_revid=base_revid)
+    return saves
+
+  def save_pages_from_worker(item, saves):
+    saved = True
+    for pagetitle, index, newtext, comment, base_revid in saves:
+      def errandpagemsg(txt):
+        errandmsg("Page %s %s: %s" % (index, pagetitle, txt))
+      page = pywikibot.Page(site, pagetitle)
+      if save_queue is not None:
+        save_queue.put(page, index, newtext, comment, base_revid)
+      elif base_revid is not None and not page_has_revid(pagetitle, base_revid, errandpagemsg):
+        errandpagemsg("WARNING: Page has changed since revision %s, which the changes were made to; not saving; would have saved with comment = %s"
+                      % (base_revid, comment))
+        saved = False
+      else:
+        page.text = newtext
+        if not safe_page_save(page, comment, errandpagemsg):
+          saved = False
+    if saved:
+      record_page_done(item[0], item[1])
+
+  # With --journal or --resume, record that the page at `index` titled `pagetitle` has been processed, once any save of
+  # it queued using --save-queue is done; if that save failed or conflicted, the page isn't recorded, so that it's
+  # processed again when resuming.
+  def record_page_done(index, pagetitle):
+    if run_journal is None:
+      return
+    def record_if_saved(saved):
+      if saved:
+        run_journal.record_done(journal_pass, index, pagetitle)
+    if save_queue is not None:
+      save_queue.call_after_saves(record_if_saved, pagetitle)
+    else:
+      run_journal.record_done(journal_pass, index, pagetitle)
+
+  parallel_pool = None
+  if num_workers > 1 and not (stdin and (args.stdin or args.find_regex or args.dump)) and list_pages_fp is None:
+    parallel_pool = OrderedWorkerPool(process_pywikibot_page_in_worker, num_workers,
+                                      handle_result=save_pages_from_worker, get_worker_state=get_worker_state,
+                                      merge_worker_state=merge_worker_state)
+
+  # Process a page from one of the page sources below, either directly or, with --parallel, by sending it to a
+  # worker. The `seen` set is checked here so that it is shared among all workers.
+  def process_pywikibot_page(index, page, no_check_seen=False):
+    pagetitle = str(page.title())
+    if list_pages_fp is not None:
+      if not no_check_seen and seen is not None:
+        if pagetitle in seen:
+          return
+        seen.add(pagetitle)
+      list_pages_fp.write(json.dumps({"call": call_number, "index": index, "title": pagetitle,
+                                      "category": isinstance(page, pywikibot.Category)}, ensure_ascii=False) + "\n")
+      return
+    if run_journal is not None and run_journal.is_done(journal_pass, index, pagetitle):
+      run_journal.counts["skipped"] += 1
+      return
+    if parallel_pool is None:
+      do_process_pywikibot_page(index, page, no_check_seen=no_check_seen)
+      record_page_done(index, pagetitle)
+      return
+    if not no_check_seen and seen is not None:
+      if pagetitle in seen:
+        return
+      seen.add(pagetitle)
+    text = base_revid = None
+    if getattr(args, "prefetch", False) and not (page_store and pagetitle in page_store):
+      text = safe_page_text(page, errandmsg, bad_value_ret=None)
+      if text is not None:
+        try:
+          base_revid = page.latest_revision_id
+        except pywikibot.exceptions.NoPageError:
+          text = None
+    parallel_pool.submit((index, pagetitle, text, base_revid))
+
+  # If --prefetch was given, wrap an iterator over (INDEX, PAGE) tuples so that the text of the pages is fetched in bulk
+  # ahead of processing them.
+  # Pages done in a previous run (with --resume) are left out first, so they aren't fetched.
+  def maybe_prefetch(indexed_pages):
+    if run_journal is not None and run_journal.has_done(journal_pass):
+      indexed_pages = skip_done_pages(indexed_pages)
+    if not getattr(args, "prefetch", False) or list_pages_fp is not None:
+      return indexed_pages
+    return prefetch_pages(indexed_pages, batch_size=args.prefetch_batch_size, window=args.prefetch_window,
+      skip_page=page_store and (lambda page: str(page.title()) in page_store))
+
+  def skip_done_pages(indexed_pages):
+    for index, page in indexed_pages:
+      if run_journal.is_done(journal_pass, index, str(page.title())):
+        run_journal.counts["skipped"] += 1
+      else:
+        yield index, page
+
+  # With --journal or --resume, get the whole listing of (INDEX, PAGE) tuples returned by `make_listing()` before
+  # processing any of the pages and record their titles in the journal, or reuse the titles recorded by a previous run
+  # under `key`, which should identify the listing and everything that affects it. `adds_to_seen` indicates that the
+  # listing adds its pages to the `seen` set (as category listings do), which must be done when reusing it.
+  # `page_class` is the Pywikibot class used to recreate the pages from their titles.
+  def journaled_listing(key, make_listing, adds_to_seen=False, page_class=None):
+    if run_journal is None:
+      return make_listing()
+    items = run_journal.listing(key)
+    if items is None:
+      items = [(index, str(page.title())) for index, page in make_listing()]
+      run_journal.record_listing(key, items)
+    else:
+      run_journal.counts["listings_reused"] += 1
+      if adds_to_seen and seen is not None:
+        seen.update(pagetitle for _, pagetitle in items)
+    page_class = page_class or pywikibot.Page
+    return ((index, page_class(site, pagetitle)) for index, pagetitle in items)
+
+  if page_batch is not None:
+    for index, page in maybe_prefetch(
+        (entry["index"], (pywikibot.Category if entry["category"] else pywikibot.Page)(site, entry["title"]))
+        for entry in page_batch):
+      process_pywikibot_page(index, page, no_check_seen=True)
+
+  elif stdin and (args.stdin or args.find_regex or args.dump):
     pages_to_filter = None
     if args.pages:
       pages_to_filter = set(split_arg(args.pages, canonicalize=canonicalize_pagename))
@@ -1480,63 +2936,120 @@ def do_pagefile_cats_refs(
           msg("Page %s %s: %s" % (index, pagetitle, txt))
         return do_process_text_on_page(index, pagetitle, text, prev_comment, pagemsg)
     if args.find_regex:
-      index_pagetitle_text_comment = yield_text_from_find_regex(sys.stdin, args.verbose)
-      for index, (_, pagetitle, text, prev_comment) in iter_items(index_pagetitle_text_comment, start, end,
-          get_name=lambda x:x[1], get_index=None if args.ignore_embedded_page_indices else lambda x:x[0]):
+      def do_process_find_regex_text_on_page(index, pagetitle, text, prev_comment):
+        with metrics_page():
+          do_process_find_regex_text_on_page_1(index, pagetitle, text, prev_comment)
+      def do_process_find_regex_text_on_page_1(index, pagetitle, text, prev_comment):
         retval = do_process_stdin_text_on_page(index, pagetitle, text, prev_comment)
         def pagemsg(txt):
           msg("Page %s %s: %s" % (process_index(index), pagetitle, txt))
         if prev_comment:
           prev_comment = parse_grouped_notes(prev_comment)
         do_handle_stdin_retval(args, retval, text, prev_comment, pagemsg, is_find_regex=True, edit=edit)
+      index_pagetitle_text_comment = yield_text_from_find_regex(sys.stdin, args.verbose)
+      indexed_items = iter_items(index_pagetitle_text_comment, start, end, get_name=lambda x:x[1],
+          get_index=None if args.ignore_embedded_page_indices else lambda x:x[0])
+      if num_workers > 1:
+        pool = OrderedWorkerPool(lambda item: do_process_find_regex_text_on_page(*item), num_workers,
+                                 get_worker_state=get_worker_state, merge_worker_state=merge_worker_state)
+        for index, (_, pagetitle, text, prev_comment) in indexed_items:
+          pool.submit((index, pagetitle, text, prev_comment))
+        pool.finish()
+      else:
+        for index, (_, pagetitle, text, prev_comment) in indexed_items:
+          do_process_find_regex_text_on_page(index, pagetitle, text, prev_comment)
     else:
       def do_process_stdin_dump_text_on_page(index, pagetitle, text):
+        with metrics_page():
+          do_process_stdin_dump_text_on_page_1(index, pagetitle, text)
+      def do_process_stdin_dump_text_on_page_1(index, pagetitle, text):
         retval = do_process_stdin_text_on_page(index, pagetitle, text, None)
         def pagemsg(txt):
           msg("Page %s %s: %s" % (process_index(index), pagetitle, txt))
         do_handle_stdin_retval(args, retval, text, None, pagemsg, is_find_regex=False, edit=edit)
-      parse_dump(sys.stdin, do_process_stdin_dump_text_on_page, start, end)
+      # Filters applied by the dump reader before the page text is decoded. Pages rejected here still count towards
+      # the page indices.
+      def dump_title_filter(pagetitle):
+        if pages_to_filter is not None and pagetitle not in pages_to_filter:
+          return False
+        return not page_should_be_filtered_out(pagetitle, None, check_namespace=False)
+      text_prefilter = "==%s==" % only_lang if only_lang and not args.only_lang else None
+      def do_parse_dump(pagecallback):
+        if args.dump and args.dump_index:
+          parse_multistream_dump(args.dump, args.dump_index, pagecallback, start, end, pages=pages_to_filter,
+                                 title_filter=dump_title_filter, text_prefilter=text_prefilter,
+                                 num_workers=args.dump_workers)
+        elif args.dump:
+          with open_dump(args.dump) as fp:
+            parse_dump(fp, pagecallback, start, end, title_filter=dump_title_filter, text_prefilter=text_prefilter)
+        else:
+          parse_dump(sys.stdin, pagecallback, start, end, title_filter=dump_title_filter,
+                     text_prefilter=text_prefilter)
+      if num_workers > 1:
+        # The dump itself is read in this process; only the page callbacks run in the workers.
+        pool = OrderedWorkerPool(lambda item: do_process_stdin_dump_text_on_page(*item), num_workers,
+                                 get_worker_state=get_worker_state, merge_worker_state=merge_worker_state)
+        do_parse_dump(lambda index, pagetitle, text: pool.submit((index, pagetitle, text)))
+        pool.finish()
+      else:
+        do_parse_dump(do_process_stdin_dump_text_on_page)
 
   elif args_has_non_default_pages(args):
     args_filter_cats = args.filter_cats
     args_prune_cats = args.prune_cats
     if args.pages:
       pages = split_arg(args.pages, canonicalize=canonicalize_pagename)
-      for index, pagetitle in iter_items(pages, start, end):
-        process_pywikibot_page(index, pywikibot.Page(site, pagetitle))
+      for index, page in maybe_prefetch((index, pywikibot.Page(site, pagetitle))
+                                        for index, pagetitle in iter_items(pages, start, end)):
+        process_pywikibot_page(index, page)
     if args.pagefile:
-      for index, pagetitle in iter_items_from_file(args.pagefile, start, end, canonicalize=canonicalize_pagename):
-        process_pywikibot_page(index, pywikibot.Page(site, pagetitle))
+      for index, page in maybe_prefetch((index, pywikibot.Page(site, pagetitle)) for index, pagetitle in
+          iter_items_from_file(args.pagefile, start, end, canonicalize=canonicalize_pagename)):
+        process_pywikibot_page(index, page)
     if args.pages_from_find_regex:
       index_pagetitle_text_comment = yield_text_from_find_regex(
         open(args.pages_from_find_regex, "r", encoding="utf-8"), args.verbose
       )
-      for index, (_, pagetitle, _, _) in iter_items(index_pagetitle_text_comment, start, end,
-          get_name=lambda x:x[1], get_index=None if args.ignore_embedded_page_indices else lambda x:x[0]):
-        process_pywikibot_page(index, pywikibot.Page(site, pagetitle))
+      for index, page in maybe_prefetch((index, pywikibot.Page(site, pagetitle)) for index, (_, pagetitle, _, _) in
+          iter_items(index_pagetitle_text_comment, start, end, get_name=lambda x:x[1],
+                     get_index=None if args.ignore_embedded_page_indices else lambda x:x[0])):
+        process_pywikibot_page(index, page)
     if args.pages_from_previous_output:
       index_pagetitle = yield_pages_from_previous_output(
         open(args.pages_from_previous_output, "r", encoding="utf-8"), args.verbose
       )
-      for index, (_, pagetitle) in iter_items(index_pagetitle, start, end,
-          get_name=lambda x:x[1], get_index=None if args.ignore_embedded_page_indices else lambda x:x[0]):
-        process_pywikibot_page(index, pywikibot.Page(site, pagetitle))
+      for index, page in maybe_prefetch((index, pywikibot.Page(site, pagetitle)) for index, (_, pagetitle) in
+          iter_items(index_pagetitle, start, end, get_name=lambda x:x[1],
+                     get_index=None if args.ignore_embedded_page_indices else lambda x:x[0])):
+        process_pywikibot_page(index, page)
     if args.cats or args.category_file:
       def do_cat(cat):
+        listing_key = ["cat", cat, start, end, args_filter_cats, args_prune_cats, args.recursive, args.track_seen]
         if args.do_cat_and_subcats:
-          for index, subcat in cat_subcats(cat, start, end, seen=seen, filter_cats_regex=args_filter_cats,
-                                           prune_cats_regex=args_prune_cats, do_this_page=True,
-                                           recurse=args.recursive):
+          for index, subcat in maybe_prefetch(journaled_listing(listing_key + ["cat_and_subcats"],
+              lambda: cat_subcats(cat, start, end, seen=seen, filter_cats_regex=args_filter_cats,
+                                  prune_cats_regex=args_prune_cats, do_this_page=True, recurse=args.recursive),
+              adds_to_seen=True, page_class=pywikibot.Category)):
             process_pywikibot_page(index, subcat, no_check_seen=True)
         elif args.do_subcats:
-          for index, subcat in cat_subcats(cat, start, end, seen=seen, filter_cats_regex=args_filter_cats,
-                                           prune_cats_regex=args_prune_cats, do_this_page=False,
-                                           recurse=args.recursive):
+          for index, subcat in maybe_prefetch(journaled_listing(listing_key + ["subcats"],
+              lambda: cat_subcats(cat, start, end, seen=seen, filter_cats_regex=args_filter_cats,
+                                  prune_cats_regex=args_prune_cats, do_this_page=False, recurse=args.recursive),
+              adds_to_seen=True, page_class=pywikibot.Category)):
             process_pywikibot_page(index, subcat, no_check_seen=True)
+        elif link_index:
+          for index, page in maybe_prefetch(journaled_listing(listing_key + ["articles"],
+              lambda: cat_articles_from_index(
+                link_index, cat, start, end, seen=seen, filter_cats_regex=args_filter_cats,
+                prune_cats_regex=args_prune_cats, recurse=args.recursive, track_seen=args.track_seen),
+              adds_to_seen=True)):
+            process_pywikibot_page(index, page, no_check_seen=True)
         else:
-          for index, page in cat_articles(cat, start, end, seen=seen, filter_cats_regex=args_filter_cats,
-                                          prune_cats_regex=args_prune_cats, recurse=args.recursive,
-                                          track_seen=args.track_seen):
+          for index, page in maybe_prefetch(journaled_listing(listing_key + ["articles"],
+              lambda: cat_articles(
+                cat, start, end, seen=seen, filter_cats_regex=args_filter_cats, prune_cats_regex=args_prune_cats,
+                recurse=args.recursive, track_seen=args.track_seen),
+              adds_to_seen=True)):
             process_pywikibot_page(index, page, no_check_seen=True)
       if args.cats:
         for cat in split_arg(args.cats):
@@ -1547,61 +3060,858 @@ def do_pagefile_cats_refs(
     if args.refs:
       for ref in split_arg(args.refs):
         # We don't use ref_namespaces here because the user might not want it.
-        for index, page in references(ref, start, end, namespaces=args_ref_namespaces):
+        def make_refs_listing():
+          if link_index:
+            return refs_from_index(link_index, ref, start, end, namespaces=args_ref_namespaces)
+          else:
+            return references(ref, start, end, namespaces=args_ref_namespaces)
+        for index, page in maybe_prefetch(journaled_listing(["refs", ref, start, end, args_ref_namespaces],
+                                                            make_refs_listing)):
           process_pywikibot_page(index, page)
     if args.pages_and_refs:
       for page_and_ref in split_arg(args.pages_and_refs):
         # We don't use ref_namespaces here because the user might not want it.
-        for index, page in references(page_and_ref, start, end, namespaces=args_ref_namespaces,
-            include_page=True):
+        def make_refs_listing():
+          if link_index:
+            return refs_from_index(link_index, page_and_ref, start, end, namespaces=args_ref_namespaces,
+                                   include_page=True)
+          else:
+            return references(page_and_ref, start, end, namespaces=args_ref_namespaces, include_page=True)
+        for index, page in maybe_prefetch(journaled_listing(
+            ["pages_and_refs", page_and_ref, start, end, args_ref_namespaces], make_refs_listing)):
           process_pywikibot_page(index, page)
     if args.specials:
       for special in split_arg(args.specials):
         for index, page in query_special_pages(special, start, end):
           title = str(page.title())
           if args.do_specials_cat_pages and title.startswith("Category:"):
-            for index2, subcat in cat_articles(
+            for index2, subcat in maybe_prefetch(cat_articles(
                 re.sub("^Category:", "", title), seen=seen, filter_cats_regex=args_filter_cats,
-                prune_cats_regex=args_prune_cats, recurse=args.recursive):
+                prune_cats_regex=args_prune_cats, recurse=args.recursive)):
               process_pywikibot_page(index2, subcat, no_check_seen=True)
           if args.do_specials_refs:
             # We don't use ref_namespaces here because the user might not want it.
-            for index2, page2 in references(title, namespaces=args_ref_namespaces):
+            for index2, page2 in maybe_prefetch(references(title, namespaces=args_ref_namespaces)):
               process_pywikibot_page(index2, page2)
           if not args.do_specials_cat_pages and not args.do_specials_refs:
             process_pywikibot_page(index, page)
     if args.contribs:
       for contrib in split_arg(args.contribs):
-        for index, page in query_usercontribs(contrib, start, end, starttime=args.contribs_start, endtime=args.contribs_end):
-          process_pywikibot_page(index, pywikibot.Page(site, page['title']))
+        for index, page in maybe_prefetch((index, pywikibot.Page(site, page['title'])) for index, page in
+            query_usercontribs(contrib, start, end, starttime=args.contribs_start, endtime=args.contribs_end)):
+          process_pywikibot_page(index, page)
     if args.prefix_namespace:
       for prefix in split_arg(args.prefix_pages):
         namespace = args.prefix_namespace
-        for index, page in prefix_pages(
-            prefix, start, end, namespace, filter_redirects=True if args.prefix_redirects_only else None):
+        for index, page in maybe_prefetch(journaled_listing(
+            ["prefix", prefix, start, end, namespace, args.prefix_redirects_only],
+            lambda: prefix_pages(prefix, start, end, namespace,
+                                 filter_redirects=True if args.prefix_redirects_only else None))):
           process_pywikibot_page(index, page)
 
   elif args_namespaces:
     for namespace in args_namespaces:
-      for index, page in prefix_pages(
-          None, start, end, namespace, filter_redirects=True if args.prefix_redirects_only else None):
+      for index, page in maybe_prefetch(journaled_listing(
+          ["prefix", None, start, end, namespace, args.prefix_redirects_only],
+          lambda: prefix_pages(None, start, end, namespace,
+                               filter_redirects=True if args.prefix_redirects_only else None))):
         process_pywikibot_page(index, page)
 
   else:
     if not default_pages and not default_cats and not default_refs:
       raise ValueError("One of --pages, --pagefile, --cats, --refs, --specials, --contribs or --prefix-pages should be specified")
-    for index, pagetitle in iter_items(default_pages, start, end):
-      process_pywikibot_page(index, pywikibot.Page(site, pagetitle))
+    for index, page in maybe_prefetch((index, pywikibot.Page(site, pagetitle))
+                                      for index, pagetitle in iter_items(default_pages, start, end)):
+      process_pywikibot_page(index, page)
     for cat in default_cats:
-      for index, page in cat_articles(cat, start, end, seen=seen, track_seen=args.track_seen):
+      def make_cat_listing():
+        if link_index:
+          return cat_articles_from_index(link_index, cat, start, end, seen=seen, track_seen=args.track_seen)
+        else:
+          return cat_articles(cat, start, end, seen=seen, track_seen=args.track_seen)
+      for index, page in maybe_prefetch(journaled_listing(
+          ["cat", cat, start, end, None, None, False, args.track_seen, "articles"], make_cat_listing,
+          adds_to_seen=True)):
         process_pywikibot_page(index, page, no_check_seen=True)
     for ref in default_refs:
-      for index, page in references(ref, start, end, namespaces=ref_namespaces):
+      def make_refs_listing():
+        if link_index:
+          return refs_from_index(link_index, ref, start, end, namespaces=ref_namespaces)
+        else:
+          return references(ref, start, end, namespaces=ref_namespaces)
+      for index, page in maybe_prefetch(journaled_listing(["refs", ref, start, end, ref_namespaces],
+                                                          make_refs_listing)):
         process_pywikibot_page(index, page)
 
+  if parallel_pool:
+    parallel_pool.finish()
+  if list_pages_fp is not None:
+    list_pages_fp.close()
+
   elapsed_time()
 
+# A local, read-only store of page texts, as created by write_page_store() (see build_page_store.py). The store is a
+# directory containing three files:
+#
+# * `texts.dat`: the zlib-compressed texts of the pages, concatenated;
+# * `titles.dat`: the UTF-8-encoded titles of the pages, concatenated;
+# * `index.dat`: one fixed-size record per page (see `page_store_record`), sorted by UTF-8-encoded title, holding the
+#   offsets and lengths of the page's title and text along with its revision ID and namespace.
+#
+# The index and titles are memory-mapped and looked up using binary search, so opening a store is instantaneous
+# regardless of its size, and only the pages actually looked up are read and decompressed.
+page_store_record = struct.Struct("<QIQIqi")
+
+class PageStore(object):
+  def __init__(self, path):
+    self.path = path
+    self.texts = open(os.path.join(path, "texts.dat"), "rb")
+    self.titles_fp = open(os.path.join(path, "titles.dat"), "rb")
+    self.index_fp = open(os.path.join(path, "index.dat"), "rb")
+    self.titles = self.mmap_file(self.titles_fp)
+    self.index = self.mmap_file(self.index_fp)
+    self.num_pages = len(self.index) // page_store_record.size
+
+  @staticmethod
+  def mmap_file(fp):
+    if os.fstat(fp.fileno()).st_size == 0:
+      # Can't mmap an empty file.
+      return b""
+    return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+  def __len__(self):
+    return self.num_pages
+
+  def __contains__(self, title):
+    return self.find_record(title) is not None
+
+  def get_record(self, i):
+    return page_store_record.unpack_from(self.index, i * page_store_record.size)
+
+  def get_title_bytes(self, record):
+    title_offset, title_len = record[0], record[1]
+    return self.titles[title_offset:title_offset + title_len]
+
+  def find_record(self, title):
+    title_bytes = title.encode("utf-8")
+    lo = 0
+    hi = self.num_pages
+    while lo < hi:
+      mid = (lo + hi) // 2
+      record = self.get_record(mid)
+      mid_title_bytes = self.get_title_bytes(record)
+      if mid_title_bytes == title_bytes:
+        return record
+      if mid_title_bytes < title_bytes:
+        lo = mid + 1
+      else:
+        hi = mid
+    return None
+
+  # Read with os.pread() rather than seek() and read(), since the file offset is shared with the worker processes
+  # forked by --parallel.
+  def read_text(self, record):
+    return zlib.decompress(os.pread(self.texts.fileno(), record[3], record[2])).decode("utf-8")
+
+  # Return a tuple (TEXT, REVID, NAMESPACE) for the page titled `title`, or None if the page isn't in the store.
+  def lookup(self, title):
+    record = self.find_record(title)
+    if record is None:
+      return None
+    return self.read_text(record), record[4], record[5]
+
+  # Iterate over the titles in the store, in sorted order (by UTF-8 bytes, which is also code point order).
+  def iter_titles(self):
+    for i in range(self.num_pages):
+      yield self.get_title_bytes(self.get_record(i)).decode("utf-8")
+
+  def close(self):
+    for mapped in [self.titles, self.index]:
+      if isinstance(mapped, mmap.mmap):
+        mapped.close()
+    for fp in [self.texts, self.titles_fp, self.index_fp]:
+      fp.close()
+
+# Write a page store to the directory `path` (which is created if necessary) from `pages`, an iterable of tuples
+# (TITLE, NAMESPACE, REVID, TEXT) such as is returned by iter_dump_pages(); tuples with TEXT set to None are ignored.
+# If the same title occurs more than once, the last occurrence wins. Returns the number of pages stored.
+def write_page_store(path, pages, compress_level=6):
+  os.makedirs(path, exist_ok=True)
+  records = {}
+  with open(os.path.join(path, "texts.dat"), "wb") as texts_fp:
+    text_offset = 0
+    for title, ns, revid, text in pages:
+      if text is None:
+        continue
+      compressed = zlib.compress(text.encode("utf-8"), compress_level)
+      texts_fp.write(compressed)
+      records[title.encode("utf-8")] = (text_offset, len(compressed), revid or 0, ns or 0)
+      text_offset += len(compressed)
+  with open(os.path.join(path, "titles.dat"), "wb") as titles_fp, open(
+      os.path.join(path, "index.dat"), "wb") as index_fp:
+    title_offset = 0
+    for title_bytes in sorted(records):
+      text_offset, text_len, revid, ns = records[title_bytes]
+      titles_fp.write(title_bytes)
+      index_fp.write(page_store_record.pack(title_offset, len(title_bytes), text_offset, text_len, revid, ns))
+      title_offset += len(title_bytes)
+  return len(records)
+
+# Namespaces whose prefixes are recognized in template and category names when building a LinkIndex; other prefixes
+# are taken to be part of a template name in the Template: namespace.
+link_index_namespace_prefixes = {
+  "Template": 10, "Module": 828, "Category": 14, "Appendix": 100, "Wiktionary": 4, "User": 2,
+  "Reconstruction": 118, "Thesaurus": 110, "Citations": 114, "MediaWiki": 8, "Help": 12,
+}
+
+_link_index_template_re = re.compile(r"\{\{\s*([^{}|\n<>\[\]]+?)\s*(?:\||\}\})")
+_link_index_category_re = re.compile(r"\[\[\s*[Cc][Aa][Tt][Ee][Gg][Oo][Rr][Yy]\s*:\s*([^\[\]|\n{}]+?)\s*(?:\||\]\])")
+_link_index_redirect_re = re.compile(r"\A\s*#\s*REDIRECT\s*:?\s*\[\[\s*:?\s*([^\[\]|#\n]+?)\s*(?:[|#][^\]]*)?\]\]", re.I)
+
+# Normalize a link target or template name to a full page title, using `default_prefix` (e.g. "Template:") if it
+# doesn't have a recognized namespace prefix. Returns None for names that can't be page titles (parser functions, magic
+# words with arguments, etc.). The case of the first letter is preserved, as Wiktionary titles are case-sensitive.
+def normalize_link_index_title(name, default_prefix=""):
+  name = re.sub(r"[_\s]+", " ", name).strip()
+  if not name or name.startswith("#") or "{" in name:
+    return None
+  if name.startswith(":"):
+    name = name[1:].strip()
+    default_prefix = ""
+  if ":" in name:
+    prefix, rest = name.split(":", 1)
+    prefix = ucfirst(prefix.strip().lower())
+    if prefix in link_index_namespace_prefixes:
+      return "%s:%s" % (prefix, rest.strip())
+    if prefix.lower() in ["subst", "safesubst", "msgnw", "raw"]:
+      return normalize_link_index_title(rest, default_prefix)
+    if default_prefix:
+      # Magic words with arguments, e.g. {{lc:FOO}}, {{DISPLAYTITLE:...}}.
+      return None
+  return default_prefix + name
+
+# Extract the templates and modules transcluded by `text`, the categories it is explicitly placed in and the target of
+# the redirect if it is a redirect. Returns a tuple of (TRANSCLUSIONS, CATEGORIES, REDIRECT_TARGET), where
+# TRANSCLUSIONS is a set of full page titles (e.g. "Template:l", "Module:links"), CATEGORIES is a set of category names
+# without the "Category:" prefix and REDIRECT_TARGET is a full page title or None. Only explicit category links are
+# seen; categories added by templates (e.g. headword or {{lb}} categories) can't be determined without expanding the
+# templates.
+def extract_page_links(text):
+  transclusions = set()
+  for m in _link_index_template_re.finditer(text):
+    name = m.group(1)
+    if name.startswith("#"):
+      m2 = re.match(r"#invoke\s*:\s*(.+)", name, re.I)
+      if m2:
+        title = normalize_link_index_title(m2.group(1), "Module:")
+        if title:
+          transclusions.add(title)
+      continue
+    title = normalize_link_index_title(name, "Template:")
+    if title:
+      transclusions.add(title)
+  categories = set()
+  for m in _link_index_category_re.finditer(text):
+    categories.add(re.sub(r"[_\s]+", " ", m.group(1)).strip())
+  redirect = None
+  m = _link_index_redirect_re.match(text)
+  if m:
+    redirect = normalize_link_index_title(m.group(1))
+  return transclusions, categories, redirect
+
+# Write an offline template-transclusion and category-membership index to `path` (an SQLite database, which is
+# replaced if it exists) from `pages`, an iterable of tuples (TITLE, NAMESPACE, REVID, TEXT) as returned by
+# iter_dump_pages(); tuples with TEXT set to None are ignored. Returns the number of pages indexed.
+def write_link_index(path, pages, batch_size=10000):
+  if os.path.exists(path):
+    os.unlink(path)
+  conn = sqlite3.connect(path)
+  conn.executescript("""
+    CREATE TABLE pages (id INTEGER PRIMARY KEY, title TEXT NOT NULL, ns INTEGER NOT NULL);
+    CREATE TABLE transclusions (target TEXT NOT NULL, page INTEGER NOT NULL);
+    CREATE TABLE categories (category TEXT NOT NULL, page INTEGER NOT NULL);
+    CREATE TABLE redirects (page INTEGER PRIMARY KEY, target TEXT NOT NULL);
+  """)
+  num_pages = 0
+  page_rows = []
+  transclusion_rows = []
+  category_rows = []
+  redirect_rows = []
+  def flush():
+    conn.executemany("INSERT INTO pages VALUES (?, ?, ?)", page_rows)
+    conn.executemany("INSERT INTO transclusions VALUES (?, ?)", transclusion_rows)
+    conn.executemany("INSERT INTO categories VALUES (?, ?)", category_rows)
+    conn.executemany("INSERT INTO redirects VALUES (?, ?)", redirect_rows)
+    del page_rows[:], transclusion_rows[:], category_rows[:], redirect_rows[:]
+  for title, ns, revid, text in pages:
+    if text is None:
+      continue
+    num_pages += 1
+    page_rows.append((num_pages, title, ns or 0))
+    transclusions, categories, redirect = extract_page_links(text)
+    transclusion_rows.extend((target, num_pages) for target in transclusions)
+    category_rows.extend((category, num_pages) for category in categories)
+    if redirect:
+      redirect_rows.append((num_pages, redirect))
+    if len(page_rows) >= batch_size:
+      flush()
+  flush()
+  conn.executescript("""
+    CREATE INDEX pages_title ON pages (title);
+    CREATE INDEX transclusions_target ON transclusions (target);
+    CREATE INDEX categories_category ON categories (category);
+    CREATE INDEX redirects_target ON redirects (target);
+  """)
+  conn.commit()
+  conn.close()
+  return num_pages
+
+# An offline template-transclusion and category-membership index built from a dump by write_link_index() (see
+# build_link_index.py), used in place of live reference and category listings.
+class LinkIndex(object):
+  def __init__(self, path):
+    if not os.path.exists(path):
+      raise ValueError("Link index %s doesn't exist" % path)
+    self.conn = sqlite3.connect(path)
+
+  # Return the titles of the pages that redirect to `title`.
+  def redirects_to(self, title):
+    return [row[0] for row in self.conn.execute(
+      "SELECT pages.title FROM redirects JOIN pages ON pages.id = redirects.page WHERE redirects.target = ?",
+      (title,))]
+
+  # Return a list of (ID, TITLE, NAMESPACE) for the pages transcluding `title` (a full page title such as
+  # "Template:l"), directly, through a redirect to it, or (if `indirect`) through other templates or modules that
+  # transclude it, in dump order.
+  def transcluding_pages(self, title, indirect=True):
+    targets_seen = set()
+    targets_to_do = [title]
+    pages = {}
+    while targets_to_do:
+      target = targets_to_do.pop()
+      if target in targets_seen:
+        continue
+      targets_seen.add(target)
+      targets_to_do.extend(self.redirects_to(target))
+      for pageid, pagetitle, ns in self.conn.execute(
+          "SELECT pages.id, pages.title, pages.ns FROM transclusions JOIN pages ON pages.id = transclusions.page "
+          "WHERE transclusions.target = ?", (target,)):
+        if pageid not in pages:
+          pages[pageid] = (pageid, pagetitle, ns)
+          if indirect and ns in [10, 828]:
+            targets_to_do.append(pagetitle)
+    return [pages[pageid] for pageid in sorted(pages)]
+
+  # Return a list of (ID, TITLE, NAMESPACE) for the pages explicitly placed in category `cat` (with or without the
+  # "Category:" prefix) or a category redirecting to it, in dump order.
+  def category_members(self, cat):
+    cat = re.sub("^Category:", "", cat)
+    cats = [cat] + [re.sub("^Category:", "", redirect) for redirect in self.redirects_to("Category:" + cat)]
+    pages = {}
+    for thiscat in cats:
+      for row in self.conn.execute(
+          "SELECT pages.id, pages.title, pages.ns FROM categories JOIN pages ON pages.id = categories.page "
+          "WHERE categories.category = ?", (thiscat,)):
+        pages[row[0]] = row
+    return [pages[pageid] for pageid in sorted(pages)]
+
+# Return True if a page with title `pagetitle` in namespace number `ns` is in one of `namespaces`, a list of namespace
+# numbers (as integers or strings of digits) or names.
+def page_in_namespaces(pagetitle, ns, namespaces):
+  for namespace in namespaces:
+    if isinstance(namespace, int) or re.search("^[0-9]+$", namespace):
+      if ns == int(namespace):
+        return True
+    elif namespace == "-":
+      if ns == 0:
+        return True
+    elif pagetitle.startswith(namespace + ":"):
+      return True
+  return False
+
+# Like references(), but using `link_index` (a LinkIndex) instead of querying the server. Only transclusions are
+# returned (as with only_template_inclusion=True), but including indirect transclusions through other templates and
+# modules, as the server does.
+def refs_from_index(link_index, page, startprefix=None, endprefix=None, namespaces=None, include_page=False):
+  if not isinstance(page, str):
+    page = str(page.title())
+  refs = [pagetitle for _, pagetitle, ns in link_index.transcluding_pages(page)
+          if not namespaces or page_in_namespaces(pagetitle, ns, namespaces)]
+  if include_page:
+    refs = [page] + refs
+  for i, pagetitle in iter_items(refs, startprefix, endprefix):
+    yield i, pywikibot.Page(site, pagetitle)
+
+# Like raw_cat_articles(), but using `link_index` (a LinkIndex) instead of querying the server. `seen`,
+# `filter_cats_regex`, `prune_cats_regex` and `recurse` have the same meaning. Only explicit category links are
+# indexed, so pages categorized by templates are missing; see extract_page_links().
+def raw_cat_articles_from_index(link_index, cat, seen, filter_cats_regex=None, prune_cats_regex=None, recurse=False):
+  cat = re.sub("^Category:", "", cat)
+  cats_seen = set()
+  def yield_cat_articles(cat):
+    if cat in cats_seen:
+      return
+    cats_seen.add(cat)
+    if recurse:
+      if filter_cats_regex and not re.search(filter_cats_regex, cat):
+        msg("Skipping category '%s' as it doesn't match --filter-cats regex '%s'" % (cat, filter_cats_regex))
+        return
+      if prune_cats_regex and re.search(prune_cats_regex, cat):
+        msg("Skipping category '%s' as it matches --prune-cats regex '%s'" % (cat, prune_cats_regex))
+        return
+    members = link_index.category_members(cat)
+    for _, pagetitle, ns in members:
+      if ns == 14:
+        continue
+      if seen is None:
+        yield pagetitle
+      elif pagetitle not in seen:
+        seen.add(pagetitle)
+        yield pagetitle
+    if recurse:
+      for _, pagetitle, ns in members:
+        if ns == 14:
+          for article in yield_cat_articles(re.sub("^Category:", "", pagetitle)):
+            yield article
+  for article in yield_cat_articles(cat):
+    yield article
+
+# Like cat_articles(), but using `link_index` (a LinkIndex) instead of querying the server.
+def cat_articles_from_index(link_index, cat, startprefix=None, endprefix=None, seen=None, filter_cats_regex=None,
+                            prune_cats_regex=None, recurse=False, track_seen=False):
+  if seen is None and track_seen:
+    seen = set()
+  for i, pagetitle in iter_items(raw_cat_articles_from_index(
+      link_index, cat, seen, filter_cats_regex=filter_cats_regex, prune_cats_regex=prune_cats_regex,
+      recurse=recurse), startprefix, endprefix):
+    yield i, pywikibot.Page(site, pagetitle)
+
+# Per-phase timing of a run, enabled using --metrics (see start_run_metrics()). The time spent in each of the
+# following phases is recorded, along with the number of calls and (for a random sample of at most
+# `max_samples_per_phase` calls) the time each call took:
+#   "fetch": fetching page text (safe_page_text(), parse() and prefetch_pages());
+#   "parse_text": parsing text with mwparserfromhell (parse cache hits aren't counted);
+#   "process": the script's own processing function, not counting time spent in the other phases while it runs;
+#   "expand_text": expand_text() and the requests made by expand_many();
+#   "diff": show_diff();
+#   "save": saving pages, including those saved by the save queue's thread.
+# The time taken by each page as a whole is recorded the same way under "page". The time of a phase not counting the
+# phases nested within it is what's reported as its share of the run, so the shares add up to at most 100% (except
+# that saves done in the background by --save-queue overlap with the other phases). API requests are also counted by
+# kind (see api_call_kind()), by intercepting Pywikibot's API requests.
+#
+# A breakdown is output to stderr every `report_interval` pages and at the end by elapsed_time(). If `output_file` is
+# given, the metrics are also written to it each time, as JSON or, if the file is named "*.prom", in the Prometheus
+# text format (e.g. for the node exporter's textfile collector). The file is replaced atomically.
+metrics_phases = ["fetch", "parse_text", "process", "expand_text", "diff", "save"]
+
+class RunMetrics(object):
+  max_samples_per_phase = 10000
+
+  def __init__(self, report_interval=500, output_file=None):
+    self.report_interval = report_interval
+    self.output_file = output_file
+    self.start = time.time()
+    self.lock = threading.Lock()
+    # Per-thread stack of [PHASE, TIME_IN_NESTED_PHASES] for the phases currently being timed.
+    self.local = threading.local()
+    self.reset()
+
+  def reset(self):
+    self.calls = defaultdict(int)
+    self.seconds = defaultdict(float)
+    self.samples = defaultdict(list)
+    self.api_calls = defaultdict(int)
+
+  def stack(self):
+    stack = getattr(self.local, "stack", None)
+    if stack is None:
+      stack = self.local.stack = []
+    return stack
+
+  # Context manager timing a call in `phase`. A phase entered again while already being timed in the same thread
+  # (e.g. a processing function called through nested wrappers) isn't counted again.
+  @contextlib.contextmanager
+  def phase(self, phase):
+    stack = self.stack()
+    if any(entry[0] == phase for entry in stack):
+      yield
+      return
+    entry = [phase, 0.0]
+    stack.append(entry)
+    tstart = time.perf_counter()
+    try:
+      yield
+    finally:
+      elapsed = time.perf_counter() - tstart
+      stack.pop()
+      if stack:
+        stack[-1][1] += elapsed
+      self.record(phase, elapsed, elapsed - entry[1])
+
+  def record(self, phase, elapsed, own_elapsed):
+    with self.lock:
+      self.calls[phase] += 1
+      self.seconds[phase] += own_elapsed
+      samples = self.samples[phase]
+      if len(samples) < self.max_samples_per_phase:
+        samples.append(elapsed)
+      else:
+        # Reservoir sampling, so the samples are a uniform sample of all calls.
+        i = random.randrange(self.calls[phase])
+        if i < self.max_samples_per_phase:
+          samples[i] = elapsed
+
+  # Context manager timing the processing of a page. Nested pages (e.g. do_edit() called while processing a page from
+  # do_pagefile_cats_refs()) count once.
+  @contextlib.contextmanager
+  def page(self):
+    if getattr(self.local, "in_page", False):
+      yield
+      return
+    self.local.in_page = True
+    tstart = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.local.in_page = False
+      elapsed = time.perf_counter() - tstart
+      self.record("page", elapsed, elapsed)
+      self.maybe_report()
+
+  def count_api_call(self, kind):
+    with self.lock:
+      self.api_calls[kind] += 1
+
+  # Return and reset the metrics collected so far. Used in worker processes, which return the metrics for each item
+  # to the main process to be merged using merge().
+  def take(self):
+    with self.lock:
+      taken = (dict(self.calls), dict(self.seconds), dict(self.samples), dict(self.api_calls))
+      self.reset()
+    return taken
+
+  def merge(self, taken):
+    calls, seconds, samples, api_calls = taken
+    with self.lock:
+      for phase, count in calls.items():
+        self.calls[phase] += count
+      for phase, secs in seconds.items():
+        self.seconds[phase] += secs
+      for phase, phase_samples in samples.items():
+        space = self.max_samples_per_phase - len(self.samples[phase])
+        self.samples[phase].extend(phase_samples[:space])
+      for kind, count in api_calls.items():
+        self.api_calls[kind] += count
+    if calls.get("page"):
+      self.maybe_report()
+
+  def maybe_report(self):
+    pages = self.calls["page"]
+    if self.report_interval and pages and pages % self.report_interval == 0:
+      self.report(errmsg)
+
+  @staticmethod
+  def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+      return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))]
+
+  # Return the metrics as a dictionary, as written to a JSON output file.
+  def summary(self):
+    with self.lock:
+      elapsed = time.time() - self.start
+      pages = self.calls.get("page", 0)
+      summary = {"script": os.path.basename(sys.argv[0]), "elapsed_seconds": elapsed, "pages": pages,
+                 "pages_per_second": pages / elapsed if elapsed > 0 else 0.0, "phases": {},
+                 "api_calls": dict(self.api_calls)}
+      for phase in ["page"] + metrics_phases:
+        samples = sorted(self.samples.get(phase, []))
+        summary["phases"][phase] = {
+          "calls": self.calls.get(phase, 0), "seconds": self.seconds.get(phase, 0.0),
+          "p50_seconds": self.percentile(samples, 0.5), "p95_seconds": self.percentile(samples, 0.95)}
+    return summary
+
+  # Output a breakdown of the metrics using `output` (e.g. msg() or errmsg()) and write the output file if any.
+  def report(self, output):
+    summary = self.summary()
+    elapsed = summary["elapsed_seconds"]
+    page = summary["phases"]["page"]
+    output("Metrics: %s pages in %0.1f secs, %0.2f pages/sec; per page p50 %0.1f ms, p95 %0.1f ms" % (
+      summary["pages"], elapsed, summary["pages_per_second"], 1000 * page["p50_seconds"],
+      1000 * page["p95_seconds"]))
+    for phase in metrics_phases:
+      stats = summary["phases"][phase]
+      if stats["calls"]:
+        output("  %s: %s calls, %0.1f secs (%0.1f%%), p50 %0.1f ms, p95 %0.1f ms" % (
+          phase, stats["calls"], stats["seconds"], 100.0 * stats["seconds"] / elapsed if elapsed > 0 else 0.0,
+          1000 * stats["p50_seconds"], 1000 * stats["p95_seconds"]))
+    if summary["api_calls"]:
+      output("  API requests: %s" % ", ".join("%s %s" % (kind, count)
+                                              for kind, count in sorted(summary["api_calls"].items())))
+    if self.output_file:
+      self.write_output_file(summary)
+
+  def write_output_file(self, summary):
+    if self.output_file.endswith(".prom"):
+      contents = metrics_to_prometheus(summary)
+    else:
+      contents = json.dumps(summary, indent=2) + "\n"
+    temp_file = self.output_file + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as fp:
+      fp.write(contents)
+    os.replace(temp_file, self.output_file)
+
+# Convert the metrics summary returned by RunMetrics.summary() to the Prometheus text format.
+def metrics_to_prometheus(summary):
+  def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+  script = 'script="%s"' % escape_label(summary["script"])
+  lines = []
+  def metric(name, metric_type, help, values):
+    lines.append("# HELP %s %s" % (name, help))
+    lines.append("# TYPE %s %s" % (name, metric_type))
+    for labels, value in values:
+      lines.append("%s{%s} %r" % (name, ",".join([script] + labels), value))
+  metric("blib_pages_total", "counter", "Pages processed.", [([], summary["pages"])])
+  metric("blib_elapsed_seconds", "gauge", "Time since the run started.", [([], summary["elapsed_seconds"])])
+  metric("blib_pages_per_second", "gauge", "Pages processed per second over the whole run.",
+         [([], summary["pages_per_second"])])
+  phases = summary["phases"]
+  metric("blib_phase_calls_total", "counter", "Calls made in each phase.",
+         [(['phase="%s"' % phase], stats["calls"]) for phase, stats in phases.items()])
+  metric("blib_phase_seconds_total", "counter", "Time spent in each phase, not counting nested phases.",
+         [(['phase="%s"' % phase], stats["seconds"]) for phase, stats in phases.items()])
+  metric("blib_phase_latency_seconds", "gauge", "Time taken by calls in each phase (sampled quantiles).",
+         [(['phase="%s"' % phase, 'quantile="%s"' % quantile], stats["p%s_seconds" % percent])
+          for phase, stats in phases.items() for quantile, percent in [("0.5", 50), ("0.95", 95)]])
+  metric("blib_api_requests_total", "counter", "API requests made, by kind.",
+         [(['kind="%s"' % escape_label(kind)], count) for kind, count in sorted(summary["api_calls"].items())])
+  return "\n".join(lines) + "\n"
+
+# The active RunMetrics, if any; see start_run_metrics().
+run_metrics = None
+
+# Context manager that does nothing, returned when there's nothing to time or profile.
+null_context = contextlib.nullcontext()
+
+# Return a context manager timing a call in `phase` if --metrics is in effect; see RunMetrics.phase().
+def metrics_phase(phase):
+  if run_metrics is None:
+    return null_context
+  return run_metrics.phase(phase)
+
+# Return a context manager timing the processing of a page if --metrics is in effect; see RunMetrics.page().
+def metrics_page():
+  if run_metrics is None:
+    return null_context
+  return run_metrics.page()
+
+# Return the kind of API request made with the parameters `params`, for the counts of requests by kind.
+def api_call_kind(params):
+  def param(name):
+    value = params.get(name) or ""
+    if not isinstance(value, str):
+      value = "|".join(str(v) for v in value)
+    return set(value.split("|")) - {""}
+  action = param("action")
+  if "query" in action:
+    prop = param("prop")
+    lists = param("list") | param("generator")
+    if "revisions" in prop:
+      return "page_text"
+    if "categorymembers" in lists:
+      return "category_listing"
+    if lists & {"embeddedin", "backlinks", "transcludedin"} or "transcludedin" in prop:
+      return "references"
+    if "allpages" in lists:
+      return "prefix_listing"
+    if "usercontribs" in lists:
+      return "contribs"
+    return "query"
+  if "edit" in action:
+    return "save"
+  return "|".join(sorted(action)) or "other"
+
+# Wrap Pywikibot's Request.submit() so that each API request waits for the rate limiter (with --rate-limit; see
+# RateLimiter) and is counted by kind (with --metrics; see api_call_kind()).
+def install_api_request_hook():
+  request_class = importlib.import_module("pywikibot.data.api").Request
+  if getattr(request_class, "blib_hooked", False):
+    return
+  submit = request_class.submit
+  def hooked_submit(self, *args, **kwargs):
+    if rate_limiter is not None:
+      rate_limiter.acquire()
+    if run_metrics is not None:
+      run_metrics.count_api_call(api_call_kind(getattr(self, "_params", None) or {}))
+    return submit(self, *args, **kwargs)
+  request_class.submit = hooked_submit
+  request_class.blib_hooked = True
+
+# Install the API request hook now if Pywikibot has been imported, otherwise once it is.
+def hook_api_requests():
+  if "pywikibot" in sys.modules:
+    install_api_request_hook()
+  else:
+    pywikibot.on_import(install_api_request_hook)
+
+# Start collecting metrics; see RunMetrics. Normally called automatically when the arguments of a parser returned by
+# create_argparser() are parsed and --metrics or --metrics-file is given. Pywikibot's API requests are counted once
+# it has been imported.
+def start_run_metrics(report_interval=500, output_file=None):
+  global run_metrics
+  if run_metrics is None:
+    run_metrics = RunMetrics(report_interval=report_interval, output_file=output_file)
+    hook_api_requests()
+  return run_metrics
+
+# Profile of the script's processing function, enabled using --profile (see start_callback_profiler()). Only the calls
+# of the processing function (wrapped by do_edit() and do_pagefile_cats_refs() using process_callback()) are
+# profiled, including whatever they call, so the profile isn't swamped by blib's own overhead in fetching pages or
+# reading dumps. A random fraction `sample_rate` of the pages are profiled; the profiles are aggregated over all
+# pages. The time taken by the processing function is recorded for every page, so as to list the `num_slowest` slowest
+# pages. At the end, elapsed_time() outputs a report and writes the profile to `output_file` in pstats format.
+class CallbackProfiler(object):
+  report_lines = 40
+
+  def __init__(self, sample_rate=1.0, num_slowest=20, output_file=None):
+    self.sample_rate = sample_rate
+    self.num_slowest = num_slowest
+    self.output_file = output_file or "%s.pstats" % os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    # Profiles of pages processed by worker processes; see merge().
+    self.merged_stats = None
+    self.depth = 0
+    self.reset()
+
+  def reset(self):
+    self.profiler = cProfile.Profile()
+    self.has_profile = False
+    self.pages = 0
+    self.pages_profiled = 0
+    # Heap of (SECONDS, SEQUENCE_NUMBER, INDEX, TITLE) for the slowest pages.
+    self.slowest = []
+    self.sequence_number = 0
+
+  # Context manager around a call of the processing function for the page at `index` titled `pagetitle`. Calls
+  # nested within another call count as part of it.
+  @contextlib.contextmanager
+  def callback(self, index, pagetitle):
+    if self.depth:
+      yield
+      return
+    profile = self.sample_rate >= 1 or random.random() < self.sample_rate
+    self.depth += 1
+    tstart = time.perf_counter()
+    if profile:
+      self.profiler.enable()
+    try:
+      yield
+    finally:
+      if profile:
+        self.profiler.disable()
+        self.has_profile = True
+        self.pages_profiled += 1
+      self.depth -= 1
+      self.pages += 1
+      self.record_time(time.perf_counter() - tstart, index, pagetitle)
+
+  # Record the time taken to process a page, keeping the slowest pages.
+  def record_time(self, elapsed, index, pagetitle):
+    self.sequence_number += 1
+    entry = (elapsed, self.sequence_number, index, pagetitle)
+    if len(self.slowest) < self.num_slowest:
+      heapq.heappush(self.slowest, entry)
+    elif self.slowest and entry > self.slowest[0]:
+      heapq.heapreplace(self.slowest, entry)
+
+  # Return and reset the profile and page times collected so far. Used in worker processes, which return them for
+  # each item to the main process to be merged using merge().
+  def take(self):
+    stats = None
+    if self.has_profile:
+      self.profiler.create_stats()
+      stats = self.profiler.stats
+    taken = (stats, self.pages, self.pages_profiled, [(elapsed, index, pagetitle)
+                                                      for elapsed, _, index, pagetitle in self.slowest])
+    self.reset()
+    return taken
+
+  def merge(self, taken):
+    stats, pages, pages_profiled, slowest = taken
+    if stats:
+      stats = ProfileStats(stats)
+      if self.merged_stats is None:
+        self.merged_stats = pstats.Stats(stats)
+      else:
+        self.merged_stats.add(stats)
+    self.pages += pages
+    self.pages_profiled += pages_profiled
+    for elapsed, index, pagetitle in slowest:
+      self.record_time(elapsed, index, pagetitle)
+
+  # Return a pstats.Stats of all the profiles, or None if no page was profiled.
+  def stats(self):
+    if not self.has_profile:
+      return self.merged_stats
+    stats = pstats.Stats(self.profiler)
+    if self.merged_stats is not None:
+      stats.add(self.merged_stats)
+    return stats
+
+  # Output the profile sorted by cumulative time, and the slowest pages, using `output` (e.g. msg()), and write the
+  # profile to the output file.
+  def report(self, output):
+    stats = self.stats()
+    output("Profile: profiled processing of %s of %s pages" % (self.pages_profiled, self.pages))
+    if stats is not None:
+      stats.dump_stats(self.output_file)
+      report = io.StringIO()
+      stats.stream = report
+      stats.sort_stats("cumulative", "tottime").print_stats(self.report_lines)
+      output(report.getvalue().strip("\n"))
+      output("Profile written to %s" % self.output_file)
+    if self.slowest:
+      output("Slowest pages:")
+      for elapsed, _, index, pagetitle in sorted(self.slowest, reverse=True):
+        output("  %0.1f ms: Page %s %s" % (1000 * elapsed, index, pagetitle))
+
+# Holder for the statistics of a profile returned from a worker process, in the form that pstats.Stats() accepts.
+class ProfileStats(object):
+  def __init__(self, stats):
+    self.stats = stats
+
+  def create_stats(self):
+    pass
+
+# The active CallbackProfiler, if any; see start_callback_profiler().
+callback_profiler = None
+
+# Start profiling the script's processing function; see CallbackProfiler. Normally called automatically when the
+# arguments of a parser returned by create_argparser() are parsed and --profile is given.
+def start_callback_profiler(sample_rate=1.0, num_slowest=20, output_file=None):
+  global callback_profiler
+  if callback_profiler is None:
+    callback_profiler = CallbackProfiler(sample_rate=sample_rate, num_slowest=num_slowest, output_file=output_file)
+  return callback_profiler
+
+# Return a context manager around a call of the script's processing function for the page at `index` titled
+# `pagetitle`, which times it as the "process" phase if --metrics is in effect and profiles it if --profile is in
+# effect.
+def process_callback(index, pagetitle):
+  if callback_profiler is None:
+    return metrics_phase("process")
+  if run_metrics is None:
+    return callback_profiler.callback(index, pagetitle)
+  return profiled_process_callback(index, pagetitle)
+
+@contextlib.contextmanager
+def profiled_process_callback(index, pagetitle):
+  with metrics_phase("process"), callback_profiler.callback(index, pagetitle):
+    yield
+
 def elapsed_time():
+  finish_save_queue()
   endtime = time.time()
   elapsed = endtime - starttime
   hours = int(elapsed // 3600)
@@ -1612,25 +3922,49 @@ def elapsed_time():
     msg("Elapsed time: %s hours %s mins %0.2f secs" % (hours, mins, secs))
   else:
     msg("Elapsed time: %s mins %0.2f secs" % (mins, secs))
+  if expand_text_cache is not None and any(expand_text_cache.stats.values()):
+    stats = expand_text_cache.stats
+    msg("Expansion cache: %s hits, %s misses, %s outdated, %s not cacheable" % (
+      stats["hits"], stats["misses"], stats["outdated"], stats["uncacheable"]))
+  if local_lua_backend is not None:
+    msg("Local Lua: %s calls expanded locally, %s expanded by the server%s" % (
+      local_lua_stats["local"], local_lua_stats["fallback"],
+      ", %s differing from server" % local_lua_stats["parity_mismatches"] if local_lua_parity else ""))
+  if diff_stats["gave_up"]:
+    msg("Gave up on finding exact differences for %s of %s diffs" % (diff_stats["gave_up"], diff_stats["diffs"]))
+  if expand_many_stats["calls"]:
+    msg("Expanded %s calls in %s batched requests" % (expand_many_stats["calls"], expand_many_stats["requests"]))
+  if prefetch_stats["pages"]:
+    msg("Prefetched text of %s pages in %s requests, saving %s requests" % (
+      prefetch_stats["pages"], prefetch_stats["requests"], prefetch_stats["pages"] - prefetch_stats["requests"]))
+  if category_snapshot is not None:
+    msg("Category snapshot: reused %s category listings, fetched %s" % (
+      category_snapshot.counts["reused"], category_snapshot.counts["fetched"]))
+  if run_journal is not None and any(run_journal.counts.values()):
+    msg("Journal: skipped %s pages done in previous runs, reused %s listings" % (
+      run_journal.counts["skipped"], run_journal.counts["listings_reused"]))
+  if retry_stats["retries"] or retry_stats["skipped"] or retry_stats["failed"]:
+    msg("Retries: %s retries (%s when the server was busy or throttling) waiting %0.1f secs, %s skipped, %s failed" % (
+      retry_stats["retries"], retry_stats["throttled"], retry_stats["retry_seconds"], retry_stats["skipped"],
+      retry_stats["failed"]))
+  if rate_limiter is not None:
+    counts = rate_limiter.counts
+    msg("Rate limiter: %s requests, %s of which waited, for %0.1f secs in all; slowed down %s times" % (
+      counts["requests"], counts["waits"], counts["wait_seconds"], counts["slowdowns"]))
+  if run_metrics is not None:
+    run_metrics.report(msg)
+  if callback_profiler is not None:
+    callback_profiler.report(msg)
   msg("Ending at %s" % time.ctime(endtime))
 
+# Language, etymology-language, family and script data. The lists (`languages`, `etym_languages`, `families`,
+# `scripts`) are set by getLanguageData(), getEtymLanguageData(), getFamilyData() and getScriptData() (or all at once
+# by getData()); the lookup tables by code, canonical name and alias (`languages_byCode`, etc.) are built from the
+# lists the first time they're accessed (see __getattr__() below), as most scripts use only one or two of them.
 languages = None
-languages_byCode = None
-languages_byCanonicalName = None
-languages_byAlias = None
-
 families = None
-families_byCode = None
-families_byCanonicalName = None
-
 scripts = None
-scripts_byCode = None
-scripts_byCanonicalName = None
-
 etym_languages = None
-etym_languages_byCode = None
-etym_languages_byCanonicalName = None
-etym_languages_byAlias = None
 
 wm_languages = None
 wm_languages_byCode = None
@@ -1638,6 +3972,153 @@ wm_languages_byCanonicalName = None
 
 language_aliases_to_canonical = None
 
+def index_data_by_key(data, key):
+  return {item[key]: item for item in data}
+
+def index_data_by_alias(data):
+  by_alias = defaultdict(list)
+  for item in data:
+    if "aliases" in item:
+      for alias in item["aliases"]:
+        assert(type(alias) is str)
+        by_alias[alias].append(item)
+  return by_alias
+
+# Map from name of each lazily built lookup table to the name of the list it's built from and the function building
+# it.
+lazy_data_indexes = {
+  "languages_byCode": ("languages", lambda data: index_data_by_key(data, "code")),
+  "languages_byCanonicalName": ("languages", lambda data: index_data_by_key(data, "canonicalName")),
+  "languages_byAlias": ("languages", index_data_by_alias),
+  "families_byCode": ("families", lambda data: index_data_by_key(data, "code")),
+  "families_byCanonicalName": ("families", lambda data: index_data_by_key(data, "canonicalName")),
+  "scripts_byCode": ("scripts", lambda data: index_data_by_key(data, "code")),
+  "scripts_byCanonicalName": ("scripts", lambda data: index_data_by_key(data, "canonicalName")),
+  "etym_languages_byCode": ("etym_languages", lambda data: index_data_by_key(data, "code")),
+  "etym_languages_byCanonicalName": ("etym_languages", lambda data: index_data_by_key(data, "canonicalName")),
+  "etym_languages_byAlias": ("etym_languages", index_data_by_alias),
+}
+
+# Called for module attributes that don't exist, i.e. the lookup tables in `lazy_data_indexes` that haven't been built
+# yet. A table is None until its list has been loaded, as before.
+def __getattr__(name):
+  if name in lazy_data_indexes:
+    source, build_index = lazy_data_indexes[name]
+    data = globals()[source]
+    if data is None:
+      return None
+    index = build_index(data)
+    globals()[name] = index
+    return index
+  raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+# Set the list `name` (e.g. "languages") to `data`, discarding the lookup tables built from the old list.
+def set_data_list(name, data):
+  globals()[name] = data
+  for index_name, (source, _) in lazy_data_indexes.items():
+    if source == name:
+      globals().pop(index_name, None)
+
+# Local snapshot of the data, as written by dump_lang_data.py: the lists are read from JSONL files (one item per line)
+# and the alias data from a JSON file, and a stamp file records when the snapshot was made. If the directory also
+# contains a pickle made from the same snapshot (dump_lang_data.py --pickle), it's loaded instead, which is much
+# faster. The snapshot is looked for in $BLIB_LANG_DATA_DIR if set, otherwise in the current directory and then the
+# directory containing blib.py. Snapshots older than $BLIB_LANG_DATA_MAX_AGE days (default 7; 0 means no limit) are
+# ignored, in which case the data is fetched from the server as usual. Set $BLIB_LANG_DATA_DIR to an empty string to
+# always fetch the data from the server.
+lang_data_snapshot_files = {
+  "languages": "lang-data.json",
+  "etym_languages": "etymlang-data.json",
+  "families": "family-data.json",
+  "scripts": "script-data.json",
+  "aliases": "alias-data.json",
+}
+lang_data_stamp_file = "lang-data-stamp.json"
+lang_data_pickle_file = "lang-data.pickle"
+lang_data_snapshot_format = 1
+# Dictionary from key in `lang_data_snapshot_files` to the data loaded from the snapshot, or False if there's no usable
+# snapshot; None until first needed.
+lang_data_snapshot = None
+
+def find_lang_data_dir():
+  if "BLIB_LANG_DATA_DIR" in os.environ:
+    return os.environ["BLIB_LANG_DATA_DIR"] or None
+  for dirname in [os.getcwd(), os.path.dirname(os.path.abspath(__file__))]:
+    if os.path.exists(os.path.join(dirname, lang_data_snapshot_files["languages"])):
+      return dirname
+  return None
+
+# Return the stamp of the snapshot in `dirname`. Snapshots made before stamps were written use the modification time
+# of the language data file.
+def read_lang_data_stamp(dirname):
+  stamp_path = os.path.join(dirname, lang_data_stamp_file)
+  if os.path.exists(stamp_path):
+    with open(stamp_path, "r", encoding="utf-8") as fp:
+      return json.load(fp)
+  return {"created": os.path.getmtime(os.path.join(dirname, lang_data_snapshot_files["languages"])),
+          "format": lang_data_snapshot_format}
+
+def write_lang_data_stamp(dirname):
+  stamp = {"created": time.time(), "created_at": time.ctime(), "format": lang_data_snapshot_format}
+  with open(os.path.join(dirname, lang_data_stamp_file), "w", encoding="utf-8") as fp:
+    json.dump(stamp, fp)
+  return stamp
+
+def read_lang_data_files(dirname):
+  snapshot = {}
+  for key, filename in lang_data_snapshot_files.items():
+    path = os.path.join(dirname, filename)
+    if not os.path.exists(path):
+      continue
+    with open(path, "r", encoding="utf-8") as fp:
+      if key == "aliases":
+        snapshot[key] = json.load(fp)
+      else:
+        snapshot[key] = [json_loads(line) for line in fp if line.strip()]
+  return snapshot
+
+def load_lang_data_snapshot():
+  global lang_data_snapshot
+  if lang_data_snapshot is not None:
+    return lang_data_snapshot
+  lang_data_snapshot = False
+  dirname = find_lang_data_dir()
+  if not dirname or not os.path.exists(os.path.join(dirname, lang_data_snapshot_files["languages"])):
+    return lang_data_snapshot
+  stamp = read_lang_data_stamp(dirname)
+  max_age = float(os.environ.get("BLIB_LANG_DATA_MAX_AGE", "7"))
+  age = (time.time() - stamp["created"]) / 86400
+  if stamp.get("format") != lang_data_snapshot_format:
+    errmsg("WARNING: Ignoring language data snapshot in %s with unrecognized format %s" % (dirname, stamp.get("format")))
+    return lang_data_snapshot
+  if max_age and age > max_age:
+    errmsg("WARNING: Ignoring language data snapshot in %s made %.1f days ago; rerun dump_lang_data.py to refresh it"
+           % (dirname, age))
+    return lang_data_snapshot
+  pickle_path = os.path.join(dirname, lang_data_pickle_file)
+  if os.path.exists(pickle_path):
+    with open(pickle_path, "rb") as fp:
+      pickled = pickle.load(fp)
+    if pickled["stamp"] == stamp:
+      lang_data_snapshot = pickled["data"]
+      return lang_data_snapshot
+    errmsg("WARNING: Ignoring language data pickle %s made from a different snapshot" % pickle_path)
+  lang_data_snapshot = read_lang_data_files(dirname)
+  return lang_data_snapshot
+
+# Write the pickle of the snapshot in `dirname` used by load_lang_data_snapshot().
+def write_lang_data_pickle(dirname):
+  with open(os.path.join(dirname, lang_data_pickle_file), "wb") as fp:
+    pickle.dump({"stamp": read_lang_data_stamp(dirname), "data": read_lang_data_files(dirname)}, fp,
+                protocol=pickle.HIGHEST_PROTOCOL)
+
+# Return the data for `key` in `lang_data_snapshot_files` from the local snapshot if available, otherwise by expanding
+# `tempcall` on the server.
+def get_lang_data(key, tempcall):
+  snapshot = load_lang_data_snapshot()
+  if snapshot and key in snapshot:
+    return snapshot[key]
+  return json_loads(site.expand_text(tempcall))
 
 def getData():
   getLanguageData()
@@ -1654,70 +4135,215 @@ def json_loads(data):
     raise
 
 def getLanguageData():
-  global languages, languages_byCode, languages_byCanonicalName, languages_byAlias
-
-  jsondata = site.expand_text("{{#invoke:User:MewBot|getLanguageData}}")
-  languages = json_loads(jsondata)
-  languages_byCode = {}
-  languages_byCanonicalName = {}
-  languages_byAlias = defaultdict(list)
-
-  for lang in languages:
-    languages_byCode[lang["code"]] = lang
-    languages_byCanonicalName[lang["canonicalName"]] = lang
-    if "aliases" in lang:
-      for alias in lang["aliases"]:
-        assert(type(alias) is str)
-        languages_byAlias[alias].append(lang)
+  set_data_list("languages", get_lang_data("languages", "{{#invoke:User:MewBot|getLanguageData}}"))
 
 def getFamilyData():
-  global families, families_byCode, families_byCanonicalName
-
-  families = json_loads(site.expand_text("{{#invoke:User:MewBot|getFamilyData}}"))
-  families_byCode = {}
-  families_byCanonicalName = {}
-
-  for fam in families:
-    families_byCode[fam["code"]] = fam
-    families_byCanonicalName[fam["canonicalName"]] = fam
-
+  set_data_list("families", get_lang_data("families", "{{#invoke:User:MewBot|getFamilyData}}"))
 
 def getScriptData():
-  global scripts, scripts_byCode, scripts_byCanonicalName
-
-  scripts = json_loads(site.expand_text("{{#invoke:User:MewBot|getScriptData}}"))
-  scripts_byCode = {}
-  scripts_byCanonicalName = {}
-
-  for sc in scripts:
-    scripts_byCode[sc["code"]] = sc
-    scripts_byCanonicalName[sc["canonicalName"]] = sc
-
+  set_data_list("scripts", get_lang_data("scripts", "{{#invoke:User:MewBot|getScriptData}}"))
 
 def getEtymLanguageData():
-  global etym_languages, etym_languages_byCode, etym_languages_byCanonicalName, etym_languages_byAlias
-
-  etym_languages = json_loads(site.expand_text("{{#invoke:User:MewBot|getEtymLanguageData}}"))
-  etym_languages_byCode = {}
-  etym_languages_byCanonicalName = {}
-  etym_languages_byAlias = defaultdict(list)
-
-  for etyl in etym_languages:
-    etym_languages_byCode[etyl["code"]] = etyl
-    etym_languages_byCanonicalName[etyl["canonicalName"]] = etyl
-    if "aliases" in etyl:
-      for alias in etyl["aliases"]:
-        assert(type(alias) is str)
-        etym_languages_byAlias[alias].append(etyl)
-
+  set_data_list("etym_languages", get_lang_data("etym_languages", "{{#invoke:User:MewBot|getEtymLanguageData}}"))
 
 def getAliasData():
   global language_aliases_to_canonical
 
-  jsondata = site.expand_text("{{#invoke:User:MewBot|getAliasData}}")
-  language_aliases_to_canonical = json_loads(jsondata)
-
+  language_aliases_to_canonical = get_lang_data("aliases", "{{#invoke:User:MewBot|getAliasData}}")
+
+
+# Token bucket limiting the rate of API requests, shared among all processes using the same state file `path` (so
+# that e.g. the jobs started by make_parallel_run.py or parallel_run.py together stay under the limit), or only within
+# this process if `path` is None. Enabled using --rate-limit (see start_rate_limiter()), after which every API request
+# made through Pywikibot waits in acquire() until a token is available. Tokens are added at up to
+# `requests_per_minute` per minute, and up to `burst` of them can accumulate. The rate adapts to the server: when
+# try_repeatedly() or the save queue meets maxlag, rate limiting or a server error, slow_down() halves the rate (down
+# to `min_fraction` of the maximum) and holds back all requests for the delay being waited; each request made after
+# that raises the rate again by 1% of the maximum. The state is a small JSON file locked using flock() while it's
+# updated.
+class RateLimiter(object):
+  def __init__(self, requests_per_minute, path=None, burst=None, min_fraction=0.1):
+    self.max_rate = requests_per_minute / 60.0
+    self.min_rate = self.max_rate * min_fraction
+    self.burst = burst or max(1.0, 5 * self.max_rate)
+    self.path = path
+    if path and os.path.dirname(path):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+    self.local_state = None
+    self.lock = threading.Lock()
+    self.counts = {"requests": 0, "waits": 0, "wait_seconds": 0.0, "slowdowns": 0}
+
+  # Context manager yielding the shared state as a dictionary, holding the lock on it; changes to the dictionary are
+  # written back.
+  @contextlib.contextmanager
+  def locked_state(self):
+    if not self.path:
+      with self.lock:
+        if self.local_state is None:
+          self.local_state = self.initial_state()
+        yield self.local_state
+      return
+    with os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644), "r+") as fp:
+      fcntl.flock(fp, fcntl.LOCK_EX)
+      try:
+        state = json.loads(fp.read() or "null")
+      except JSONDecodeError:
+        state = None
+      if not isinstance(state, dict):
+        state = self.initial_state()
+      yield state
+      fp.seek(0)
+      fp.truncate()
+      fp.write(json.dumps(state))
+
+  def initial_state(self):
+    return {"tokens": self.burst, "time": time.time(), "rate": self.max_rate, "blocked_until": 0.0}
+
+  # Wait until a request can be made.
+  def acquire(self):
+    waited = False
+    while True:
+      with self.locked_state() as state:
+        now = time.time()
+        # The rate is limited by the lowest maximum of the processes sharing the state.
+        rate = min(state["rate"], self.max_rate)
+        tokens = min(self.burst, state["tokens"] + max(0.0, now - state["time"]) * rate)
+        state["time"] = now
+        wait = state["blocked_until"] - now
+        if wait <= 0:
+          if tokens >= 1:
+            state["tokens"] = tokens - 1
+            state["rate"] = min(self.max_rate, rate + 0.01 * self.max_rate)
+            break
+          wait = (1 - tokens) / rate
+        state["tokens"] = tokens
+      with self.lock:
+        self.counts["waits"] += not waited
+        self.counts["wait_seconds"] += wait
+      waited = True
+      time.sleep(wait)
+    with self.lock:
+      self.counts["requests"] += 1
+
+  # The server is busy or throttling us; halve the rate and hold back all requests for `delay` seconds.
+  def slow_down(self, delay):
+    with self.locked_state() as state:
+      state["rate"] = max(self.min_rate, min(state["rate"], self.max_rate) / 2)
+      state["blocked_until"] = max(state["blocked_until"], time.time() + delay)
+    with self.lock:
+      self.counts["slowdowns"] += 1
+
+# The active RateLimiter, if any; see start_rate_limiter().
+rate_limiter = None
+
+# Limit the rate of API requests; see RateLimiter. Normally called automatically when the arguments of a parser
+# returned by create_argparser() are parsed and --rate-limit (or $BLIB_RATE_LIMIT) is given.
+def start_rate_limiter(requests_per_minute, path=None):
+  global rate_limiter
+  if rate_limiter is None:
+    rate_limiter = RateLimiter(requests_per_minute, path=path)
+    hook_api_requests()
+  return rate_limiter
+
+# Exponential backoff with jitter used by try_repeatedly(). The delay before retry number N is chosen at random between
+# half of and the full `base_delay` * 2**(N-1) seconds, at most `max_delay` seconds, and at least the delay asked for
+# by the server (through Retry-After or the replication lag reported with maxlag). Errors due to the server being busy
+# or throttling us are retried up to `throttle_max_tries` times, even if the caller asks for fewer tries.
+class RetryPolicy(object):
+  def __init__(self, max_delay=300, throttle_max_tries=8):
+    self.max_delay = max_delay
+    self.throttle_max_tries = throttle_max_tries
+
+  def delay(self, num_tries, base_delay, server_delay=None):
+    delay = min(self.max_delay, base_delay * 2 ** (num_tries - 1))
+    delay = random.uniform(delay / 2, delay)
+    if server_delay:
+      delay = max(delay, min(server_delay, self.max_delay))
+    return delay
+
+retry_policy = RetryPolicy()
+
+# Counts of what try_repeatedly() did about errors, reported by elapsed_time().
+retry_stats = {"retries": 0, "throttled": 0, "retry_seconds": 0.0, "skipped": 0, "failed": 0}
+
+# Pywikibot exceptions (by name) and API error codes meaning that retrying won't help, so the operation is skipped,
+# along with the description used in the warning.
+skip_exception_names = [
+  ("InvalidTitleError", "Invalid title"),
+  ("TitleblacklistError", "Title is blacklisted"),
+  ("LockedPageError", "Page is protected"),
+  ("NoUsernameError", "Page is protected"),
+  ("UnsupportedPageError", "Page is protected"),
+  ("AbuseFilterDisallowedError", "Abuse filter: Disallowed"),
+]
+skip_error_codes = [
+  ("invalidtitle", "Invalid title"),
+  ("title-blacklist-forbidden", "Title is blacklisted"),
+  ("abusefilter-disallowed", "Abuse filter: Disallowed"),
+  ("abusefilter-warning", "Abuse filter warning: Disallowed"),
+  ("customjsprotected", "Protected JavaScript page: Disallowed"),
+  ("protectednamespace-interface", "Protected namespace interface: Disallowed"),
+]
+throttle_error_codes = {"maxlag", "ratelimited", "readonly", "toomanyrequests"}
+throttle_http_statuses = {429, 502, 503, 504}
+throttle_exception_names = ["MaxlagTimeoutError", "Server504Error"]
+
+# Classify the exception `e` raised by an operation. Return a tuple (CATEGORY, DESCRIPTION) where CATEGORY is "skip"
+# (retrying won't help), "throttle" (the server is busy or throttling us) or "retry" (any other error, which may be
+# transient). Throttling is recognized only from the exception type, the API error code (also of an API error wrapped
+# by a save error) or the HTTP status (for Pywikibot's ServerError, the status its message starts with), never from
+# the rest of the message text, since words like "timeout" or a bare "503" in a message don't mean the server asked us
+# to back off. A message matching `save_throttle_error_regex` is noted in the description but retried as an ordinary
+# error.
+def classify_exception(e):
+  for name, description in skip_exception_names:
+    exception_class = getattr(pywikibot.exceptions, name, None)
+    if exception_class and isinstance(e, exception_class):
+      return "skip", description
+  code = getattr(e, "code", None) or getattr(getattr(e, "reason", None), "code", None)
+  text = str(e)
+  for error_code, description in skip_error_codes:
+    if code == error_code or error_code in text:
+      return "skip", description
+  for name in throttle_exception_names:
+    exception_class = getattr(pywikibot.exceptions, name, None)
+    if exception_class and isinstance(e, exception_class):
+      return "throttle", "Server busy or throttling"
+  if code in throttle_error_codes or http_status_of_exception(e) in throttle_http_statuses:
+    return "throttle", "Server busy or throttling"
+  # Pywikibot reports other HTTP 5xx responses as a ServerError whose message starts with the status, e.g.
+  # "503 Server Error: Service Unavailable", without the response.
+  server_error_class = getattr(pywikibot.exceptions, "ServerError", None)
+  if server_error_class and isinstance(e, server_error_class) and re.match(r"\s*5[0-9][0-9]\b", text):
+    return "throttle", "Server busy or throttling"
+  if save_throttle_error_regex.search(text):
+    return "retry", "Error (message suggests throttling, but no throttling error code or HTTP status)"
+  return "retry", "Error"
+
+def http_status_of_exception(e):
+  response = getattr(e, "response", None)
+  return getattr(response, "status_code", None) or getattr(e, "status_code", None)
+
+# Return the number of seconds the server asked us to wait before retrying after the exception `e`, from a Retry-After
+# header or the replication lag reported with a maxlag error, or None.
+def server_requested_delay(e):
+  headers = getattr(getattr(e, "response", None), "headers", None) or {}
+  retry_after = headers.get("Retry-After")
+  if retry_after is None:
+    m = re.search(r"Retry-After:?\s*([0-9]+)", str(e), re.I)
+    retry_after = m and m.group(1)
+  if retry_after and retry_after.isdigit():
+    return float(retry_after)
+  m = re.search(r"([0-9]+(?:\.[0-9]+)?) seconds? lagged", str(e))
+  if m:
+    return float(m.group(1))
+  return None
 
+# Call `fun` and return its value, retrying on errors. Errors for which retrying won't help (see classify_exception())
+# are logged and `bad_value_ret` is returned. Other errors are retried up to `max_tries` tries in all (more if the
+# server is busy or throttling us; see RetryPolicy), waiting with exponential backoff starting from `sleep_time`
+# seconds, after which the error is raised. When the server is throttling us, the rate limiter (if any) is slowed down
+# so that all processes sharing it back off.
 def try_repeatedly(fun, errandpagemsg, operation="save", bad_value_ret=None, max_tries=2, sleep_time=5):
   num_tries = 0
   def log_exception(txt, e, skipping=False):
@@ -1729,57 +4355,33 @@ def try_repeatedly(fun, errandpagemsg, operation="save", bad_value_ret=None, max
   while True:
     try:
       return fun()
-    except KeyboardInterrupt as e:
+    except (KeyboardInterrupt, OfflineError) as e:
       raise
-    except pywikibot.exceptions.InvalidTitleError as e:
-      log_exception("Invalid title", e, skipping=True)
-      return bad_value_ret
-    except pywikibot.exceptions.TitleblacklistError as e:
-      log_exception("Title is blacklisted", e, skipping=True)
-      return bad_value_ret
-    except (pywikibot.exceptions.LockedPageError, pywikibot.exceptions.NoUsernameError, pywikibot.exceptions.UnsupportedPageError) as e:
-      log_exception("Page is protected", e, skipping=True)
-      return bad_value_ret
-    except pywikibot.exceptions.AbuseFilterDisallowedError as e:
-      log_exception("Abuse filter: Disallowed", e, skipping=True)
-      return bad_value_ret
-    # Instead, retry, which will save the page.
-    #except pywikibot.exceptions.PageSaveRelatedError as e:
-    #  log_exception("Unable to save (abuse filter?)", e, skipping=True)
     except Exception as e:
-      if "invalidtitle" in str(e):
-        log_exception("Invalid title", e, skipping=True)
-        return bad_value_ret
-      if "title-blacklist-forbidden" in str(e):
-        log_exception("Title is blacklisted", e, skipping=True)
-        return bad_value_ret
-      if "abusefilter-disallowed" in str(e):
-        log_exception("Abuse filter: Disallowed", e, skipping=True)
-        return bad_value_ret
-      if "abusefilter-warning" in str(e):
-        log_exception("Abuse filter warning: Disallowed", e, skipping=True)
+      category, description = classify_exception(e)
+      if category == "skip":
+        log_exception(description, e, skipping=True)
+        retry_stats["skipped"] += 1
         return bad_value_ret
-      if "customjsprotected" in str(e):
-        log_exception("Protected JavaScript page: Disallowed", e, skipping=True)
-        return bad_value_ret
-      if "protectednamespace-interface" in str(e):
-        log_exception("Protected namespace interface: Disallowed", e, skipping=True)
-        return bad_value_ret
-      #except (pywikibot.exceptions.Error, StandardError) as e:
-      log_exception("Error", e)
+      log_exception(description, e)
       num_tries += 1
-      if num_tries >= max_tries:
+      if num_tries >= (max(max_tries, retry_policy.throttle_max_tries) if category == "throttle" else max_tries):
         errandpagemsg("WARNING: Can't %s!!!!!!!" % operation)
+        retry_stats["failed"] += 1
         raise
-      errandpagemsg("Sleeping for %s seconds" % sleep_time)
-      time.sleep(sleep_time)
-      #if sleep_time >= 40:
-      #  sleep_time += 40
-      #else:
-      #  sleep_time *= 2
+      delay = retry_policy.delay(num_tries, sleep_time, server_requested_delay(e))
+      if category == "throttle":
+        retry_stats["throttled"] += 1
+        if rate_limiter is not None:
+          rate_limiter.slow_down(delay)
+      retry_stats["retries"] += 1
+      retry_stats["retry_seconds"] += delay
+      errandpagemsg("Sleeping for %0.1f seconds" % delay)
+      time.sleep(delay)
 
 def safe_page_text(page, errandpagemsg, bad_value_ret=""):
-  return try_repeatedly(lambda: page.text, errandpagemsg, "fetch page text", bad_value_ret=bad_value_ret)
+  with metrics_phase("fetch"):
+    return try_repeatedly(lambda: page.text, errandpagemsg, "fetch page text", bad_value_ret=bad_value_ret)
 
 def safe_page_exists(page, errandpagemsg):
   return try_repeatedly(lambda: page.exists(), errandpagemsg, "determine if page exists", bad_value_ret=False)
@@ -1787,8 +4389,11 @@ def safe_page_exists(page, errandpagemsg):
 def safe_page_save(page, comment, errandpagemsg):
   def do_save():
     page.save(summary=comment)
+    if run_journal is not None:
+      run_journal.record_saved(page)
     return True
-  return try_repeatedly(do_save, errandpagemsg, "save page", bad_value_ret=False)
+  with metrics_phase("save"):
+    return try_repeatedly(do_save, errandpagemsg, "save page", bad_value_ret=False)
 
 def safe_page_purge(page, errandpagemsg):
   def do_purge():
@@ -2094,6 +4699,20 @@ def parse_inline_modifier(value):
   return ParamWithInlineModifier(mainval, modifiers, preceding_whitespace, following_whitespace)
 
 
+# Map from tuple of language codes to the regex used by process_one_page_links() to check whether a page can contain
+# any templates to process.
+process_one_page_links_prefilters = {}
+
+# Return a regex matching any of the language codes in `langs` as a separate word. Every template that
+# process_one_page_links() processes has one of the codes either as a parameter value or at the beginning of its
+# name, so pages not matching the regex can be skipped without parsing them.
+def process_one_page_links_prefilter(langs):
+  key = tuple(sorted(langs))
+  if key not in process_one_page_links_prefilters:
+    process_one_page_links_prefilters[key] = re.compile(r"(?<![A-Za-z0-9])(?:%s)(?![A-Za-z0-9])" %
+      "|".join(re.escape(lang) for lang in sorted(langs, key=lambda lang: -len(lang))))
+  return process_one_page_links_prefilters[key]
+
 # Process link-like templates containing foreign text in specified language(s). PROCESS_PARAM is the function called,
 # which is called with a single argument, an object of type ProcessLinks holding information on the page; its index
 # (an integer); the page text; the template on the page; the language code of the template; the combination of
@@ -2123,6 +4742,9 @@ def parse_inline_modifier(value):
 # If INCLUDE_NOTFOREIGN is given, then PROCESS_PARAM will be called on templates referencing one of the languages in
 # LANGS but not containing any foreign-script values. In that case, the first element of the tuple passed in `param`
 # to PROCESS_PARAM will be "notforeign". See below.
+#
+# TEXT is parsed using parse_text(TEXT, cached=True), so when processing a page under do_pagefile_cats_refs(), the
+# parse tree of the page text made by blib.parse() (for `process` with edit=True) is reused and then modified in place.
 def process_one_page_links(index, pagetitle, text, langs, process_param,
   templates_seen, templates_changed, split_templates=None, include_notforeign=False):
 
@@ -2682,7 +5304,9 @@ def process_one_page_links(index, pagetitle, text, langs, process_param,
 
   actions = []
   newtext = [text]
-  parsed = parse_text(text)
+  if "{{" not in text or not process_one_page_links_prefilter(langs).search(text):
+    return text, actions
+  parsed = parse_text(text, cached=True)
 
   # First split up any templates with commas in the Latin.
   if split_templates:
@@ -2824,6 +5448,23 @@ def force_two_newlines_in_secbody(secbody, sectail):
   return secbody, sectail
 
 def split_text_into_sections(pagetext, pagemsg):
+  if section_split_cache is not None:
+    cached = section_split_cache.get(pagetext)
+    if cached is None:
+      warnings = []
+      cached = (do_split_text_into_sections(pagetext, warnings.append), warnings)
+      if len(section_split_cache) >= parse_cache_max_size:
+        section_split_cache.clear()
+      section_split_cache[pagetext] = cached
+    (sections, sections_by_lang, section_langs), warnings = cached
+    if pagemsg:
+      for warning in warnings:
+        pagemsg(warning)
+    # The caller may modify the returned values.
+    return list(sections), dict(sections_by_lang), list(section_langs)
+  return do_split_text_into_sections(pagetext, pagemsg)
+
+def do_split_text_into_sections(pagetext, pagemsg):
   # Split into sections
   sections = re.split(r"(^==[^=\n]+==[ \t]*\n)", pagetext, 0, re.M)
   sections_by_lang = {}
@@ -2943,6 +5584,178 @@ def find_lang_section(pagetext, lang, pagemsg):
     return None
   return splitsections[sections_by_lang[lang]]
 
+# A node in the tree of subsections of a language section; see PageDocument.subsection_tree(). `index` is the index
+# of the subsection's text in the list returned by PageDocument.subsections() (its header is at `index` - 1),
+# `header` its header text and `level` its header level (3 for ===Etymology===). `children` are the subsections
+# nested under it, i.e. the following subsections with higher levels.
+class SubsectionNode(object):
+  def __init__(self, index, header, level, parent=None):
+    self.index = index
+    self.header = header
+    self.level = level
+    self.parent = parent
+    self.children = []
+
+  def __repr__(self):
+    return "SubsectionNode(%s, %r, %s, %s)" % (self.index, self.header, self.level, self.children)
+
+# Structured view of the text of a page, split lazily into language sections and the language sections into
+# subsections, with the splits cached so that several operations on the same page don't each re-split the text.
+# Sections and subsections can be modified in place, and str() of the document (or `text`) puts the page back
+# together; the text is guaranteed to be byte-for-byte identical to the original text if nothing has been modified.
+#
+# Language sections are indexed as in split_text_into_sections(): `sections` (returned by sections()) alternates
+# between text and headers, and the text of the section for a language is at an even index `j` > 0. A typical use:
+#
+#    doc = blib.PageDocument(text, pagemsg)
+#    retval = doc.lang_body(langname)
+#    if retval is None:
+#      return
+#    secbody, sectail = retval
+#    ... modify secbody ...
+#    doc.set_lang_body(langname, secbody, sectail)
+#    return str(doc), notes
+#
+# The subsections of a language section are split using split_text_into_subsections() on the whole section text
+# (including any trailing categories and separator, which end up in the last subsection), so joining them always
+# gives back the section text.
+class PageDocument(object):
+  def __init__(self, text, pagemsg=None):
+    self.original_text = text
+    self.pagemsg = pagemsg
+    self._sections = None
+    self._sections_by_lang = None
+    self._section_langs = None
+    # Map from section index to the tuple returned by split_text_into_subsections() for the section.
+    self._subsections = {}
+    self._subsection_trees = {}
+    self.modified = False
+
+  def _split(self):
+    if self._sections is None:
+      self._sections, self._sections_by_lang, self._section_langs = split_text_into_sections(
+        self.original_text, self.pagemsg)
+
+  @property
+  def text(self):
+    if not self.modified:
+      return self.original_text
+    return "".join(self._sections)
+
+  def __str__(self):
+    return self.text
+
+  # Return the list of sections, as returned by split_text_into_sections(). Don't modify it directly; use
+  # set_section().
+  def sections(self):
+    self._split()
+    return self._sections
+
+  # Return a list of the languages of the sections on the page, in order (including any duplicates).
+  def langs(self):
+    self._split()
+    return [lang for j, lang in self._section_langs]
+
+  def has_lang(self, lang):
+    self._split()
+    return lang in self._sections_by_lang
+
+  # Return the index of the section for `lang` (of the first such section if there are several), or None.
+  def lang_index(self, lang):
+    self._split()
+    return self._sections_by_lang.get(lang)
+
+  # Return the text of the section for `lang` (without its header), or None if there is no such section.
+  def lang_section(self, lang):
+    j = self.lang_index(lang)
+    return None if j is None else self._sections[j]
+
+  # Return a tuple (SECBODY, SECTAIL) for the section of `lang`, split as by find_modifiable_lang_section(), or None
+  # if there is no such section.
+  def lang_body(self, lang, force_final_nls=False):
+    section = self.lang_section(lang)
+    if section is None:
+      return None
+    secbody, sectail = split_trailing_separator_and_categories(section)
+    if force_final_nls:
+      secbody, sectail = force_two_newlines_in_secbody(secbody, sectail)
+    return secbody, sectail
+
+  # Replace the text of the section at index `j` (which must be even) with `text`.
+  def set_section(self, j, text):
+    self._split()
+    assert j % 2 == 0, "Section index %s is a header, not section text" % j
+    if self._sections[j] == text:
+      return
+    self._sections[j] = text
+    self._subsections.pop(j, None)
+    self._subsection_trees.pop(j, None)
+    self.modified = True
+
+  def set_lang_section(self, lang, text):
+    j = self.lang_index(lang)
+    if j is None:
+      raise ValueError("No %s section on page" % lang)
+    self.set_section(j, text)
+
+  # Replace the section of `lang` with `secbody` + `sectail`, as returned by lang_body() (if `force_final_nls` was
+  # given to lang_body(), pass it here as well).
+  def set_lang_body(self, lang, secbody, sectail, force_final_nls=False):
+    if force_final_nls:
+      secbody = secbody.rstrip("\n")
+    self.set_lang_section(lang, secbody + sectail)
+
+  # Return the subsections of the section of `lang` as returned by split_text_into_subsections(), i.e. a tuple
+  # (SUBSECTIONS, SUBSECTIONS_BY_HEADER, SUBSECTION_HEADERS, SUBSECTION_LEVELS), or None if there is no such section.
+  # Don't modify the returned values directly; use set_subsection().
+  def subsections(self, lang):
+    j = self.lang_index(lang)
+    if j is None:
+      return None
+    if j not in self._subsections:
+      self._subsections[j] = split_text_into_subsections(self._sections[j], self.pagemsg)
+    return self._subsections[j]
+
+  # Return the subsections of the section of `lang` as a list of SubsectionNode trees, one for each top-level
+  # subsection (normally the level-3 subsections), or None if there is no such section.
+  def subsection_tree(self, lang):
+    j = self.lang_index(lang)
+    if j is None:
+      return None
+    if j not in self._subsection_trees:
+      subsections, _, subsection_headers, subsection_levels = self.subsections(lang)
+      roots = []
+      stack = []
+      for k in range(2, len(subsections), 2):
+        if k not in subsection_levels:
+          continue
+        level = subsection_levels[k]
+        while stack and stack[-1].level >= level:
+          stack.pop()
+        node = SubsectionNode(k, subsection_headers[k], level, parent=stack[-1] if stack else None)
+        (stack[-1].children if stack else roots).append(node)
+        stack.append(node)
+      self._subsection_trees[j] = roots
+    return self._subsection_trees[j]
+
+  # Replace the text of subsection `k` (an even index into the list returned by subsections(); 0 is the text before
+  # the first subsection header) of the section of `lang` with `text`.
+  def set_subsection(self, lang, k, text):
+    old_split = self.subsections(lang)
+    subsections = old_split[0]
+    assert k % 2 == 0, "Subsection index %s is a header, not subsection text" % k
+    if subsections[k] == text:
+      return
+    new_subsections = list(subsections)
+    new_subsections[k] = text
+    j = self.lang_index(lang)
+    self.set_section(j, "".join(new_subsections))
+    if new_subsections[k][-1:] == "\n" or k == len(new_subsections) - 1:
+      # Changing the text of a subsection doesn't change the split as long as it ends in a newline (or is the last
+      # subsection) and contains no headers, so keep the split rather than re-splitting later.
+      if not re.search(r"^==+[^=\n]+==+[ \t]*\n", text, re.M):
+        self._subsections[j] = (new_subsections,) + old_split[1:]
+
 def replace_in_text(text, curr, repl, pagemsg, count=-1, no_found_repl_check=False,
     abort_if_warning=False, is_re=False):
   if is_re:
@@ -3101,11 +5914,135 @@ class WikiDumpHandler(xml.sax.ContentHandler):
 class DumpExitException(Exception):
   pass
 
+# Open a dump file for use with parse_dump() or iter_dump_pages(), decompressing it if it ends in .bz2.
+def open_dump(filename):
+  if filename.endswith(".bz2"):
+    return bz2.open(filename, "rb")
+  return open(filename, "rb")
+
+_dump_title_re = re.compile(rb"<title>(.*?)</title>")
+_dump_ns_re = re.compile(rb"<ns>(-?[0-9]+)</ns>")
+_dump_id_re = re.compile(rb"<id>([0-9]+)</id>")
+_dump_text_re = re.compile(rb"<text\b[^>]*?(/?)>")
+
+def _decode_dump_string(raw):
+  text = raw.decode("utf-8")
+  if "&" in text:
+    if "&#" in text:
+      text = html.unescape(text)
+    else:
+      # Much faster than html.unescape(), which calls a Python function for each entity. "&amp;" must be last.
+      text = text.replace("&lt;", "<").replace("&gt;", ">").replace("&quot;", '"').replace(
+        "&apos;", "'").replace("&amp;", "&")
+  return text
+
+# Iterate over the raw bytes of the <page>...</page> elements in `fp` (a binary file object), reading in large chunks.
+def _iter_raw_dump_pages(fp, chunk_size=1 << 22):
+  buf = b""
+  pos = 0
+  search_from = 0
+  while True:
+    endpos = buf.find(b"</page>", search_from)
+    if endpos < 0:
+      chunk = fp.read(chunk_size)
+      if not chunk:
+        return
+      # Back up a bit in case the chunk boundary falls inside of "</page>".
+      search_from = max(len(buf) - pos - 7, 0)
+      buf = buf[pos:] + chunk
+      pos = 0
+      continue
+    startpos = buf.find(b"<page>", pos, endpos)
+    if startpos >= 0:
+      yield buf[startpos:endpos]
+    pos = endpos + 7
+    search_from = pos
+
+# Iterate over the pages in a MediaWiki XML dump (e.g. pages-articles.xml or a decompressed stream of a multistream
+# dump), yielding tuples (TITLE, NS, REVID, TEXT). This is much faster than going through xml.sax, because it scans the
+# raw bytes for the few elements we need and only decodes and unescapes the text of a page once the page has passed the
+# following filters:
+#
+# * If `title_filter` is given, it is a function of one argument (the page title) that returns True to accept a page.
+# * If `namespaces` is given, it is a collection of namespace numbers; pages in other namespaces are rejected.
+# * If `text_prefilter` is given, it is a string (e.g. "==Latin==") that must occur in the page text.
+#
+# Pages rejected by a filter are still yielded, but with TEXT set to None, so that callers can keep page indices
+# consistent with unfiltered runs. As with the xml.sax-based reader, one tuple is yielded per revision, so a dump
+# containing page histories yields the same title several times. `fp` should be a binary file object; if a text file
+# object is passed in (e.g. sys.stdin), its underlying binary buffer is used. If `progress_interval` is nonzero, a
+# progress message with the number of pages per second is written to stderr every `progress_interval` pages and at the
+# end.
+def iter_dump_pages(fp, title_filter=None, namespaces=None, text_prefilter=None, progress_interval=10000):
+  if isinstance(fp, io.TextIOBase):
+    fp = fp.buffer
+  if text_prefilter is not None:
+    raw_prefilter = text_prefilter.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace(
+      '"', "&quot;").encode("utf-8")
+  num_pages = 0
+  num_decoded = 0
+  tstart = time.time()
+
+  def report_progress():
+    elapsed = time.time() - tstart
+    errmsg("Read %s pages from dump (%s decoded), %.1f pages/sec" % (
+      num_pages, num_decoded, num_pages / elapsed if elapsed else 0.0))
+
+  for raw_page in _iter_raw_dump_pages(fp):
+    m = _dump_title_re.search(raw_page)
+    title = _decode_dump_string(m.group(1)) if m else ""
+    m = _dump_ns_re.search(raw_page)
+    ns = int(m.group(1)) if m else None
+    accept_page = ((namespaces is None or ns in namespaces) and
+      (title_filter is None or title_filter(title)))
+    revpos = raw_page.find(b"<revision")
+    while revpos >= 0:
+      m = _dump_id_re.search(raw_page, revpos)
+      revid = int(m.group(1)) if m else None
+      m = _dump_text_re.search(raw_page, revpos)
+      if not m:
+        break
+      if m.group(1):
+        # Self-closing <text ... />, i.e. an empty page.
+        raw_text = b""
+        textend = m.end()
+      else:
+        textend = raw_page.find(b"</text>", m.end())
+        if textend < 0:
+          textend = len(raw_page)
+        raw_text = raw_page[m.end():textend]
+      text = None
+      if accept_page and (text_prefilter is None or raw_prefilter in raw_text):
+        num_decoded += 1
+        text = _decode_dump_string(raw_text)
+      num_pages += 1
+      if progress_interval and num_pages % progress_interval == 0:
+        report_progress()
+      yield title, ns, revid, text
+      revpos = raw_page.find(b"<revision", textend)
+  if progress_interval and num_pages % progress_interval != 0:
+    report_progress()
+
+# Parse a MediaWiki XML dump read from `fp`, calling `pagecallback` as pagecallback(INDEX, TITLE, TEXT) on each page
+# within the range given by `startprefix` and `endprefix` (page indices or title prefixes). `title_filter`,
+# `namespaces` and `text_prefilter` are passed to iter_dump_pages() to reject pages before their text is decoded; the
+# callback is not called on rejected pages, but they count towards the page indices. If `use_sax` is given, use the
+# older xml.sax-based parser, which doesn't support prefiltering.
 def parse_dump(fp, pagecallback, startprefix=None, endprefix=None,
-    skip_ignorable_pages=False):
+    skip_ignorable_pages=False, title_filter=None, namespaces=None, text_prefilter=None, use_sax=False):
   item_handler = ProcessItems(startprefix=startprefix, endprefix=endprefix,
       skip_ignorable_pages=skip_ignorable_pages)
 
+  if not use_sax:
+    for title, ns, revid, text in iter_dump_pages(fp, title_filter=title_filter, namespaces=namespaces,
+                                                  text_prefilter=text_prefilter):
+      retval = item_handler.should_process(title)
+      if retval is None:
+        return
+      if retval != False and text is not None:
+        pagecallback(retval, title, text)
+    return
+
   def mycallback(title, text):
     retval = item_handler.should_process(title)
     if retval is None:
@@ -3119,7 +6056,405 @@ def parse_dump(fp, pagecallback, startprefix=None, endprefix=None,
   except DumpExitException as e:
     return
 
+# Read the index file of a multistream dump (lines of the form OFFSET:PAGEID:TITLE, one per page in dump order; plain
+# or .bz2) and return a list of the bz2 streams containing at least one wanted page. `want_page` is a function of two
+# arguments (the 1-based index of the page in the dump and its title) returning True if the page is wanted, or None if
+# no further pages are wanted (which stops reading the index). Each returned stream is a tuple
+# (OFFSET, END_OFFSET, FIRST_INDEX, WANTED_TITLES), where END_OFFSET is None for the last stream in the dump, FIRST_INDEX
+# is the index of the first page in the stream and WANTED_TITLES is the set of wanted titles in the stream.
+def select_multistream_dump_streams(index_filename, want_page):
+  if index_filename.endswith(".bz2"):
+    fp = bz2.open(index_filename, "rt", encoding="utf-8")
+  else:
+    fp = open(index_filename, "r", encoding="utf-8")
+  streams = []
+  # Current stream as [OFFSET, FIRST_INDEX, WANTED_TITLES].
+  cur_stream = None
+  done = False
+  with fp:
+    for index, line in enumerate(fp, 1):
+      offset, _, title = line.rstrip("\n").split(":", 2)
+      offset = int(offset)
+      if cur_stream is None or offset != cur_stream[0]:
+        if cur_stream is not None and cur_stream[2]:
+          streams.append((cur_stream[0], offset, cur_stream[1], cur_stream[2]))
+        if done:
+          cur_stream = None
+          break
+        cur_stream = [offset, index, set()]
+      if done:
+        continue
+      wanted = want_page(index, title)
+      if wanted is None:
+        done = True
+      elif wanted:
+        cur_stream[2].add(title)
+  if cur_stream is not None and cur_stream[2]:
+    streams.append((cur_stream[0], None, cur_stream[1], cur_stream[2]))
+  return streams
+
+# Decompress one bz2 stream of a multistream dump in a worker process and parse its pages, returning a list of
+# (TITLE, NS, REVID, TEXT) tuples as for iter_dump_pages(). Pages not in `wanted_titles` have TEXT set to None.
+def _read_multistream_dump_stream(task):
+  dump_filename, offset, end_offset, wanted_titles, text_prefilter = task
+  with open(dump_filename, "rb") as fp:
+    fp.seek(offset)
+    data = fp.read() if end_offset is None else fp.read(end_offset - offset)
+  data = bz2.decompress(data)
+  return list(iter_dump_pages(io.BytesIO(data), title_filter=lambda title: title in wanted_titles,
+                              text_prefilter=text_prefilter, progress_interval=0))
+
+# Parse a multistream dump (e.g. enwiktionary-latest-pages-articles-multistream.xml.bz2) using its index file, calling
+# `pagecallback` as pagecallback(INDEX, TITLE, TEXT) on the selected pages, in dump order. Page indices are the same as
+# when the whole dump is read using parse_dump(). Pages are selected by `startprefix` and `endprefix` (page indices or
+# title prefixes, as for parse_dump()) and, if `pages` is given, must also be in `pages` (a collection of titles).
+# The index is used to read only the bz2 streams containing selected pages, and the streams are decompressed and parsed
+# in `num_workers` worker processes. `title_filter` and `text_prefilter` are as for parse_dump().
+def parse_multistream_dump(dump_filename, index_filename, pagecallback, startprefix=None, endprefix=None, pages=None,
+    title_filter=None, text_prefilter=None, num_workers=4):
+  def want_page(index, title):
+    if isinstance(endprefix, int) and index > endprefix:
+      return None
+    if isinstance(startprefix, int) and index < startprefix:
+      return False
+    if isinstance(startprefix, str) and title < startprefix:
+      return False
+    if isinstance(endprefix, str) and title > endprefix:
+      return None
+    if pages is not None and title not in pages:
+      return False
+    if title_filter and not title_filter(title):
+      return False
+    return True
+
+  errmsgn("Reading multistream dump index %s..." % index_filename)
+  streams = select_multistream_dump_streams(index_filename, want_page)
+  errmsg(" done; %s streams to read." % len(streams))
+  pool = mp.get_context("fork").Pool(num_workers)
+  pending = deque()
+  streams_done = 0
+  tstart = time.time()
+  try:
+    stream_iter = iter(streams)
+    while True:
+      # Keep a bounded number of streams in flight so we don't decompress the whole dump into memory when the page
+      # callback is slower than decompression.
+      while len(pending) < 2 * num_workers:
+        stream = next(stream_iter, None)
+        if stream is None:
+          break
+        offset, end_offset, first_index, wanted_titles = stream
+        pending.append((first_index, pool.apply_async(_read_multistream_dump_stream,
+          ((dump_filename, offset, end_offset, wanted_titles, text_prefilter),))))
+      if not pending:
+        break
+      first_index, async_result = pending.popleft()
+      for i, (title, ns, revid, text) in enumerate(async_result.get()):
+        if text is not None:
+          pagecallback(first_index + i, title, text)
+      streams_done += 1
+      if streams_done % 100 == 0:
+        elapsed = time.time() - tstart
+        errmsg("Read %s/%s streams, %.1f streams/sec" % (streams_done, len(streams), streams_done / elapsed))
+  finally:
+    pool.terminate()
+    pool.join()
+
+# Structured event log written alongside the usual text output when --event-log is given (see start_event_log()). Each
+# message output using msg() (including through errandmsg() and pagemsg() functions) is also written as one line of
+# JSON with the following keys:
+#   "type": "message" for ordinary messages; for messages of the form "Page INDEX TITLE: TEXT", "warning" if TEXT
+#           begins with "WARNING:", "would_save" or "save" for the messages output when a page is (or would be) saved,
+#           "skip" when a page is skipped, "text" for the new text of a page output in find_regex format, and "diff" for
+#           a diff output by show_diff();
+#   "index", "title": the page index (as a string) and title, for page messages;
+#   "text": the message text, without the "Page INDEX TITLE: " prefix; for "text" and "diff" events, the new text of
+#           the page or the diff;
+#   "comment": the comment for "would_save" and "save" events, and for "skip" events from find_regex.py output (the
+#           previous comment).
+# The first line is a "start" event holding the command line. When the log is closed, an index is written to
+# PATH.idx (an SQLite database) holding the offset of the first event of each run of events for the same page and of
+# each warning, so that the events for a given page can be looked up directly; see EventLogReader.
+#
+# Readers of the text output (yield_text_from_find_regex(), yield_text_from_diff() and
+# yield_pages_from_previous_output(), along with parse_log_file.py, filter_inflection_msgs.py and extract-warnings)
+# use the event log instead if it is named after the text output with ".events.jsonl" added (e.g. "foo.out" and
+# "foo.out.events.jsonl") and the text output hasn't been modified since; see find_event_log().
+event_log_page_message_regex = re.compile(r"\APage ([^ ]+) (.*?): (.*)\Z", re.S)
+event_log_save_regex = re.compile(r"\A(Would save|Saving|Queueing save|Saved) with comment = (.*)\Z", re.S)
+event_log_find_regex_text_regex = re.compile(r"\A-+ begin text -+\n(.*\n|)-+ end text -+\Z", re.S)
+# Regexes used to split off the "Page INDEX TITLE: " prefix of messages about a page other than the one being
+# processed, tried in order. As when reading the text output, the title is matched greedily for the messages recognized
+# by what follows it, so that titles containing ": " are split in the right place, and non-greedily otherwise.
+event_log_page_message_regexes = [
+  re.compile(r"\APage ([^ ]+) ([^\n]*): (-+ begin text -+\n.*)\Z", re.S),
+  re.compile(r"\APage ([^ ]+) ([^\n]*): ((?:Would save|Saving|Queueing save|Saved) with comment = .*)\Z", re.S),
+  re.compile(r"\APage ([^ ]+) ([^\n]*): (Skipped, no changes; previous comment = .*)\Z", re.S),
+  re.compile(r"\APage ([^ ]+) ([^\n]*): (Diff:)\Z", re.S),
+  re.compile(r"\APage ([^ ]+) ([^\n]*): (WARNING:.*)\Z", re.S),
+  event_log_page_message_regex,
+]
+# Title of the page being processed by do_pagefile_cats_refs(), whose messages are split using the known title.
+event_log_current_title = None
+
+# Split the message `text` into (INDEX, TITLE, TEXT) if it has the form "Page INDEX TITLE: TEXT", else return None.
+def split_page_message(text):
+  if event_log_current_title is not None:
+    m = re.match(r"Page ([^ ]+) %s: " % re.escape(event_log_current_title), text)
+    if m:
+      return m.group(1), event_log_current_title, text[m.end():]
+  for regex in event_log_page_message_regexes:
+    m = regex.search(text)
+    if m:
+      return m.groups()
+  return None
+
+# Return the event for the message `text` as written to the event log.
+def event_for_message(text):
+  split = split_page_message(text)
+  if not split:
+    return {"type": "message", "text": text}
+  index, pagetitle, text = split
+  event = {"type": "message", "index": index, "title": pagetitle, "text": text}
+  if text.startswith("WARNING:"):
+    event["type"] = "warning"
+  elif text.startswith("Skipped"):
+    event["type"] = "skip"
+    if text.startswith("Skipped, no changes; previous comment = "):
+      event["comment"] = text[len("Skipped, no changes; previous comment = "):]
+  else:
+    m = event_log_save_regex.search(text)
+    if m:
+      event["type"] = "would_save" if m.group(1) == "Would save" else "save"
+      event["comment"] = m.group(2)
+    else:
+      m = event_log_find_regex_text_regex.search(text)
+      if m:
+        event["type"] = "text"
+        event["text"] = m.group(1)
+  return event
+
+class EventLog(object):
+  def __init__(self, path):
+    self.path = path
+    self.fp = open(path, "wb")
+    self.offset = 0
+    self.lock = threading.Lock()
+    # (TITLE, INDEX, OFFSET) for the first event of each run of events for the same page, and offsets of warnings.
+    self.page_runs = []
+    self.warnings = []
+    self.last_page = None
+    # List of events being collected instead of written, in a worker process; see _process_batch_in_worker().
+    self.captured = None
+    self.closed = False
+    self.write_event({"type": "start", "argv": sys.argv, "time": time.time()})
+
+  def write_event(self, event):
+    if self.captured is not None:
+      self.captured.append(event)
+      return
+    line = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+    with self.lock:
+      if self.closed:
+        return
+      if "title" in event:
+        page = (event["index"], event["title"])
+        if page != self.last_page:
+          self.page_runs.append((event["title"], event["index"], self.offset))
+          self.last_page = page
+        if event["type"] == "warning":
+          self.warnings.append(self.offset)
+      self.fp.write(line)
+      self.offset += len(line)
+
+  def log_message(self, text):
+    self.write_event(event_for_message(str(text)))
+
+  # Log a diff output by show_diff(), which follows a "Diff:" message for the page.
+  def log_diff(self, diff):
+    event = {"type": "diff", "text": diff}
+    last_page = self.captured[-1] if self.captured else None
+    if last_page is not None:
+      last_page = (last_page.get("index"), last_page.get("title"))
+    else:
+      last_page = self.last_page
+    if last_page and last_page[1] is not None:
+      event["index"], event["title"] = last_page
+    self.write_event(event)
+
+  def close(self):
+    with self.lock:
+      if self.closed:
+        return
+      self.closed = True
+      # Make sure the text output is no newer than the event log; see find_event_log().
+      sys.stdout.flush()
+      self.fp.close()
+    write_event_log_index(self.path, self.page_runs, self.warnings)
+
+def write_event_log_index(path, page_runs, warnings):
+  index_path = path + ".idx"
+  if os.path.exists(index_path):
+    os.unlink(index_path)
+  conn = sqlite3.connect(index_path)
+  conn.execute("CREATE TABLE page_runs (title TEXT, idx TEXT, offset INTEGER)")
+  conn.execute("CREATE TABLE warnings (offset INTEGER)")
+  conn.executemany("INSERT INTO page_runs VALUES (?, ?, ?)", page_runs)
+  conn.executemany("INSERT INTO warnings VALUES (?)", [(offset,) for offset in warnings])
+  conn.execute("CREATE INDEX page_runs_title ON page_runs (title)")
+  conn.commit()
+  conn.close()
+
+# Write the index of an existing event log, e.g. one whose run was killed before it could be written.
+def build_event_log_index(path):
+  page_runs = []
+  warnings = []
+  last_page = None
+  offset = 0
+  with open(path, "rb") as fp:
+    for line in fp:
+      try:
+        event = json.loads(line)
+      except JSONDecodeError:
+        break
+      if "title" in event:
+        page = (event["index"], event["title"])
+        if page != last_page:
+          page_runs.append((event["title"], event["index"], offset))
+          last_page = page
+        if event["type"] == "warning":
+          warnings.append(offset)
+      offset += len(line)
+  write_event_log_index(path, page_runs, warnings)
+
+# Read an event log written using --event-log.
+class EventLogReader(object):
+  def __init__(self, path):
+    self.path = path
+    self.conn = None
+
+  # Yield each event in order. Stops at an incomplete final line, left if the run was killed.
+  def events(self):
+    with open(self.path, "rb") as fp:
+      for line in fp:
+        try:
+          yield json.loads(line)
+        except JSONDecodeError:
+          return
+
+  def connect(self):
+    if self.conn is None:
+      if not os.path.exists(self.path + ".idx"):
+        build_event_log_index(self.path)
+      self.conn = sqlite3.connect(self.path + ".idx")
+    return self.conn
+
+  # Return the events for the page titled `pagetitle`, in order, using the index.
+  def page_events(self, pagetitle):
+    events = []
+    with open(self.path, "rb") as fp:
+      for index, offset in self.connect().execute("SELECT idx, offset FROM page_runs WHERE title = ? ORDER BY offset",
+                                                  (pagetitle,)):
+        fp.seek(offset)
+        for line in fp:
+          event = json.loads(line)
+          if event.get("index") != index or event.get("title") != pagetitle:
+            break
+          events.append(event)
+    return events
+
+  # Return the warning events, in order, using the index.
+  def warning_events(self):
+    events = []
+    with open(self.path, "rb") as fp:
+      for offset, in self.connect().execute("SELECT offset FROM warnings ORDER BY offset"):
+        fp.seek(offset)
+        events.append(json.loads(fp.readline()))
+    return events
+
+# The active EventLog, if any; see start_event_log().
+event_log = None
+
+# Start writing an event log to `path`; see EventLog. Normally called automatically when the arguments of a parser
+# returned by create_argparser() are parsed and --event-log is given. The log is closed at exit.
+def start_event_log(path):
+  global event_log
+  if event_log is None:
+    event_log = EventLog(path)
+    atexit.register(event_log.close)
+  return event_log
+
+# Return the path of the event log corresponding to the text output in `fp` (an open file or a filename), or None. If
+# `fp` is itself an event log (named "*.events.jsonl"), it is returned. Otherwise the event log must be named after
+# the text output with ".events.jsonl" added and must have been written no earlier than the text output, allowing a
+# few seconds for output written through a pipe (e.g. using 'tee'), so that an event log isn't used in place of text
+# output that has been edited by hand.
+def find_event_log(fp):
+  filename = fp if isinstance(fp, str) else getattr(fp, "name", None)
+  if not isinstance(filename, str) or not os.path.isfile(filename):
+    return None
+  if filename.endswith(".events.jsonl"):
+    return filename
+  path = filename + ".events.jsonl"
+  if os.path.isfile(path) and os.path.getmtime(path) + 5 >= os.path.getmtime(filename):
+    return path
+  return None
+
+# Yield (INDEX, PAGETITLE, TEXT) for each line of the text output in the file `filename`, where INDEX and PAGETITLE
+# are None for lines not of the form "Page INDEX PAGETITLE: TEXT" (in which case TEXT is the whole line). Lines don't
+# include the final newline. The event log is used instead if present (see find_event_log()).
+def yield_page_messages_from_output(filename):
+  event_log_path = find_event_log(filename)
+  if event_log_path:
+    for event in EventLogReader(event_log_path).events():
+      if event["type"] == "start":
+        continue
+      if event["type"] == "text":
+        lines = ("-------- begin text --------\n%s-------- end text --------" % event["text"]).split("\n")
+      elif event["type"] == "diff":
+        # The diff follows the "Diff:" message on lines of its own.
+        for line in event["text"].rstrip("\n").split("\n"):
+          yield None, None, line
+        continue
+      else:
+        lines = event["text"].split("\n")
+      if "title" in event:
+        yield event["index"], event["title"], lines[0]
+        lines = lines[1:]
+      for line in lines:
+        yield None, None, line
+  else:
+    with open(filename, "r", encoding="utf-8") as fp:
+      for line in fp:
+        line = line.rstrip("\n")
+        m = event_log_page_message_regex.search(line)
+        if m:
+          yield m.groups()
+        else:
+          yield None, None, line
+
+def yield_text_from_find_regex_events(event_log_path, verbose):
+  comment = None
+  for event in EventLogReader(event_log_path).events():
+    if "title" not in event or not event["index"].isdigit():
+      continue
+    pagenum = int(event["index"])
+    pagename = event["title"]
+    if event["type"] in ["would_save", "skip"] and "comment" in event:
+      comment_pagenum, comment_pagename, comment = pagenum, pagename, event["comment"]
+    elif event["type"] == "text":
+      if comment is not None and (pagenum != comment_pagenum or pagename != comment_pagename):
+        errmsg("WARNING: Processing text for index %s, page '%s' but saw comment '%s' for different index %s, page '%s'; ignoring"
+          % (pagenum, pagename, comment, comment_pagenum, comment_pagename))
+        comment = None
+      yield pagenum, pagename, event["text"], comment
+      comment = None
+
 def yield_text_from_find_regex(lines, verbose):
+  event_log_path = find_event_log(lines)
+  if event_log_path:
+    yield from yield_text_from_find_regex_events(event_log_path, verbose)
+    return
   in_multiline = False
   comment = None
   while True:
@@ -3162,6 +6497,12 @@ def yield_text_from_find_regex(lines, verbose):
           msg("Skipping: %s" % line)
 
 def yield_text_from_diff(lines, verbose):
+  event_log_path = find_event_log(lines)
+  if event_log_path:
+    for event in EventLogReader(event_log_path).events():
+      if event["type"] == "diff" and "title" in event and event["index"].isdigit():
+        yield event["index"], event["title"], event["text"]
+    return
   in_multiline = False
   while True:
     try:
@@ -3187,6 +6528,17 @@ def yield_text_from_diff(lines, verbose):
 def yield_pages_from_previous_output(lines, verbose):
   prev_pagenum = None
   prev_pagename = None
+  event_log_path = find_event_log(lines)
+  if event_log_path:
+    for event in EventLogReader(event_log_path).events():
+      if "title" in event and event["index"].isdigit():
+        pagenum = int(event["index"])
+        pagename = event["title"]
+        if pagenum != prev_pagenum or pagename != prev_pagename:
+          yield pagenum, pagename
+        prev_pagenum = pagenum
+        prev_pagename = pagename
+    return
   while True:
     try:
       line = next(lines)
@@ -3222,6 +6574,137 @@ def process_in_parallel(generator, process, num_workers=5):
   pool.close()
   pool.join()
 
+# Functions called in the worker processes of an OrderedWorkerPool. They are set before the pool is created and
+# inherited by the workers when they are forked, which is why they can be closures (closures can't be pickled).
+_worker_pool_process_item = None
+_worker_pool_get_state = None
+# True in the worker processes of an OrderedWorkerPool, so that processing functions can tell whether they need to
+# collect state for `get_worker_state`.
+in_worker_process = False
+
+def _init_worker_process():
+  global in_worker_process
+  in_worker_process = True
+  # The metrics collected before the fork belong to the main process; the worker's are returned per item.
+  if run_metrics is not None:
+    run_metrics.reset()
+    run_metrics.report_interval = 0
+    run_metrics.output_file = None
+  if callback_profiler is not None:
+    callback_profiler.reset()
+  # Don't share HTTP connections opened by the parent process with it; new ones are opened as needed.
+  if "pywikibot" not in sys.modules:
+    return
+  try:
+    from pywikibot.comms import http
+    http.session.close()
+  except Exception:
+    pass
+
+def _process_batch_in_worker(batch):
+  results = []
+  for item in batch:
+    output = io.StringIO()
+    error = None
+    retval = None
+    state = None
+    if event_log is not None:
+      event_log.captured = []
+    with contextlib.redirect_stdout(output):
+      try:
+        retval = _worker_pool_process_item(item)
+        if _worker_pool_get_state:
+          state = _worker_pool_get_state()
+      except Exception:
+        error = traceback.format_exc()
+    events = None
+    if event_log is not None:
+      events = event_log.captured
+      event_log.captured = None
+    metrics = run_metrics.take() if run_metrics is not None else None
+    profile = callback_profiler.take() if callback_profiler is not None else None
+    results.append((output.getvalue(), retval, error, state, events, metrics, profile))
+  return results
+
+# Process items in a pool of worker processes, emitting the output of each item in the order the items were submitted.
+# Everything the processing function writes to stdout (e.g. using msg() or a pagemsg() function) is captured in the
+# worker and written out atomically by the main process once all preceding items have been written, so the output looks
+# exactly as if the items had been processed serially (e.g. it can be read by yield_text_from_find_regex()).
+#
+# `process_item` is a function of one argument (an item), called in a worker process. It can be a closure, because the
+# workers are forked after it is set. Items and the return value of `process_item` must be picklable. If
+# `handle_result` is given, it is called in the main process as handle_result(ITEM, RETVAL) in submission order, after
+# the item's output has been written.
+#
+# Changes that `process_item` makes to module-level state (counters and such) happen in the worker processes and are
+# not seen by the main process. To carry them over, pass `get_worker_state`, a function of no arguments called in the
+# worker after each item, which should return the state accumulated since it was last called (which must be
+# picklable) and reset it, and `merge_worker_state`, a function of one argument called in the main process with each
+# such state, in submission order. `batch_size` items are sent to a worker at a time, and at most
+# `max_pending_batches` batches are outstanding at any time, bounding the memory used when items are submitted faster
+# than they can be processed.
+#
+# Use like this:
+#
+#   pool = blib.OrderedWorkerPool(process_item, num_workers)
+#   for item in items:
+#     pool.submit(item)
+#   pool.finish()
+class OrderedWorkerPool(object):
+  def __init__(self, process_item, num_workers, handle_result=None, batch_size=20, max_pending_batches=None,
+      get_worker_state=None, merge_worker_state=None):
+    global _worker_pool_process_item, _worker_pool_get_state
+    _worker_pool_process_item = process_item
+    _worker_pool_get_state = get_worker_state
+    self.handle_result = handle_result
+    self.merge_worker_state = merge_worker_state
+    self.batch_size = batch_size
+    self.max_pending_batches = max_pending_batches or 4 * num_workers
+    self.batch = []
+    self.pending = deque()
+    self.pool = mp.get_context("fork").Pool(num_workers, initializer=_init_worker_process)
+
+  def submit(self, item):
+    self.batch.append(item)
+    if len(self.batch) >= self.batch_size:
+      self.flush_batch()
+
+  def flush_batch(self):
+    if self.batch:
+      batch = self.batch
+      self.batch = []
+      self.pending.append((batch, self.pool.apply_async(_process_batch_in_worker, (batch,))))
+    while len(self.pending) > self.max_pending_batches:
+      self.emit_oldest()
+
+  def emit_oldest(self):
+    batch, async_result = self.pending.popleft()
+    for item, (output, retval, error, state, events, metrics, profile) in zip(batch, async_result.get()):
+      sys.stdout.write(output)
+      if events:
+        for event in events:
+          event_log.write_event(event)
+      if metrics:
+        run_metrics.merge(metrics)
+      if profile:
+        callback_profiler.merge(profile)
+      if error:
+        sys.stdout.flush()
+        self.pool.terminate()
+        raise RuntimeError("Error in worker process:\n%s" % error)
+      if self.merge_worker_state and state is not None:
+        self.merge_worker_state(state)
+      if self.handle_result:
+        self.handle_result(item, retval)
+    sys.stdout.flush()
+
+  def finish(self):
+    self.flush_batch()
+    while self.pending:
+      self.emit_oldest()
+    self.pool.close()
+    self.pool.join()
+
 # From wikibooks
 def levenshtein(s1, s2):
     if len(s1) < len(s2):
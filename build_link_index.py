@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Build an offline template-transclusion and category-membership index from a Wiktionary dump, for use with the
+# --link-index option of scripts that use blib.do_pagefile_cats_refs(). Every page in the dump is parsed once; see
+# blib.write_link_index() and blib.LinkIndex.
+
+import blib
+from blib import msg
+
+import argparse, sys
+
+parser = argparse.ArgumentParser(description="Build an offline transclusion and category index from a dump.")
+parser.add_argument("--dump", help="Dump file to read (plain XML or .bz2); if omitted, read the dump from stdin.")
+parser.add_argument("--output", help="Index file to write (an SQLite database).", required=True)
+args = parser.parse_args()
+
+fp = blib.open_dump(args.dump) if args.dump else sys.stdin
+num_pages = blib.write_link_index(args.output, blib.iter_dump_pages(fp))
+msg("Indexed %s pages in %s" % (num_pages, args.output))
+blib.elapsed_time()
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Build a local page store from a Wiktionary dump, for use with the --page-store option of scripts that use
+# blib.do_pagefile_cats_refs(). The store holds the compressed text, revision ID and namespace of each page along with
+# a memory-mappable title index; see blib.PageStore.
+
+import blib
+from blib import msg
+
+import argparse, sys
+
+parser = argparse.ArgumentParser(description="Build a local page store from a dump.")
+parser.add_argument("--dump", help="Dump file to read (plain XML or .bz2); if omitted, read the dump from stdin.")
+parser.add_argument("--output", help="Directory to write the page store into.", required=True)
+parser.add_argument("--namespaces", help="Only store pages in these namespaces (comma-separated namespace numbers).")
+parser.add_argument("--only-lang", help="Only store pages containing a section for this language (a canonical language name).")
+args = parser.parse_args()
+
+namespaces = set(int(ns) for ns in args.namespaces.split(",")) if args.namespaces else None
+text_prefilter = "==%s==" % args.only_lang if args.only_lang else None
+fp = blib.open_dump(args.dump) if args.dump else sys.stdin
+num_pages = blib.write_page_store(args.output, blib.iter_dump_pages(fp, namespaces=namespaces,
+  text_prefilter=text_prefilter))
+msg("Stored %s pages in %s" % (num_pages, args.output))
+blib.elapsed_time()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Check the local Scribunto backend (see scribunto.py) against expansions recorded from the server, reporting each
+# call whose local expansion differs from the server's along with a diff. The recorded expansions come either from the
+# persistent expansion cache written by blib.expand_text() with --expand-cache (--expand-cache-file, default the same
+# file that blib.expand_text() uses) or from a JSONL file (--expansions) with one object per line with keys "pagetitle",
+# "tempcall" and "result". Only calls that can be expanded locally are compared; the others are counted as
+# unsupported.
+
+import blib
+from blib import msg
+
+import argparse, difflib, json, os, re, sqlite3
+
+import scribunto
+
+parser = argparse.ArgumentParser(description="Compare local Lua expansions with recorded server expansions.")
+parser.add_argument("--expand-cache-file", help="Expansion cache to read recorded expansions from (default $BLIB_EXPAND_CACHE or ~/.cache/blib/expand_text.sqlite3).")
+parser.add_argument("--expansions", help="JSONL file to read recorded expansions from instead of the expansion cache.")
+parser.add_argument("--local-lua-dir", action="append", help="Directory to load Lua modules from (default the directory containing scribunto.py); can be repeated.")
+parser.add_argument("--page-store", help="Page store to load modules and templates not in the module directories from.")
+parser.add_argument("--filter", help="Only check calls matching this regex.")
+parser.add_argument("--limit", type=int, help="Check at most this many calls.")
+parser.add_argument("--verbose", action="store_true", help="Also show the calls that match.")
+args = parser.parse_args()
+
+def read_expansions():
+  if args.expansions:
+    with open(args.expansions, "r", encoding="utf-8") as fp:
+      for line in fp:
+        line = line.strip()
+        if line:
+          obj = json.loads(line)
+          yield obj["pagetitle"], obj["tempcall"], obj["result"]
+  else:
+    path = args.expand_cache_file or blib.default_expand_cache_path
+    if not os.path.exists(path):
+      raise ValueError("Expansion cache %s doesn't exist" % path)
+    conn = sqlite3.connect(path)
+    for row in conn.execute("SELECT pagetitle, tempcall, result FROM expansions ORDER BY pagetitle, tempcall"):
+      yield row
+
+backend = scribunto.LocalScribunto(module_dirs=args.local_lua_dir,
+  page_store=blib.PageStore(args.page_store) if args.page_store else None)
+filter_re = re.compile(args.filter) if args.filter else None
+counts = {"match": 0, "mismatch": 0, "unsupported": 0, "error": 0}
+for pagetitle, tempcall, result in read_expansions():
+  if filter_re and not filter_re.search(tempcall):
+    continue
+  if args.limit and sum(counts.values()) >= args.limit:
+    break
+  def pagemsg(txt):
+    msg("Page %s: %s" % (pagetitle, txt))
+  try:
+    local_result = backend.expand_text(tempcall, pagetitle)
+  except scribunto.LocalExpansionUnsupported as e:
+    counts["unsupported"] += 1
+    if args.verbose:
+      pagemsg("Unsupported: %s: %s" % (tempcall, e))
+    continue
+  if local_result == result:
+    counts["match"] += 1
+    if args.verbose:
+      pagemsg("Matches: %s" % tempcall)
+  elif local_result.startswith('<strong class="error">'):
+    counts["error"] += 1
+    pagemsg("WARNING: Got local error for %s: %s" % (tempcall, re.sub("<.*?>", "", local_result)))
+  else:
+    counts["mismatch"] += 1
+    pagemsg("WARNING: Local expansion of %s differs from server expansion:\n%s" % (tempcall,
+      "\n".join(difflib.unified_diff(result.split("\n"), local_result.split("\n"), "server", "local", lineterm=""))))
+msg("%s calls match, %s differ, %s got local errors, %s can't be expanded locally" % (
+  counts["match"], counts["mismatch"], counts["error"], counts["unsupported"]))
+blib.elapsed_time()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Check that blib.PageDocument round-trips page texts exactly and agrees with split_text_into_sections(),
+# find_modifiable_lang_section() and split_text_into_subsections(), using the pages in a dump. For each page, the
+# document is checked unmodified, after setting every language section and subsection to its own text (which must
+# not change anything) and after appending a line to each subsection (which must give the same text as doing the
+# same with the lower-level functions).
+
+import blib
+from blib import msg
+
+import argparse, re
+
+parser = argparse.ArgumentParser(description="Check blib.PageDocument against the section-splitting functions.")
+parser.add_argument("--dump", help="Dump file to read (plain XML or .bz2).", required=True)
+parser.add_argument("--limit", type=int, help="Check at most this many pages.")
+args = parser.parse_args()
+
+counts = {"pages": 0, "failures": 0}
+
+def check_page(index, pagetitle, text):
+  if args.limit and counts["pages"] >= args.limit:
+    return
+  counts["pages"] += 1
+  def fail(txt):
+    counts["failures"] += 1
+    msg("Page %s %s: WARNING: %s" % (index, pagetitle, txt))
+
+  doc = blib.PageDocument(text)
+  if str(doc) != text:
+    fail("Unmodified document doesn't round-trip")
+  sections, sections_by_lang, _ = blib.do_split_text_into_sections(text, None)
+  if doc.sections() != sections:
+    fail("Sections differ from split_text_into_sections()")
+  for lang in sections_by_lang:
+    retval = blib.find_modifiable_lang_section(text, lang, None)
+    _, j, secbody, sectail, _ = retval
+    if doc.lang_body(lang) != (secbody, sectail):
+      fail("Body of %s section differs from find_modifiable_lang_section()" % lang)
+    doc.set_lang_body(lang, *doc.lang_body(lang))
+    subsections = doc.subsections(lang)
+    if subsections[0] != blib.split_text_into_subsections(sections[j], None)[0]:
+      fail("Subsections of %s section differ from split_text_into_subsections()" % lang)
+    for k in range(0, len(subsections[0]), 2):
+      doc.set_subsection(lang, k, doc.subsections(lang)[0][k])
+    tree_indices = []
+    def walk(nodes, parent_level):
+      for node in nodes:
+        if node.level <= parent_level:
+          fail("Subsection %s at level %s is under a subsection at level %s" % (node.header, node.level, parent_level))
+        tree_indices.append(node.index)
+        walk(node.children, node.level)
+    walk(doc.subsection_tree(lang), 0)
+    if tree_indices != sorted(subsections[3]):
+      fail("Subsection tree of %s section doesn't contain each subsection once, in order" % lang)
+  if str(doc) != text:
+    fail("Document doesn't round-trip after no-op edits")
+
+  # Append a line to each subsection of each language, using the document and using the lower-level functions.
+  expected_sections = list(sections)
+  for lang, j in sections_by_lang.items():
+    subsections = list(blib.split_text_into_subsections(expected_sections[j], None)[0])
+    for k in range(0, len(subsections), 2):
+      subsections[k] += "added line\n"
+      doc.set_subsection(lang, k, doc.subsections(lang)[0][k] + "added line\n")
+    expected_sections[j] = "".join(subsections)
+  if str(doc) != "".join(expected_sections):
+    fail("Document differs from the expected text after appending to subsections")
+
+with blib.open_dump(args.dump) as fp:
+  blib.parse_dump(fp, check_page)
+msg("Checked %s pages, %s failures" % (counts["pages"], counts["failures"]))
+blib.elapsed_time()
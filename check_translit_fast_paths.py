@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Check that the compiled fast paths in the transliteration modules give the same output as the implementations they
+# replace, and optionally time them. The input texts are the Latin and foreign texts in each module's run_tests()
+# corpus, plus the whole corpus joined into one text with spaces and with newlines. For each module with a
+# tr_reference(), tr() is checked against it (for Arabic, also with each of the ʾiʿrāb options), and for every
+# module, str.translate() with tt_canonicalize_latin_table is checked against rsub(text, ".", tt_canonicalize_latin)
+# on the Latin texts. For Arabic, has_diacritics() is also checked against has_diacritics_reference().
+
+import blib
+from blib import msg
+
+import argparse, contextlib, importlib, io, time
+
+parser = argparse.ArgumentParser(description="Check and time the compiled transliteration fast paths.")
+parser.add_argument("--langs", help="Comma-separated codes of the languages whose modules to check (default all).",
+  default="ru,bg,ar,grc,fa")
+parser.add_argument("--bench", help="Also time the compiled versions against the reference versions.",
+  action="store_true")
+parser.add_argument("--repeat", help="With --bench, number of passes over the corpus (default 100).", type=int,
+  default=100)
+args = parser.parse_args()
+
+# For each language, whether the optional fourth argument to test() in run_tests() is the expected Latin (otherwise
+# it's the expected foreign text).
+fourth_test_arg_is_latin = {"ru": False, "bg": False, "ar": False, "grc": False, "fa": True}
+
+# Keyword arguments to check tr() with, for each language.
+tr_kwargs = {
+  "ar": [{}, {"force_translate": True}, {"force_translate": True, "omit_i3raab": True},
+         {"force_translate": True, "gray_i3raab": True}],
+}
+
+counts = {"checks": 0, "failures": 0}
+
+# Return a tuple (LATIN, FOREIGN) of the Latin and foreign texts passed to test() by the run_tests() of the
+# transliteration module for LANG, without running the tests.
+def get_test_corpus(lang, module):
+  latin = []
+  foreign = []
+  def collect(*testargs, **kwargs):
+    for i, arg in enumerate(testargs):
+      if not isinstance(arg, str) or i == 2:
+        continue
+      if i == 0 or i == 3 and fourth_test_arg_is_latin[lang]:
+        latin.append(arg)
+      else:
+        foreign.append(arg)
+  orig_test = module.test
+  module.test = collect
+  try:
+    with contextlib.redirect_stdout(io.StringIO()):
+      module.run_tests()
+  finally:
+    module.test = orig_test
+  def with_joined(texts):
+    texts = list(dict.fromkeys(texts))
+    return texts + [" ".join(texts), "\n".join(texts)]
+  return with_joined(latin), with_joined(foreign)
+
+# Call FUN on TEXT with keyword arguments KWARGS, returning the result or a description of the exception raised.
+def call(fun, text, kwargs):
+  try:
+    return fun(text, **kwargs)
+  except Exception as e:
+    return "EXCEPTION %s: %s" % (type(e).__name__, e)
+
+def check(lang, what, text, expected, actual):
+  counts["checks"] += 1
+  if expected != actual:
+    counts["failures"] += 1
+    msg("%s: WARNING: %s differs for %r: expected %r, got %r" % (lang, what, text, expected, actual))
+
+# Return the average time in microseconds of calling FUN on each of TEXTS, over args.repeat passes.
+def time_calls(fun, texts):
+  start = time.perf_counter()
+  for i in range(args.repeat):
+    for text in texts:
+      fun(text)
+  return (time.perf_counter() - start) * 1000000 / (args.repeat * len(texts))
+
+def bench(lang, what, reference, compiled, texts):
+  reference_time = time_calls(reference, texts)
+  compiled_time = time_calls(compiled, texts)
+  msg("%s: %s: reference %.2f us/call, compiled %.2f us/call, %.1fx faster" % (
+    lang, what, reference_time, compiled_time, reference_time / compiled_time))
+
+for lang in args.langs.split(","):
+  module = importlib.import_module("%s_translit" % lang)
+  latin, foreign = get_test_corpus(lang, module)
+  msg("%s: %s Latin and %s foreign texts" % (lang, len(latin), len(foreign)))
+
+  def canonicalize_reference(text):
+    return module.rsub(text, ".", module.tt_canonicalize_latin)
+  def canonicalize_compiled(text):
+    return text.translate(module.tt_canonicalize_latin_table)
+  for text in latin:
+    check(lang, "tt_canonicalize_latin_table", text, canonicalize_reference(text), canonicalize_compiled(text))
+  if args.bench:
+    bench(lang, "tt_canonicalize_latin_table", canonicalize_reference, canonicalize_compiled, latin)
+
+  if hasattr(module, "has_diacritics_reference"):
+    for text in foreign + latin:
+      check(lang, "has_diacritics()", text, module.has_diacritics_reference(text), module.has_diacritics(text))
+    if args.bench:
+      bench(lang, "has_diacritics()", module.has_diacritics_reference, module.has_diacritics, foreign)
+
+  if hasattr(module, "tr_reference"):
+    for kwargs in tr_kwargs.get(lang, [{}]):
+      what = "tr(%s)" % ", ".join("%s=%s" % (k, v) for k, v in kwargs.items())
+      for text in foreign + latin:
+        check(lang, what, text, call(module.tr_reference, text, kwargs), call(module.tr, text, kwargs))
+      if args.bench:
+        bench(lang, what, lambda text: call(module.tr_reference, text, kwargs),
+              lambda text: call(module.tr, text, kwargs), foreign)
+
+msg("Did %s checks, %s failures" % (counts["checks"], counts["failures"]))
+blib.elapsed_time()
@@ -711,6 +711,16 @@ def check_for_redundant_translit(ru, tr, pagemsg, warnfun, expand_text):
     tr, autotr, ru))
   return ru, tr
 
+# Batch version of check_for_redundant_translit(). RU_TRS is a list of (RU, TR)
+# tuples, and EXPAND_MANY a function of one argument (a list of template
+# calls) returning a list of their expansions. All needed transliterations
+# are generated in a single batch. Return a list of (RU, TR) tuples.
+def check_for_redundant_translit_many(ru_trs, pagemsg, warnfun, expand_many):
+  calls = ["{{xlit|ru|%s}}" % ru for ru, tr in ru_trs if tr]
+  expansions = dict(zip(calls, expand_many(calls))) if calls else {}
+  return [check_for_redundant_translit(ru, tr, pagemsg, warnfun,
+    lambda tempcall: expansions[tempcall]) for ru, tr in ru_trs]
+
 # Return True if LEMMA (in the form RUSSIAN or RUSSIAN/TRANSLIT) matches the
 # specified Cyrillic term RU, with possible manual transliteration TR
 # (may be empty). Issue a warning if Cyrillic matches but not translit.
@@ -854,6 +864,8 @@ def create_inflection_entry(program_args, save, index, inflections, lemma,
     pagemsg(txt, fun=errmsg)
   def expand_text(tempcall):
     return blib.expand_text(tempcall, pagename, pagemsg, verbose)
+  def expand_many(tempcalls):
+    return blib.expand_many(tempcalls, pagename, pagemsg, verbose)
   def warn(warning, simple=False, err=False):
     text = format_pagemsg_text(warning, simple)
     issue_warning(text, errpagemsg if err else pagemsg, warnings)
@@ -867,8 +879,10 @@ def create_inflection_entry(program_args, save, index, inflections, lemma,
       return warnings
 
   # Remove any redundant manual translit
-  lemma, lemmatr = check_for_redundant_translit(lemma, lemmatr, pagemsg, warn, expand_text)
-  inflections = [check_for_redundant_translit(infl, infltr, pagemsg, warn, expand_text) for infl, infltr in inflections]
+  lemma_and_inflections = check_for_redundant_translit_many([(lemma, lemmatr)] + inflections, pagemsg, warn,
+    expand_many)
+  lemma, lemmatr = lemma_and_inflections[0]
+  inflections = lemma_and_inflections[1:]
 
   is_participle = "_part" in infltype
   is_adverbial_participle = "adv_part" in infltype
@@ -3041,8 +3055,23 @@ def create_forms(lemmas_to_process, lemmas_no_jo, lemmas_to_overwrite,
         multiple_noun_animacies = True
         pagemsg("Found multiple animacies for noun")
 
+    # Expand the calls that generate the forms of all the inflection templates
+    # in a single batch, by first recording the calls that GENERATE_FORMS makes.
+    generate_forms_calls = []
+    def record_call(tempcall):
+      generate_forms_calls.append(tempcall)
+      return False
+    for infltemp, headword_gender in inflection_templates:
+      generate_forms(infltemp, record_call)
+    generate_forms_expansions = dict(zip(generate_forms_calls,
+      blib.expand_many(generate_forms_calls, pagetitle, pagemsg, verbose))) if generate_forms_calls else {}
+    def expand_generate_forms_call(tempcall):
+      if tempcall in generate_forms_expansions:
+        return generate_forms_expansions[tempcall]
+      return expand_text(tempcall)
+
     for infltemp, headword_gender in inflection_templates:
-      result = generate_forms(infltemp, expand_text)
+      result = generate_forms(infltemp, expand_generate_forms_call)
       if not result:
         pagemsg("WARNING: Error generating %s forms, skipping" % pos)
         continue
@@ -1,28 +1,48 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+# Write a local snapshot of the language, etymology-language, family, script and alias data, which is used by
+# blib.getData() etc. instead of fetching the data from the server (see blib.load_lang_data_snapshot()). With
+# --pickle, also write a pickle of the snapshot, which loads much faster.
+
 import blib
-import json
+import argparse, json, os
 
-lang_outfile = "lang-data.json"
-etymlang_outfile = "etymlang-data.json"
-family_outfile = "family-data.json"
-script_outfile = "script-data.json"
+parser = argparse.ArgumentParser(description="Write a local snapshot of language data.")
+parser.add_argument("--directory", help="Directory to write the snapshot to (default the current directory).", default=".")
+parser.add_argument("--pickle", help="Also write a pickle of the snapshot for faster loading.", action="store_true")
+args = parser.parse_args()
 
+# Always fetch the data from the server, not from an existing snapshot.
+blib.lang_data_snapshot = False
 blib.getData()
 
-with open(lang_outfile, "w") as fp:
+def outfile(key):
+  return os.path.join(args.directory, blib.lang_data_snapshot_files[key])
+
+with open(outfile("languages"), "w") as fp:
   for lang in blib.languages:
     fp.write(json.dumps(lang) + "\n")
 
-with open(etymlang_outfile, "w") as fp:
+with open(outfile("etym_languages"), "w") as fp:
   for lang in blib.etym_languages:
     fp.write(json.dumps(lang) + "\n")
 
-with open(family_outfile, "w") as fp:
+with open(outfile("families"), "w") as fp:
   for fam in blib.families:
     fp.write(json.dumps(fam) + "\n")
 
-with open(script_outfile, "w") as fp:
+with open(outfile("scripts"), "w") as fp:
   for scr in blib.scripts:
     fp.write(json.dumps(scr) + "\n")
+
+with open(outfile("aliases"), "w") as fp:
+  json.dump(blib.language_aliases_to_canonical, fp)
+
+blib.write_lang_data_stamp(args.directory)
+pickle_path = os.path.join(args.directory, blib.lang_data_pickle_file)
+if args.pickle:
+  blib.write_lang_data_pickle(args.directory)
+elif os.path.exists(pickle_path):
+  # Remove the pickle of the old snapshot, which would otherwise be ignored with a warning.
+  os.unlink(pickle_path)
@@ -6,7 +6,7 @@ import re, unicodedata
 import arabiclib
 from arabiclib import *
 import blib
-from blib import remove_links, msg, msgn, tname
+from blib import remove_links, msg, msgn, tname, char_translation_table
 
 # Some issues to take care of:
 #
@@ -586,6 +586,9 @@ for alt in build_canonicalize_latin:
   if canon != "multiple":
     tt_canonicalize_latin[alt] = canon
 
+# str.translate() version of tt_canonicalize_latin.
+tt_canonicalize_latin_table = char_translation_table(tt_canonicalize_latin)
+
 # A list of Latin characters that are allowed to have particular unmatched
 # Arabic characters following. This is used to allow short Latin vowels
 # to correspond to long Arabic vowels. The value is the list of possible
@@ -862,7 +865,7 @@ def canonicalize_latin_foreign(obj, latin, arabic, msgfun=msg):
     def quote_subst(m):
       return m.group(0).replace("'", multi_single_quote_subst)
     latin = re.sub(r"''+", quote_subst, latin)
-    latin = rsub(latin, ".", tt_canonicalize_latin)
+    latin = latin.translate(tt_canonicalize_latin_table)
     latin_chars = "[a-zA-Zâêîôûčḍḏḡḥḵṣšṭṯẓžʿʾ]"
     # Convert 3 to ʿ if next to a letter or letter symbol. This tries
     # to avoid converting 3 in numbers.
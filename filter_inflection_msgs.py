@@ -3,6 +3,7 @@
 
 import re, sys, argparse
 
+import blib
 from blib import msg, errmsg
 import rulib
 
@@ -13,13 +14,23 @@ start, end = blib.parse_start_end(args.start, args.end)
 
 pagenos = set()
 
-for lineno, line in blib.iter_items_from_file(args.direcfile, start, end):
-  if "Would save with comment" in line:
-    m = re.search("^Page ([0-9]+) .*Would save with comment.* (?:of|dictionary form) (.*?)(,| after| before| \(add| \(modify| \(update|$)", line)
-    if not m:
-      errmsg("WARNING: Unable to parse line: %s" % line)
-    else:
-      pagenos.add(m.group(1))
+def check_would_save_line(line):
+  m = re.search("^Page ([0-9]+) .*Would save with comment.* (?:of|dictionary form) (.*?)(,| after| before| \(add| \(modify| \(update|$)", line)
+  if not m:
+    errmsg("WARNING: Unable to parse line: %s" % line)
+  else:
+    pagenos.add(m.group(1))
+
+event_log_path = blib.find_event_log(args.direcfile)
+if event_log_path and start is None and end is None:
+  # Only look at the save events rather than every line.
+  for event in blib.EventLogReader(event_log_path).events():
+    if event["type"] == "would_save":
+      check_would_save_line("Page %s %s: %s" % (event["index"], event["title"], event["text"]))
+else:
+  for lineno, line in blib.iter_items_from_file(args.direcfile, start, end):
+    if "Would save with comment" in line:
+      check_would_save_line(line)
 
 for lineno, line in blib.iter_items_from_file(args.direcfile, start, end):
   m = re.search("^Page ([0-9]+) ", line)
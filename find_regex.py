@@ -4,7 +4,6 @@
 # Find pages that need definitions among a set list (e.g. most frequent words).
 
 import blib, re, sys
-import pywikibot
 
 import blib
 from blib import getparam, rmparam, msg, site
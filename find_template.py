@@ -8,11 +8,6 @@ import blib
 from blib import getparam, rmparam, msg, site, tname
 
 def process_text_on_page(index, pagetitle, text, templates, paramspecs, countparams, counted_param_values_by_template):
-  if not any(template in text for template in templates):
-    return
-  #if not re.search(r"\{\{\s*(%s)" % "|".join(templates), text):
-  #  return
-
   def pagemsg(txt):
     msg("Page %s %s: %s" % (index, pagetitle, txt))
 
@@ -20,7 +15,7 @@ def process_text_on_page(index, pagetitle, text, templates, paramspecs, countpar
     pagemsg("Processing")
   notes = []
 
-  parsed = blib.parse_text(text)
+  parsed = blib.parse_text(text, cached=True)
 
   paramset = paramspecs and set(paramspecs) or set()
 
@@ -67,6 +62,8 @@ def process_text_on_page(index, pagetitle, text, templates, paramspecs, countpar
             if pvalue not in counted_param_values[pname]:
               output_found("new value %s=%s for %s template" % (pname, pvalue, tn))
             counted_param_values[pname][pvalue] += 1
+            if blib.in_worker_process:
+              param_value_counts_since_last_merge[(tn, pname, pvalue)] += 1
           if args.negate:
             if pname not in paramset:
               output_found("%s template with unrecognized param %s=%s" % (tn, pname, pvalue))
@@ -97,6 +94,8 @@ def process_text_on_page(index, pagetitle, text, templates, paramspecs, countpar
               if None not in counted_param_values[countparam]:
                 output_found("new value %s=(unseen) for %s template" % (countparam, tn))
               counted_param_values[countparam][None] += 1
+              if blib.in_worker_process:
+                param_value_counts_since_last_merge[(tn, countparam, None)] += 1
   if args.single_line:
     if template_occurrences:
       pagemsg("Found %s" % "; ".join("%s (%s)" % (temptext, gloss) for gloss, temptext in template_occurrences))
@@ -178,8 +177,27 @@ countparams = re.split(",", args.count) if args.count else []
 counted_param_values_by_template = {template: {} for template in templates}
 def do_process_text_on_page(index, pagetitle, text):
   process_text_on_page(index, pagetitle, text, templates, paramspecs, countparams, counted_param_values_by_template)
+
+# When processing in parallel, the counts are accumulated separately in each worker, and the counts for each page are
+# merged into the counts in the main process. (Each worker reports the values it hasn't seen before as new.) The
+# per-page counts are only recorded in worker processes, since otherwise nothing takes them.
+param_value_counts_since_last_merge = defaultdict(int)
+def get_worker_state():
+  global param_value_counts_since_last_merge
+  state = param_value_counts_since_last_merge
+  param_value_counts_since_last_merge = defaultdict(int)
+  return state
+
+def merge_worker_state(state):
+  for (template, pname, pvalue), count in state.items():
+    counted_param_values = counted_param_values_by_template[template]
+    if pname not in counted_param_values:
+      counted_param_values[pname] = defaultdict(int)
+    counted_param_values[pname][pvalue] += count
+
 blib.do_pagefile_cats_refs(args, start, end, do_process_text_on_page, stdin=True,
-    default_refs=["Template:%s" % template for template in templates])
+    default_refs=["Template:%s" % template for template in templates],
+    get_worker_state=get_worker_state, merge_worker_state=merge_worker_state, templates=templates)
 
 for template in templates:
   counted_param_values = counted_param_values_by_template[template]
@@ -5,7 +5,7 @@
 import re
 import unicodedata
 
-from blib import remove_links, msg
+from blib import remove_links, msg, char_translation_table
 
 # FIXME:
 #
@@ -133,9 +133,9 @@ iotate_vowel = {"α":"ᾳ", "Α":"ᾼ",
                 "η":"ῃ", "Ε":"ῌ",
                 "ω":"ῳ", "Ω":"ῼ",}
 
-# Transliterates text, which should be a single word or phrase. It should
-# include stress marks, which are then preserved in the transliteration.
-def tr(text, lang=None, sc=None, msgfun=msg):
+# Reference implementation of tr(), which tr() below must agree with; used by
+# check_translit_fast_paths.py to check the compiled version and time it.
+def tr_reference(text, lang=None, sc=None, msgfun=msg):
     text = remove_links(text)
     text = tr_canonicalize_greek(text)
 
@@ -149,6 +149,30 @@ def tr(text, lang=None, sc=None, msgfun=msg):
 
     return text
 
+# Compiled regexes and tables used by tr().
+tr_gamma_nasal_re = re.compile("γ([γκξχ])")
+tr_h_before_capital_re = re.compile("h([AEIOU])")
+tt_table = char_translation_table(tt)
+
+# Transliterates text, which should be a single word or phrase. It should
+# include stress marks, which are then preserved in the transliteration.
+# This does the same as tr_reference() but with precompiled regexes and
+# str.translate() in place of a per-character rsub().
+def tr(text, lang=None, sc=None, msgfun=msg):
+    text = remove_links(text)
+    text = tr_canonicalize_greek(text)
+
+    text = tr_gamma_nasal_re.sub(r"n\1", text)
+    text = text.replace("ρρ", "rrh")
+
+    text = text.translate(tt_table)
+
+    # compose accented characters, fix hA and similar
+    text = tr_h_before_capital_re.sub(lambda m: "H" + m.group(1).lower(), text)
+    text = nfc_form(text)
+
+    return text
+
 ############################################################################
 #                      Transliterate from Latin to Greek                   #
 ############################################################################
@@ -296,6 +320,9 @@ for alt in build_canonicalize_latin:
     if canon != "multiple":
         tt_canonicalize_latin[alt] = canon
 
+# str.translate() version of tt_canonicalize_latin.
+tt_canonicalize_latin_table = char_translation_table(tt_canonicalize_latin)
+
 # A list of Latin characters that are allowed to be unmatched in the
 # Greek. The value is the corresponding Greek character to insert.
 tt_to_greek_unmatching = {
@@ -367,7 +394,7 @@ def canonicalize_latin_greek(latin, greek, msgfun=msg):
         def quote_subst(m):
             return m.group(0).replace("'", multi_single_quote_subst)
         latin = re.sub(r"''+", quote_subst, latin)
-        latin = rsub(latin, ".", tt_canonicalize_latin)
+        latin = latin.translate(tt_canonicalize_latin_table)
         latin = latin.replace(multi_single_quote_subst, "'")
         latin = post_canonicalize_latin(latin)
     return (latin, greek)
@@ -375,6 +402,16 @@ def canonicalize_latin_greek(latin, greek, msgfun=msg):
 def canonicalize_latin_foreign(latin, greek, msgfun=msg):
     return canonicalize_latin_greek(latin, greek, msgfun=msgfun)
 
+# Compiled regexes used by tr_canonicalize_greek(), which is called on every
+# call to tr().
+tr_greek_diphthong_breathing_re = re.compile(r"(^|[ \[\]|])(" +
+        greek_diphthong_first_vowels + MBSOPT + "[υι])(" + RS + ")(?!" +
+        GR_ACC_NO_DIA + "*" + DIA + ")")
+tr_greek_vowel_breathing_re = re.compile(r"(^|[ \[\]|])(" + greek_vowels +
+        MBSOPT + ")(" + RS + ")")
+tr_greek_iotated_vowel_re = re.compile("([αΑηΗωΩ])(" + GR_ACC_NO_IOBE +
+        "*)" + IOBE)
+
 def tr_canonicalize_greek(text):
     # Convert to decomposed form
     text = nfd_form(text)
@@ -388,19 +425,16 @@ def tr_canonicalize_greek(text):
     # in order with multiple accents, except macron or breve. Second vowel of
     # diphthong must be υ or ι and no following diaeresis. Only do it at
     # beginning of word.
-    text = rsub(text, r"(^|[ \[\]|])(" + greek_diphthong_first_vowels + MBSOPT +
-            "[υι])(" + RS + ")(?!" + GR_ACC_NO_DIA + "*" + DIA + ")",
-            r"\1\3\2")
+    text = tr_greek_diphthong_breathing_re.sub(r"\1\3\2", text)
     # Put rough/smooth breathing before vowel; rough breathing comes first in
     # order with multiple accents, except macron or breve. Only do it at
     # beginning of word.
-    text = rsub(text, r"(^|[ \[\]|])(" + greek_vowels + MBSOPT + ")(" +
-            RS + ")", r"\1\3\2")
+    text = tr_greek_vowel_breathing_re.sub(r"\1\3\2", text)
     # Recombine iotated vowels; iotated accent comes last in order.
     # We do this because iotated vowels have special Latin mappings that
     # aren't just sum-of-parts (i.e. with an extra macron in the case of αΑ).
-    text = rsub(text, "([αΑηΗωΩ])(" + GR_ACC_NO_IOBE + "*)" + IOBE,
-            lambda m:iotate_vowel[m.group(1)] + m.group(2))
+    text = tr_greek_iotated_vowel_re.sub(
+            lambda m:iotate_vowel[m.group(1)] + m.group(2), text)
     return text
 
 # Early pre-canonicalization of Greek, doing stuff that's safe. We split
@@ -287,6 +287,46 @@ def generate_infl_forms(pos, template, errandpagemsg, expand_text,
     errandpagemsg("WARNING: Bad pos=%s, expected noun/verb/adj/nounadj/numadj/part" % pos)
     return None
 
+# Batch variants of the above functions: generate the forms of each of `templates` (a list of declension or
+# conjugation templates), returning a list of the results of the corresponding single-template function. All the
+# necessary expansions are done in bulk by `expand_many`, a function of one argument (a list of template calls) that
+# returns a list of the expansions (e.g. a wrapper around blib.expand_many()). This works by first calling the
+# single-template function with an expand_text function that just records the calls, and then calling it again with
+# one that returns the bulk expansions.
+def generate_forms_many(generate_forms, templates, errandpagemsg, expand_many, *args, **kwargs):
+  calls = []
+  def record_call(tempcall):
+    calls.append(tempcall)
+    return False
+  for template in templates:
+    generate_forms(template, lambda txt: None, record_call, *args, **kwargs)
+  expansions = dict(zip(calls, expand_many(calls))) if calls else {}
+  return [generate_forms(template, errandpagemsg, lambda tempcall: expansions[tempcall], *args, **kwargs)
+          for template in templates]
+
+def generate_adj_forms_many(templates, errandpagemsg, expand_many, return_raw=False,
+    include_linked=False):
+  return generate_forms_many(generate_adj_forms, templates, errandpagemsg, expand_many, return_raw,
+      include_linked)
+
+def generate_noun_forms_many(templates, errandpagemsg, expand_many, return_raw=False,
+    include_linked=False):
+  return generate_forms_many(generate_noun_forms, templates, errandpagemsg, expand_many, return_raw,
+      include_linked)
+
+def generate_verb_forms_many(templates, errandpagemsg, expand_many, return_raw=False,
+    include_linked=False, include_props=False, add_sync_forms=False):
+  return generate_forms_many(generate_verb_forms, templates, errandpagemsg, expand_many, return_raw,
+      include_linked, include_props, add_sync_forms=add_sync_forms)
+
+def generate_infl_forms_many(pos, templates, errandpagemsg, expand_many,
+    return_raw=False, include_linked=False, include_props=False,
+    add_sync_verb_forms=False):
+  def generate_forms(template, errandpagemsg, expand_text):
+    return generate_infl_forms(pos, template, errandpagemsg, expand_text, return_raw, include_linked,
+        include_props, add_sync_verb_forms)
+  return generate_forms_many(generate_forms, templates, errandpagemsg, expand_many)
+
 uppercase = "A-ZĀĒĪŌŪȲĂĔĬŎŬÄËÏÖÜŸ"
 lowercase = "a-zāēīōūȳăĕĭŏŭäëïöüÿ"
 vowel = "aeiouyAEIOUYāēīōūȳăĕĭŏŭäëïöüÿĀĒĪŌŪȲĂĔĬŎŬÄËÏÖÜŸ"
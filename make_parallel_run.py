@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import argparse
+# Generate a shell script running a bot script in NUM-PARTS background jobs over fixed index ranges. See also
+# parallel_run.py, which hands out small batches to the workers as they become free, merges the output in index order
+# and can resume failed batches.
+
+import argparse, os, shlex
 
 parser = argparse.ArgumentParser(description="Generate script to run a bot script in parallel.")
 parser.add_argument('--num-parts', help="Number of parallel parts.", type=int, default=10)
@@ -11,10 +15,15 @@ parser.add_argument('--num-terms', help="Approximate number of terms that will b
 parser.add_argument('--overlap', help="Number of terms that each run will overlap with the next run. Set to 0 for no overlap.", type=int, default=5)
 parser.add_argument('--no-sleep', help="Don't sleep at beginning of runs (normally done so offsets will remain true; not necessary if offsets won't change as files are saved).", action="store_true")
 parser.add_argument('--no-save', help="Don't add --save to the commands.", action="store_true")
+parser.add_argument('--rate-limit', help="Maximum number of API requests per minute made by all runs together (passed to blib in $BLIB_RATE_LIMIT, with the rate limiter state in OUTPUT-PREFIX.rate-limit.json).", type=float)
 args = parser.parse_args()
 
 print("#!/bin/sh")
 print()
+if args.rate_limit:
+  print("export BLIB_RATE_LIMIT=%s" % args.rate_limit)
+  print("export BLIB_RATE_LIMIT_FILE=%s" % shlex.quote(os.path.abspath(args.output_prefix + ".rate-limit.json")))
+  print()
 
 num_terms_per_run = args.num_terms // args.num_parts
 first_part_num_terms = int(0.4 * num_terms_per_run)
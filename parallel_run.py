@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Run a bot script in parallel over its pages. Unlike make_parallel_run.py, which generates a shell script with one
+# long-running job per part and fixed index ranges, this splits the pages into small batches and hands them out to the
+# worker processes on demand, so that all workers finish at about the same time. The stdout of each batch is written to
+# a file in the state directory, and the batch outputs are concatenated in order into a single output file as soon as
+# all preceding batches are done. Completed batches are recorded, so if some batches fail (or the run is interrupted),
+# rerunning with --resume runs only the batches that haven't completed.
+#
+# The page source (--pages, --pagefile, --cats, --refs, etc. in the command) is listed once, by running the command
+# with blib's --list-pages-to (passed in $BLIB_LIST_PAGES_TO), which lists the index and title of each page the script
+# would process instead of processing it. The listing is kept in the state directory and reused by --resume. Each batch
+# then runs the command on its part of the listing, passed using blib's --page-batch (in $BLIB_PAGE_BATCH), so the
+# pages keep their indices and the page source isn't listed again, even if the run itself changes it. If the script
+# calls blib.do_pagefile_cats_refs() more than once (e.g. a counting pass followed by an editing pass), each batch
+# gets the same part of the pages of each call. %START and %END in the command are removed, and %SAVE is replaced by
+# --save unless --no-save, with --save left out of the listing run.
+#
+# Scripts that read their pages from stdin or a dump can't be listed this way. For them, use --no-list and
+# --num-terms: the command is then run once per batch with %START and %END replaced by the batch's page indices, as
+# for make_parallel_run.py, and each batch reads its pages anew.
+#
+# Example:
+#
+# python3 parallel_run.py --command "python3 fix_links.py --cats 'Russian nouns'" --output fix_links.out \
+#   --num-workers 10 --batch-size 200
+
+import blib
+from blib import msg, errandmsg
+
+import argparse, json, os, queue, subprocess, sys, threading
+
+parser = argparse.ArgumentParser(description="Run a bot script in parallel, handing out batches of pages on demand.")
+parser.add_argument('--command', help="Command to run; %%SAVE is replaced by --save, and with --no-list, %%START and %%END by the batch's start and end index.", required=True)
+parser.add_argument('--output', help="File to write the merged output of all batches to.", required=True)
+parser.add_argument('--state-dir', help="Directory for the page listing, the output of each batch and the record of completed batches (default OUTPUT.batches).")
+parser.add_argument('--num-workers', help="Number of batches to run at once.", type=int, default=10)
+parser.add_argument('--batch-size', help="Number of pages (or with --no-list, terms) in each batch.", type=int, default=100)
+parser.add_argument('--no-list', help="Don't list the pages first; instead run each batch over a range of page indices, which it lists itself. Needed for scripts reading pages from stdin or a dump.", action="store_true")
+parser.add_argument('--num-terms', help="With --no-list, approximate number of terms that will be run on.", type=int)
+parser.add_argument('--overlap', help="With --no-list, number of terms that each batch will overlap with the next one.", type=int, default=0)
+parser.add_argument('--no-save', help="Don't add --save to the commands.", action="store_true")
+parser.add_argument('--resume', help="Resume a previous run using the same state directory, rerunning only failed or unfinished batches.", action="store_true")
+parser.add_argument('--rate-limit', help="Maximum number of API requests per minute made by all batches together (passed to blib in $BLIB_RATE_LIMIT, with the rate limiter state in the state directory).", type=float)
+args = parser.parse_args()
+if args.no_list and not args.num_terms:
+  parser.error("--num-terms is required with --no-list")
+
+state_dir = args.state_dir or args.output + ".batches"
+done_file = os.path.join(state_dir, "done")
+params_file = os.path.join(state_dir, "params.json")
+listing_file = os.path.join(state_dir, "pages.jsonl")
+
+command = args.command
+if "%SAVE" not in command:
+  command += " %SAVE"
+if args.no_list and "%START" not in command:
+  command += " %START %END"
+
+params = {"command": command, "batch_size": args.batch_size, "list": not args.no_list}
+if args.no_list:
+  params.update({"num_terms": args.num_terms, "overlap": args.overlap})
+if os.path.exists(params_file):
+  if not args.resume:
+    raise ValueError("State directory %s already exists; use --resume to resume the previous run or remove it"
+                     % state_dir)
+  with open(params_file, "r", encoding="utf-8") as fp:
+    old_params = json.load(fp)
+  if old_params != params:
+    raise ValueError("Can't resume: command or batch settings differ from the previous run: %s" % old_params)
+else:
+  os.makedirs(state_dir, exist_ok=True)
+  with open(params_file, "w", encoding="utf-8") as fp:
+    json.dump(params, fp)
+
+completed = set()
+if os.path.exists(done_file):
+  with open(done_file, "r", encoding="utf-8") as fp:
+    for line in fp:
+      line = line.strip()
+      if line:
+        completed.add(tuple(int(x) for x in line.split("-")))
+
+# Environment of the batch commands, which share a rate limiter if --rate-limit is given.
+batch_env = dict(os.environ)
+if args.rate_limit:
+  batch_env["BLIB_RATE_LIMIT"] = str(args.rate_limit)
+  batch_env["BLIB_RATE_LIMIT_FILE"] = os.path.abspath(os.path.join(state_dir, "rate-limit.json"))
+
+def substitute_command(start="", end="", save=not args.no_save):
+  return command.replace("%START", str(start)).replace("%END", str(end)).replace("%SAVE", "--save" if save else "")
+
+# List the pages by running the command with --list-pages-to, unless a previous run did. Return the listing, as a list
+# of lists of entries (each a dictionary with keys "call", "index", "title" and "category"), one list for each call of
+# blib.do_pagefile_cats_refs() by the script.
+def list_pages():
+  if not os.path.exists(listing_file):
+    temp_listing_file = listing_file + ".tmp"
+    if os.path.exists(temp_listing_file):
+      os.unlink(temp_listing_file)
+    msg("Listing pages")
+    env = dict(batch_env)
+    env["BLIB_LIST_PAGES_TO"] = os.path.abspath(temp_listing_file)
+    with open(os.path.join(state_dir, "listing.out"), "w", encoding="utf-8") as fp:
+      retcode = subprocess.call(substitute_command(save=False), shell=True, stdout=fp, env=env)
+    if retcode != 0:
+      raise ValueError("Listing the pages failed with exit code %s; see %s" % (
+        retcode, os.path.join(state_dir, "listing.out")))
+    if not os.path.exists(temp_listing_file):
+      raise ValueError("Listing the pages produced no listing; does the script use blib.do_pagefile_cats_refs()?")
+    os.rename(temp_listing_file, listing_file)
+  entries_by_call = {}
+  with open(listing_file, "r", encoding="utf-8") as fp:
+    for line in fp:
+      entry = json.loads(line)
+      entries_by_call.setdefault(entry["call"], []).append(entry)
+  return [entries_by_call[call] for call in sorted(entries_by_call)]
+
+batches = []
+if args.no_list:
+  for first_term_index in range(1, args.num_terms + 1, args.batch_size):
+    last_term_index = min(first_term_index + args.batch_size - 1 + args.overlap, args.num_terms)
+    batches.append((first_term_index, last_term_index))
+else:
+  listing = list_pages()
+  num_pages = max([len(entries) for entries in listing] or [0])
+  msg("Listed %s pages" % " + ".join(str(len(entries)) for entries in listing))
+  # Batches are (FIRST, LAST) positions (1-based) in the listing of each call.
+  for first_position in range(1, num_pages + 1, args.batch_size):
+    batches.append((first_position, min(first_position + args.batch_size - 1, num_pages)))
+
+def batch_output_file(batch):
+  return os.path.join(state_dir, "%s-%s.out" % batch)
+
+def batch_pages_file(batch):
+  return os.path.join(state_dir, "%s-%s.pages.jsonl" % batch)
+
+done_lock = threading.Lock()
+# Batch -> True if succeeded, False if failed; set when a batch finishes, read by the merging code.
+batch_results = {}
+batch_finished = threading.Condition(done_lock)
+
+def run_batch(batch):
+  first, last = batch
+  env = batch_env
+  if args.no_list:
+    batch_command = substitute_command(first, last)
+  else:
+    batch_command = substitute_command()
+  # Always record the result, even if running the batch raised an exception (e.g. the output file can't be opened),
+  # so the merging code doesn't wait forever for it.
+  succeeded = False
+  try:
+    if not args.no_list:
+      with open(batch_pages_file(batch), "w", encoding="utf-8") as fp:
+        for entries in listing:
+          for entry in entries[first - 1:last]:
+            fp.write(json.dumps(entry, ensure_ascii=False) + "\n")
+      env = dict(batch_env)
+      env["BLIB_PAGE_BATCH"] = os.path.abspath(batch_pages_file(batch))
+    with open(batch_output_file(batch), "w", encoding="utf-8") as fp:
+      retcode = subprocess.call(batch_command, shell=True, stdout=fp, env=env)
+    with done_lock:
+      if retcode == 0:
+        with open(done_file, "a", encoding="utf-8") as fp:
+          fp.write("%s-%s\n" % batch)
+        succeeded = True
+      else:
+        errandmsg("WARNING: Batch %s-%s failed with exit code %s" % (first, last, retcode))
+  except Exception as e:
+    errandmsg("WARNING: Batch %s-%s failed: %s" % (first, last, e))
+  finally:
+    with done_lock:
+      batch_results[batch] = succeeded
+      batch_finished.notify_all()
+
+batch_queue = queue.Queue()
+for batch in batches:
+  if batch in completed:
+    batch_results[batch] = True
+  else:
+    batch_queue.put(batch)
+num_to_run = batch_queue.qsize()
+msg("Running %s of %s batches of %s %s using %s workers" % (num_to_run, len(batches), args.batch_size,
+                                                          "terms" if args.no_list else "pages", args.num_workers))
+
+def worker():
+  while True:
+    try:
+      batch = batch_queue.get_nowait()
+    except queue.Empty:
+      return
+    run_batch(batch)
+
+threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.num_workers)]
+for thread in threads:
+  thread.start()
+
+# Concatenate the batch outputs into the merged output file in order, as soon as each batch and all batches before it
+# are done. A failed batch stops the merge at that point (later batches are still run); the merged output is completed
+# on a later --resume run.
+failed_batches = []
+num_merged = 0
+with open(args.output, "w", encoding="utf-8") as outfp:
+  for batch in batches:
+    with done_lock:
+      while batch not in batch_results:
+        batch_finished.wait()
+      succeeded = batch_results[batch]
+    if not succeeded:
+      failed_batches.append(batch)
+      continue
+    if failed_batches:
+      continue
+    with open(batch_output_file(batch), "r", encoding="utf-8") as infp:
+      outfp.write(infp.read())
+    outfp.flush()
+    num_merged += 1
+
+for thread in threads:
+  thread.join()
+
+msg("Merged output of %s of %s batches into %s" % (num_merged, len(batches), args.output))
+if failed_batches:
+  msg("Failed batches: %s" % ", ".join("%s-%s" % batch for batch in failed_batches))
+  msg("Rerun with --resume to run the failed batches again")
+blib.elapsed_time()
+if failed_batches:
+  sys.exit(1)
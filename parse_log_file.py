@@ -100,18 +100,16 @@ def yield_page_lines(fn):
     for i in range(frm+1, to):
       page_lines[i] = fix_page_line(page_lines[i])
 
-  for line in open(fn, "r", encoding="utf-8"):
-    line = line.strip()
-    # Add a colon after Processing to match other lines
-    m = re.match(r"^(Page [^{}]*: )Processing (\{\{.*?\}\})$", line)
-    if m:
-      line = "%sProcessing: %s" % (m.groups())
-    m = re.match(r"^Page ([0-9/.-]+) (.*?): (.*)$", line)
-    if not m:
-      pagemsg("Can't parse line, skipping: [%s]" % line)
+  # The lines are already split into index, page name and text, using the event log if there is one.
+  for newindex, newpagename, text in blib.yield_page_messages_from_output(fn):
+    text = text.strip()
+    if newindex is None or not re.match(r"^[0-9/.-]+$", newindex):
+      pagemsg("Can't parse line, skipping: [%s]" % text)
     else:
-      newindex = m.group(1)
-      newpagename = m.group(2)
+      # Add a colon after Processing to match other lines, including lines where
+      # a prefix such as a language code precedes Processing
+      text = re.sub(r"^([^{}]*: )?Processing (\{\{.*?\}\})$", r"\1Processing: \2", text)
+      line = "Page %s %s: %s" % (newindex, newpagename, text)
       # We're at the end of a page, starting a new one.
       if newindex != index or newpagename != pagename:
         if index != None:
@@ -135,7 +133,7 @@ def yield_page_lines(fn):
         last_processing_template = None
         replace_from_templates = []
         replace_to_template = None
-      mm = re.match(r"Replaced (\{\{.*?\}\}) with (\{\{.*?\}\})$", m.group(3))
+      mm = re.match(r"Replaced (\{\{.*?\}\}) with (\{\{.*?\}\})$", text)
       if mm:
         # We found a "Replaced {{FOO}} with {{BAR}} line.
         from_template = mm.group(1)
@@ -151,7 +149,7 @@ def yield_page_lines(fn):
           replace_from_templates = [from_template]
           replace_to_template = to_template
       else:
-        mm = re.match(r".*?: Processing: (\{\{.*?\}\})$", m.group(3))
+        mm = re.match(r".*?: Processing: (\{\{.*?\}\})$", text)
         if mm:
           processing_template = mm.group(1)
           if last_processing_template and (last_processing_template !=
@@ -11,13 +11,34 @@ import unicodedata
 # actual current text of the page. `contents` is the desired text of the page (or of the specific language section if
 # --lang-only or --subset-of-langs), and `origcontents` is the previous text of the page (or of the specific language
 # section) from which `contents` was derived. We need `origcontents` so we can check to see if the page (or specific
-# language section) was changed by someone else in the meantime; if so, we can't save.
+# language section) was changed by someone else in the meantime; if so, we can't save unless --merge is given, in
+# which case we do a three-way merge of our changes with the changes made by others, and save unless they conflict.
 def process_text_on_page(index, pagetitle, curtext, contents, prev_comment, origcontents):
   def pagemsg(txt):
     msg("Page %s %s: %s" % (index, pagetitle, txt))
   def errandpagemsg(txt):
     errandmsg("Page %s %s: %s" % (index, pagetitle, txt))
 
+  # Merge the changes from `supposed_curtext` to `newtext` into `curtext`, where `what` describes the text for
+  # messages. Return the merged text, or None if the changes conflict.
+  def merge_changes(what, supposed_curtext, curtext, newtext):
+    merged, conflicts = blib.merge_text(supposed_curtext, newtext, curtext, args.merge_granularity)
+    if conflicts:
+      errandpagemsg("WARNING: %s has changed from supposed original text and %s change%s conflict%s with ours, not saving"
+                    % (what, len(conflicts), "" if len(conflicts) == 1 else "s", "s" if len(conflicts) == 1 else ""))
+      for orig_start, orig_text, edited_text, current_text in conflicts:
+        conflict_msg = "Page %s %s: Conflict in %s at %s %s: original <%s>, ours <%s>, current <%s>" % (
+          index, pagetitle, what, args.merge_granularity, orig_start + 1, format_conflict_text(orig_text),
+          format_conflict_text(edited_text), format_conflict_text(current_text))
+        msg(conflict_msg)
+        if conflict_fp:
+          conflict_fp.write(conflict_msg + "\n")
+      merge_stats["conflicted"] += 1
+      return None
+    pagemsg("%s has changed from supposed original text; merged our changes with the current text" % what)
+    merge_stats["merged"] += 1
+    return merged
+
   def normalize_text(text):
     if text is None:
       return text
@@ -61,10 +82,15 @@ def process_text_on_page(index, pagetitle, curtext, contents, prev_comment, orig
         if cursectext != supposed_cursectext:
           if cursectext == newsectext:
             pagemsg("%s section has already been changed to new text, not saving" % lang)
+            return False
+          elif args.merge:
+            newsectext = merge_changes("%s section" % lang, supposed_cursectext, cursectext, newsectext)
+            if newsectext is None:
+              return False
           else:
             errandpagemsg("WARNING: %s text has changed from supposed original text, not saving; showing our changes:" % lang)
             blib.show_diff(supposed_cursectext, newsectext)
-          return False
+            return False
         sections[langsec] = newsectext
         return True
 
@@ -93,10 +119,16 @@ def process_text_on_page(index, pagetitle, curtext, contents, prev_comment, orig
       if nfc_curtext != supposed_nfc_curtext:
         if nfc_curtext == contents:
           pagemsg("Page has already been changed to new text, not saving")
+          return
+        elif args.merge:
+          # Add a final newline to each text so that a change to the last line is handled like other changes.
+          contents = merge_changes("Text", supposed_nfc_curtext + "\n", nfc_curtext + "\n", contents + "\n")
+          if contents is None:
+            return
         else:
           errandpagemsg("WARNING: Text has changed from supposed original text, not saving; showing our changes:")
           blib.show_diff(supposed_nfc_curtext, contents)
-        return
+          return
   if not prev_comment and not args.comment:
     errandpagemsg("WARNING: Trying to save page and neither previous comment not --comment available")
     return
@@ -108,6 +140,10 @@ def process_text_on_page(index, pagetitle, curtext, contents, prev_comment, orig
     comment = "%s; %s" % (prev_comment, args.comment)
   return contents.rstrip("\n"), comment
 
+# Format a conflicting piece of text for the conflict report, on a single line.
+def format_conflict_text(text):
+  return blib.truncate_string(blib.escape_newline(text.rstrip("\n")), 150)
+
 if __name__ == "__main__":
   parser = blib.create_argparser("Push changes made to find_regex.py output files",
     include_pagefile=True, include_stdin=True)
@@ -118,9 +154,24 @@ if __name__ == "__main__":
   parser.add_argument("--subset-of-langs", action="store_true",
     help="find_regex.py output contains a subset of all languages on the page.")
   parser.add_argument("--allow-page-creation", action="store_true", help="Allow page creation.")
+  parser.add_argument("--merge", action="store_true",
+    help="If a page (or language section) has changed since the original text, merge our changes with the changes made since then instead of skipping the page, unless they conflict.")
+  parser.add_argument("--merge-granularity", choices=["line", "section"], default="line",
+    help="With --merge, whether changes conflict if they are to the same or adjacent lines ('line', the default) or to the same section ('section').")
+  parser.add_argument("--conflict-file", help="With --merge, write a report of the conflicting changes to this file.")
+  parser.add_argument("--no-bulk-fetch", action="store_false", dest="bulk_fetch",
+    help="When pushing a whole direcfile, fetch the current text of each page separately instead of in bulk.")
+  parser.set_defaults(bulk_fetch=True)
   args = parser.parse_args()
   start, end = blib.parse_start_end(args.start, args.end)
 
+  merge_stats = {"merged": 0, "conflicted": 0}
+  def output_merge_stats():
+    if args.merge:
+      msg("Merged changes into %s changed pages or sections; %s had conflicts" % (
+        merge_stats["merged"], merge_stats["conflicted"]))
+  conflict_fp = open(args.conflict_file, "w", encoding="utf-8") if args.conflict_file else None
+
   origpages = {}
 
   if args.origfile:
@@ -148,17 +199,32 @@ if __name__ == "__main__":
         return
       return process_text_on_page(index, pagetitle, curtext, newtext, comment, origcontents)
     blib.do_pagefile_cats_refs(args, start, end, do_process_text_on_page, edit=True, stdin=True)
+    output_merge_stats()
 
   else:
     index_pagetitle_text_comment = blib.yield_text_from_find_regex(lines, args.verbose)
-    for _, (index, pagetitle, newtext, comment) in blib.iter_items(index_pagetitle_text_comment, start, end,
-        get_name=lambda x:x[1], get_index=lambda x:x[0]):
-      origcontents = origpages.get(pagetitle, None)
-      if origcontents == newtext:
+    # Yield ((INDEX, PAGETITLE, NEWTEXT, COMMENT, ORIGCONTENTS), PAGE) for each page in the directives, where PAGE is
+    # None for pages without changes, so that the current text of the pages can be fetched in bulk using
+    # blib.prefetch_pages().
+    def yield_pages_to_push():
+      for _, (index, pagetitle, newtext, comment) in blib.iter_items(index_pagetitle_text_comment, start, end,
+          get_name=lambda x:x[1], get_index=lambda x:x[0]):
+        origcontents = origpages.get(pagetitle, None)
+        page = None if origcontents == newtext else pywikibot.Page(site, pagetitle)
+        yield (index, pagetitle, newtext, comment, origcontents), page
+    pages_to_push = yield_pages_to_push()
+    if args.bulk_fetch:
+      pages_to_push = blib.prefetch_pages(pages_to_push, batch_size=args.prefetch_batch_size,
+                                          window=args.prefetch_window, skip_page=lambda page: page is None)
+    for (index, pagetitle, newtext, comment, origcontents), page in pages_to_push:
+      if page is None:
         msg("Page %s %s: Skipping contents because no change" % (index, pagetitle))
       else:
         def do_process_page(page, index, parsed):
           return process_text_on_page(index, str(page.title()), page.text, newtext, comment, origcontents)
-        blib.do_edit(pywikibot.Page(site, pagetitle), index, do_process_page,
-            save=args.save, verbose=args.verbose, diff=args.diff)
+        blib.do_edit(page, index, do_process_page, save=args.save, verbose=args.verbose, diff=args.diff)
+    output_merge_stats()
     blib.elapsed_time()
+
+  if conflict_fp:
+    conflict_fp.close()
@@ -136,6 +136,12 @@ def push_one_set_of_manual_changes(pagetitle, index, text, repl_curr_changes, co
       newtext = re.sub("^" + re.escape(curr_template) + "$", repl_template.replace("\\", r"\\"), text, 0, re.M)
     else:
       newtext = text.replace(curr_template, repl_template)
+    merged = False
+    if newtext == text and not found_repl_template and args.merge:
+      merged_text = merge_changed_snippet(text, curr_template, repl_template, pagemsg)
+      if merged_text is not None:
+        newtext = merged_text
+        merged = True
     if newtext == text:
       if not found_repl_template:
         pagemsg("WARNING: Unable to locate current template: %s (would replace with %s)" % (curr_template, repl_template))
@@ -146,7 +152,8 @@ def push_one_set_of_manual_changes(pagetitle, index, text, repl_curr_changes, co
         pagemsg("WARNING: Made change, but replacement template %s already present!" % repl_template)
       repl_curr_diff = len(repl_template) - len(curr_template)
       newtext_text_diff = len(newtext) - len(text)
-      if newtext_text_diff == repl_curr_diff:
+      # When merging, the length change also depends on the changes made to the page by others.
+      if merged or newtext_text_diff == repl_curr_diff:
         pass
       elif repl_curr_diff == 0:
         if newtext_text_diff != 0:
@@ -171,6 +178,37 @@ def push_one_set_of_manual_changes(pagetitle, index, text, repl_curr_changes, co
     changelogs = [comment]
   return text, changelogs
 
+# Apply the change from `curr` to `repl` to `text` when `curr` can't be found in `text` because the page has been
+# changed since `curr` was taken from it. This only works with changes of more than one line: the part of `text` from
+# the first line of `curr` through its last line is located (each must occur only once in `text`), and the change is
+# merged into it using a three-way merge. Return the new text, or None if the part can't be located or the change
+# conflicts with the changes made to the page.
+def merge_changed_snippet(text, curr, repl, pagemsg):
+  curr_lines = curr.split("\n")
+  first_line = curr_lines[0]
+  last_line = curr_lines[-1]
+  if len(curr_lines) < 2 or not first_line or not last_line:
+    return None
+  if text.count(first_line) != 1 or text.count(last_line) != 1:
+    pagemsg("WARNING: Can't merge change because first or last line of current text isn't found exactly once: %s"
+            % curr)
+    return None
+  start = text.find(first_line)
+  end = text.find(last_line, start + len(first_line))
+  if end < 0:
+    pagemsg("WARNING: Can't merge change because first and last lines of current text are out of order: %s" % curr)
+    return None
+  end += len(last_line)
+  merged, conflicts = blib.merge_text(curr, repl, text[start:end])
+  if conflicts:
+    for orig_start, orig_text, edited_text, current_text in conflicts:
+      pagemsg("WARNING: Can't merge change because of conflict at line %s: original <%s>, ours <%s>, current <%s>" % (
+        orig_start + 1, blib.escape_newline(orig_text), blib.escape_newline(edited_text),
+        blib.escape_newline(current_text)))
+    return None
+  pagemsg("Current text has changed; merged change with the changes made to the page")
+  return text[:start] + merged + text[end:]
+
 def undo_slash_newline(txt, repl=False):
   if args.undo_slash_newline or repl and args.undo_slash_newline_in_repl_only:
     return blib.undo_escape_newline(txt)
@@ -228,6 +266,7 @@ params.add_argument("--undo-slash-newline-in-repl-only", action="store_true", he
 params.add_argument("--comment", help="Comment of change log message (included in addition to any comments embedded in the manual changes)")
 params.add_argument("--include-what-changed", action="store_true", help="If no comment embedded in manual changes, include what changed in the changelog")
 params.add_argument("--full-lines", action="store_true", help="Changes are full lines and must match an entire line")
+params.add_argument("--merge", action="store_true", help="If the current text of a multiline change can't be found because the page has changed, merge the change with the changes made to the page, unless they conflict")
 
 args = params.parse_args()
 start, end = blib.parse_start_end(args.start, args.end)
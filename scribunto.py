@@ -0,0 +1,985 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Local execution of Scribunto (Lua) modules, used by blib.expand_text() when --local-lua is given so that template
+# calls like {{#invoke:ru-noun|generate_args|...}} can be expanded without contacting the server. Modules are loaded
+# from the .lua files in the working tree (e.g. Module:string utilities from string-utilities.lua,
+# Module:languages/data/2 from languages-data2.lua) or, failing that, from a page store (see blib.PageStore), and run
+# in an embedded Lua runtime provided by the `lupa` package (which must be installed separately). Only the parts of the
+# mw.* library commonly used by the modules here are provided (mw.ustring, mw.text, mw.title, mw.clone, mw.loadData,
+# frames and so on), and templates are expanded only if they are simple wrappers around {{#invoke:...}} whose
+# wikitext is in the page store. Anything else raises LocalExpansionUnsupported, in which case blib falls back to the
+# server. See check_local_lua.py for checking local expansions against expansions recorded from the server.
+#
+# Note that the working tree holds only some of the modules. Most inflection modules, including ru-noun, la-nominal
+# and ar-verb, require shared modules that aren't in it (e.g. Module:memoize), so they can only be run locally if a page
+# store containing those modules (built by build_page_store.py from a dump including the Module namespace) is given
+# using --page-store; without one, every call to them falls back to the server.
+
+import blib
+from blib import msg
+
+import json, os, re, unicodedata, urllib.parse, hashlib
+
+class LocalExpansionUnsupported(Exception):
+  pass
+
+######################################################################################################################
+#                                               Lua patterns                                                         #
+######################################################################################################################
+
+# Unicode-aware Lua pattern matching for mw.ustring, done by translating Lua patterns into Python regular expressions.
+# The only unsupported construct is %b (balanced match); frontier patterns (%f) are supported.
+
+class LuaPatternError(Exception):
+  pass
+
+# Map from class letter (as in %a) to the contents of a regex character set matching the characters in the class, as
+# defined by Scribunto for mw.ustring. Computed on first use.
+_class_set_contents = None
+
+def _escape_set_char(c):
+  return "\\" + c if c in "\\]^-[" else c
+
+def _ranges_to_set_contents(codepoints):
+  parts = []
+  start = prev = None
+  for cp in codepoints:
+    if prev is not None and cp == prev + 1:
+      prev = cp
+      continue
+    if start is not None:
+      parts.append(_escape_set_char(chr(start)) if start == prev else "%s-%s" % (
+        _escape_set_char(chr(start)), _escape_set_char(chr(prev))))
+    start = prev = cp
+  if start is not None:
+    parts.append(_escape_set_char(chr(start)) if start == prev else "%s-%s" % (
+      _escape_set_char(chr(start)), _escape_set_char(chr(prev))))
+  return "".join(parts)
+
+def _get_class_set_contents():
+  global _class_set_contents
+  if _class_set_contents is None:
+    members = {c: [] for c in "acdlpsuw"}
+    for cp in range(0x110000):
+      if 0xD800 <= cp <= 0xDFFF:
+        continue
+      cat = unicodedata.category(chr(cp))
+      major = cat[0]
+      if major == "L":
+        members["a"].append(cp)
+        members["w"].append(cp)
+        if cat == "Ll":
+          members["l"].append(cp)
+        elif cat == "Lu":
+          members["u"].append(cp)
+      elif cat == "Nd":
+        members["d"].append(cp)
+        members["w"].append(cp)
+      elif major == "P":
+        members["p"].append(cp)
+      elif cat == "Cc":
+        members["c"].append(cp)
+      if cat == "Zs" or chr(cp) in "\t\n\v\f\r":
+        members["s"].append(cp)
+    _class_set_contents = {c: _ranges_to_set_contents(cps) for c, cps in members.items()}
+    _class_set_contents["x"] = "0-9A-Fa-f０-９Ａ-Ｆａ-ｆ"
+  return _class_set_contents
+
+# Translate a Lua pattern into a Python regular expression. Return a tuple (REGEX, ANCHORED, POSITION_GROUPS) where
+# ANCHORED is True if the pattern began with ^ (which is removed) and POSITION_GROUPS is the set of group numbers of
+# position captures ().
+def translate_lua_pattern(pattern):
+  class_contents = None
+  n = len(pattern)
+
+  def class_escape(c):
+    nonlocal class_contents
+    lower = c.lower()
+    if lower in "acdlpsuwx":
+      if class_contents is None:
+        class_contents = _get_class_set_contents()
+      return class_contents[lower], c != lower
+    return None
+
+  # Parse a set beginning at `i` (which points to the opening bracket); return (REGEX, INDEX AFTER SET).
+  def parse_set(i):
+    i += 1
+    negate = False
+    if i < n and pattern[i] == "^":
+      negate = True
+      i += 1
+    pos_parts = []
+    neg_classes = []
+    first = True
+    while True:
+      if i >= n:
+        raise LuaPatternError("Missing ']' in pattern: %s" % pattern)
+      c = pattern[i]
+      if c == "]" and not first:
+        i += 1
+        break
+      first = False
+      if c == "%":
+        if i + 1 >= n:
+          raise LuaPatternError("Malformed pattern (ends with '%%'): %s" % pattern)
+        cls = class_escape(pattern[i + 1])
+        if cls:
+          contents, complemented = cls
+          if complemented:
+            neg_classes.append(contents)
+          else:
+            pos_parts.append(contents)
+        else:
+          pos_parts.append(_escape_set_char(pattern[i + 1]))
+        i += 2
+      elif i + 2 < n and pattern[i + 1] == "-" and pattern[i + 2] != "]":
+        pos_parts.append("%s-%s" % (_escape_set_char(c), _escape_set_char(pattern[i + 2])))
+        i += 3
+      else:
+        pos_parts.append(_escape_set_char(c))
+        i += 1
+    if not neg_classes:
+      if not pos_parts:
+        return ("." if negate else "(?!)"), i
+      return "[%s%s]" % ("^" if negate else "", "".join(pos_parts)), i
+    alternatives = (["[%s]" % "".join(pos_parts)] if pos_parts else []) + ["[^%s]" % c for c in neg_classes]
+    alternation = "|".join(alternatives)
+    if negate:
+      return "(?:(?!%s).)" % alternation, i
+    return "(?:%s)" % alternation, i
+
+  # Parse a single-character class beginning at `i`; return (REGEX, INDEX AFTER CLASS).
+  def parse_single(i):
+    c = pattern[i]
+    if c == ".":
+      return ".", i + 1
+    if c == "[":
+      return parse_set(i)
+    if c == "%":
+      if i + 1 >= n:
+        raise LuaPatternError("Malformed pattern (ends with '%%'): %s" % pattern)
+      cls = class_escape(pattern[i + 1])
+      if cls:
+        contents, complemented = cls
+        return "[%s%s]" % ("^" if complemented else "", contents), i + 2
+      return re.escape(pattern[i + 1]), i + 2
+    return re.escape(c), i + 1
+
+  out = []
+  anchored = False
+  i = 0
+  if pattern.startswith("^"):
+    anchored = True
+    i = 1
+  group_count = 0
+  open_groups = 0
+  position_groups = set()
+  while i < n:
+    c = pattern[i]
+    if c == "(":
+      group_count += 1
+      if i + 1 < n and pattern[i + 1] == ")":
+        position_groups.add(group_count)
+        out.append("()")
+        i += 2
+      else:
+        open_groups += 1
+        out.append("(")
+        i += 1
+      continue
+    if c == ")":
+      if not open_groups:
+        raise LuaPatternError("Invalid pattern capture: %s" % pattern)
+      open_groups -= 1
+      out.append(")")
+      i += 1
+      continue
+    if c == "$" and i == n - 1:
+      out.append(r"\Z")
+      i += 1
+      continue
+    if c == "%" and i + 1 < n:
+      nextc = pattern[i + 1]
+      if nextc == "b":
+        raise LocalExpansionUnsupported("Balanced-match patterns (%%b) not supported: %s" % pattern)
+      if nextc == "f":
+        if i + 2 >= n or pattern[i + 2] != "[":
+          raise LuaPatternError("Missing '[' after '%%f' in pattern: %s" % pattern)
+        setre, i = parse_set(i + 2)
+        out.append("(?<!%s)(?=%s)" % (setre, setre))
+        continue
+      if nextc.isdigit() and nextc != "0":
+        out.append("(?:\\%s)" % nextc)
+        i += 2
+        continue
+    single, i = parse_single(i)
+    if i < n and pattern[i] in "*+-?":
+      out.append(single + {"*": "*", "+": "+", "-": "*?", "?": "?"}[pattern[i]])
+      i += 1
+    else:
+      out.append(single)
+  if open_groups:
+    raise LuaPatternError("Unfinished capture: %s" % pattern)
+  return "".join(out), anchored, position_groups
+
+_compiled_patterns = {}
+
+def compile_lua_pattern(pattern):
+  compiled = _compiled_patterns.get(pattern)
+  if compiled is None:
+    regex, anchored, position_groups = translate_lua_pattern(pattern)
+    compiled = (re.compile(regex, re.S), anchored, position_groups)
+    _compiled_patterns[pattern] = compiled
+  return compiled
+
+# Convert a value passed from Lua to a string, as Lua's string functions do for numbers.
+def _tostr(value):
+  if isinstance(value, str):
+    return value
+  if isinstance(value, bytes):
+    return value.decode("utf-8")
+  if isinstance(value, float):
+    if value == int(value) and abs(value) < 1e15:
+      return str(int(value))
+    return "%.14g" % value
+  if isinstance(value, int):
+    return str(value)
+  raise LuaPatternError("Bad argument (string expected, got %s)" % type(value).__name__)
+
+def _init_index(s, init):
+  if init is None:
+    return 0
+  init = int(init)
+  if init > 0:
+    return init - 1
+  if init == 0:
+    return 0
+  return max(len(s) + init, 0)
+
+def _captures(m, position_groups, whole_if_none=True):
+  if m.re.groups == 0:
+    return (m.group(0),) if whole_if_none else ()
+  return tuple(m.start(g) + 1 if g in position_groups else m.group(g) for g in range(1, m.re.groups + 1))
+
+def ustring_find(s, pattern, init=None, plain=False):
+  s = _tostr(s)
+  pattern = _tostr(pattern)
+  start = _init_index(s, init)
+  if start > len(s):
+    return None
+  if plain:
+    pos = s.find(pattern, start)
+    if pos < 0:
+      return None
+    return pos + 1, pos + len(pattern)
+  regex, anchored, position_groups = compile_lua_pattern(pattern)
+  m = regex.match(s, start) if anchored else regex.search(s, start)
+  if not m:
+    return None
+  return (m.start() + 1, m.end()) + _captures(m, position_groups, whole_if_none=False)
+
+def ustring_match(s, pattern, init=None):
+  s = _tostr(s)
+  pattern = _tostr(pattern)
+  start = _init_index(s, init)
+  if start > len(s):
+    return None
+  regex, anchored, position_groups = compile_lua_pattern(pattern)
+  m = regex.match(s, start) if anchored else regex.search(s, start)
+  if not m:
+    return None
+  return _captures(m, position_groups)
+
+def ustring_gmatch(s, pattern):
+  s = _tostr(s)
+  regex, anchored, position_groups = compile_lua_pattern(_tostr(pattern))
+  matches = iter([regex.match(s)] if anchored else regex.finditer(s))
+  def next_match(*args):
+    for m in matches:
+      if m:
+        return _captures(m, position_groups)
+    return None
+  return next_match
+
+# `lua_type` is lupa.lua_type, used to tell tables from functions.
+def make_ustring_gsub(lua_type):
+  def ustring_gsub(s, pattern, repl, n=None):
+    s = _tostr(s)
+    regex, anchored, position_groups = compile_lua_pattern(_tostr(pattern))
+    repl_type = lua_type(repl)
+    if repl_type is None:
+      repl_str = _tostr(repl)
+      def expand_repl(m):
+        captures = _captures(m, position_groups)
+        def expand_escape(em):
+          c = em.group(1)
+          if c == "%":
+            return "%"
+          if c == "0":
+            return m.group(0)
+          if c.isdigit():
+            index = int(c) - 1
+            if index >= len(captures):
+              raise LuaPatternError("Invalid capture index %%%s in replacement string" % c)
+            return _tostr(captures[index])
+          raise LuaPatternError("Invalid use of '%' in replacement string")
+        return re.sub("%(.)", expand_escape, repl_str, flags=re.S)
+    else:
+      def expand_repl(m):
+        captures = _captures(m, position_groups)
+        if repl_type == "table":
+          value = repl[captures[0]]
+        else:
+          value = repl(*captures)
+        if value is None or value is False:
+          return m.group(0)
+        return _tostr(value)
+    count = 0 if n is None else int(n)
+    if count < 0:
+      return s, 0
+    if anchored:
+      m = regex.match(s)
+      if not m or (n is not None and count == 0):
+        return s, 0
+      return expand_repl(m) + s[m.end():], 1
+    if n is not None and count == 0:
+      return s, 0
+    return regex.subn(expand_repl, s, count=count)
+  return ustring_gsub
+
+def ustring_sub(s, i=1, j=-1):
+  s = _tostr(s)
+  length = len(s)
+  i = int(i) if i is not None else 1
+  j = int(j) if j is not None else -1
+  if i < 0:
+    i = max(length + i + 1, 1)
+  elif i == 0:
+    i = 1
+  if j < 0:
+    j = length + j + 1
+  elif j > length:
+    j = length
+  return s[i - 1:j] if i <= j else ""
+
+def ustring_codepoint(s, i=1, j=None):
+  s = _tostr(s)
+  sub = ustring_sub(s, i, i if j is None else j)
+  return tuple(ord(c) for c in sub)
+
+def ustring_gcodepoint(s, i=1, j=-1):
+  codepoints = iter(ord(c) for c in ustring_sub(s, i, j))
+  def next_codepoint(*args):
+    return next(codepoints, None)
+  return next_codepoint
+
+######################################################################################################################
+#                                            Wikitext expansion                                                      #
+######################################################################################################################
+
+namespace_names = {
+  0: "", 1: "Talk", 2: "User", 3: "User talk", 4: "Wiktionary", 5: "Wiktionary talk", 6: "File", 8: "MediaWiki",
+  10: "Template", 11: "Template talk", 12: "Help", 14: "Category", 100: "Appendix", 110: "Thesaurus",
+  114: "Citations", 118: "Reconstruction", 828: "Module", 829: "Module talk",
+}
+namespace_numbers = {name.lower(): num for num, name in namespace_names.items()}
+
+def split_title_namespace(title):
+  if ":" in title:
+    prefix, rest = title.split(":", 1)
+    num = namespace_numbers.get(prefix.strip().replace("_", " ").lower())
+    if num:
+      return num, rest
+  return 0, title
+
+# Return the position just after the "}}" closing the template call whose "{{" is at `start`, or -1.
+def _find_template_end(text, start):
+  depth = 0
+  i = start
+  n = len(text)
+  while i < n:
+    if text.startswith("{{", i):
+      depth += 1
+      i += 2
+    elif text.startswith("}}", i):
+      depth -= 1
+      i += 2
+      if depth == 0:
+        return i
+    else:
+      i += 1
+  return -1
+
+# Split the inside of a template call into parts at the pipes not inside nested templates or links.
+def _split_template_parts(inner):
+  parts = []
+  depth = 0
+  last = 0
+  i = 0
+  n = len(inner)
+  while i < n:
+    two = inner[i:i + 2]
+    if two in ("{{", "[["):
+      depth += 1
+      i += 2
+    elif two in ("}}", "]]"):
+      depth -= 1
+      i += 2
+    elif inner[i] == "|" and depth == 0:
+      parts.append(inner[last:i])
+      i += 1
+      last = i
+    else:
+      i += 1
+  parts.append(inner[last:])
+  return parts
+
+def _split_named_arg(part):
+  depth = 0
+  i = 0
+  n = len(part)
+  while i < n:
+    two = part[i:i + 2]
+    if two in ("{{", "[["):
+      depth += 1
+      i += 2
+    elif two in ("}}", "]]"):
+      depth -= 1
+      i += 2
+    elif part[i] == "=" and depth == 0:
+      return part[:i], part[i + 1:]
+    else:
+      i += 1
+  return None, part
+
+_template_param_re = re.compile(r"\{\{\{([^{}|]*)(?:\|([^{}]*))?\}\}\}")
+
+def _prepare_template_body(text):
+  if "<onlyinclude>" in text:
+    text = "".join(re.findall(r"<onlyinclude>(.*?)</onlyinclude>", text, re.S))
+  text = re.sub(r"<noinclude>.*?(?:</noinclude>|\Z)", "", text, flags=re.S)
+  text = re.sub(r"</?includeonly>", "", text)
+  text = re.sub(r"<!--.*?(?:-->|\Z)", "", text, flags=re.S)
+  return text
+
+class LocalScribunto(object):
+  # `module_dirs` is a list of directories to load .lua files from (default the directory containing this file).
+  # `page_store`, if given, is a blib.PageStore used for modules not in those directories and for templates.
+  def __init__(self, module_dirs=None, page_store=None):
+    try:
+      try:
+        from lupa import lua51 as lupa_module
+      except ImportError:
+        import lupa as lupa_module
+    except ImportError:
+      raise ImportError("Local Lua execution requires the 'lupa' package (pip install lupa)")
+    self.lupa = lupa_module
+    self.module_dirs = module_dirs or [os.path.dirname(os.path.abspath(__file__))]
+    self.page_store = page_store
+    self.lua = lupa_module.LuaRuntime(encoding="utf-8", unpack_returned_tuples=True)
+    self.current_title = ""
+    self.stats = {"local": 0, "unsupported": 0, "errors": 0}
+    self.lua.execute(_lua_shim)
+    self.lua.globals().setup_mw(self.lua.table_from(self._python_helpers()))
+
+  def _python_helpers(self):
+    lua_type = self.lupa.lua_type
+    def title_table(title):
+      if title is None:
+        return None
+      ns, text = split_title_namespace(title.replace("_", " ").strip())
+      full = ("%s:%s" % (namespace_names[ns], text)) if ns else text
+      subpage_parts = text.split("/") if ns != 0 else [text]
+      return self.lua.table_from({
+        "text": text, "fullText": full, "prefixedText": full, "nsText": namespace_names[ns], "namespace": ns,
+        "baseText": "/".join(subpage_parts[:-1]) if len(subpage_parts) > 1 else text,
+        "rootText": subpage_parts[0], "subpageText": subpage_parts[-1], "isSubpage": len(subpage_parts) > 1,
+        "exists": self.page_text(full) is not None, "isContentPage": ns in (0, 100, 118),
+      })
+    def title_new(text, ns=None):
+      text = _tostr(text)
+      if ns is not None and split_title_namespace(text)[0] == 0:
+        if isinstance(ns, str):
+          ns = namespace_numbers.get(ns.lower(), 0)
+        if ns:
+          text = "%s:%s" % (namespace_names.get(int(ns), ""), text)
+      return title_table(text)
+    def title_content(full_text):
+      return self.page_text(_tostr(full_text))
+    def json_encode(value, flags=None):
+      return json.dumps(self.lua_to_python(value), ensure_ascii=False)
+    def json_decode(text, flags=None):
+      return self.python_to_lua(json.loads(_tostr(text)))
+    return {
+      "ufind": ustring_find, "umatch": ustring_match, "ugmatch": ustring_gmatch,
+      "ugsub": make_ustring_gsub(lua_type), "usub": ustring_sub, "ulen": lambda s: len(_tostr(s)),
+      "uupper": lambda s: _tostr(s).upper(), "ulower": lambda s: _tostr(s).lower(),
+      "uchar": lambda *codepoints: "".join(chr(int(cp)) for cp in codepoints),
+      "ucodepoint": ustring_codepoint, "ugcodepoint": ustring_gcodepoint,
+      "unormalize": lambda form, s: unicodedata.normalize(form, _tostr(s)),
+      "title_new": title_new, "title_current": lambda: title_table(self.current_title),
+      "title_content": title_content,
+      "module_source": self.module_source,
+      "preprocess": lambda text: self.expand_wikitext(_tostr(text), self.current_title),
+      "expand_template": lambda title, args: self.expand_template(_tostr(title), self.lua_to_python(args)),
+      "json_encode": json_encode, "json_decode": json_decode,
+      "uri_encode": lambda s, enctype=None: urllib.parse.quote(_tostr(s), safe="") if enctype == "PATH" else
+        urllib.parse.quote(_tostr(s), safe="").replace("%20", "_" if enctype == "WIKI" else "+"),
+      "uri_decode": lambda s, enctype=None: urllib.parse.unquote(_tostr(s)) if enctype == "PATH" else
+        urllib.parse.unquote_plus(_tostr(s)),
+      "anchor_encode": lambda s: re.sub(r"\s+", "_", _tostr(s).strip()),
+      "hash_value": lambda algo, s: hashlib.new(_tostr(algo), _tostr(s).encode("utf-8")).hexdigest(),
+    }
+
+  def lua_to_python(self, value):
+    if self.lupa.lua_type(value) != "table":
+      return value
+    items = list(value.items())
+    keys = [k for k, _ in items]
+    if keys and all(isinstance(k, int) for k in keys) and sorted(keys) == list(range(1, len(keys) + 1)):
+      return [self.lua_to_python(value[k]) for k in range(1, len(keys) + 1)]
+    return {k: self.lua_to_python(v) for k, v in items}
+
+  def python_to_lua(self, value):
+    if isinstance(value, list):
+      return self.lua.table_from({i + 1: self.python_to_lua(v) for i, v in enumerate(value)})
+    if isinstance(value, dict):
+      return self.lua.table_from({k: self.python_to_lua(v) for k, v in value.items()})
+    return value
+
+  # Return the text of the page `title` from the working tree (for modules) or the page store, or None.
+  def page_text(self, title):
+    ns, name = split_title_namespace(title)
+    if ns == 828:
+      base = name.replace(" ", "-")
+      for candidate in [base.replace("/", "-"), re.sub("/([0-9])", r"\1", base).replace("/", "-")]:
+        for module_dir in self.module_dirs:
+          path = os.path.join(module_dir, candidate + ".lua")
+          if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as fp:
+              return fp.read()
+    if self.page_store is not None:
+      stored = self.page_store.lookup(title)
+      if stored is not None:
+        return stored[0]
+    return None
+
+  def module_source(self, name):
+    name = _tostr(name)
+    if not name.startswith("Module:"):
+      name = "Module:" + name
+    text = self.page_text(name)
+    if text is None:
+      raise LocalExpansionUnsupported("Module not available locally: %s" % name)
+    return text
+
+  # Call function `func` of module `module` directly with the given arguments, returning its (first) return value
+  # converted to Python. E.g. call("ru-translit", "tr", "слово").
+  def call(self, module, func, *args, pagetitle=""):
+    self.current_title = pagetitle
+    return self.lua_to_python(self.lua.globals().call_module_function(
+      module if module.startswith("Module:") else "Module:" + module, func, *args))
+
+  # Invoke function `func` of module `module` as {{#invoke:}} does, with `args` as the frame arguments. The parent
+  # frame has title `parent_title` and arguments `parent_args`; for a direct {{#invoke:}} on a page (not from a
+  # template), it's the page itself with no arguments, as in MediaWiki.
+  def invoke(self, module, func, args, parent_title=None, parent_args=None):
+    lua_args = self.lua.table_from(args)
+    lua_parent_args = self.lua.table_from(parent_args or {})
+    if parent_title is None:
+      parent_title = self.current_title
+    return self.lua.globals().invoke_module(module if module.startswith("Module:") else "Module:" + module, func,
+                                            lua_args, parent_title, lua_parent_args)
+
+  def expand_template(self, name, args):
+    if isinstance(args, list):
+      args = {i + 1: v for i, v in enumerate(args)}
+    title = name if split_title_namespace(name)[0] else "Template:" + name
+    seen = set()
+    text = self.page_text(title)
+    while text is not None:
+      m = blib._link_index_redirect_re.match(text)
+      if not m or title in seen:
+        break
+      seen.add(title)
+      title = m.group(1)
+      text = self.page_text(title)
+    if text is None:
+      raise LocalExpansionUnsupported("Template not available locally: %s" % title)
+    return self.expand_wikitext(_prepare_template_body(text), self.current_title, params=args, frame_title=title)
+
+  # Expand the template calls in `text` on page `pagetitle`. `params` are the arguments of the template whose body is
+  # being expanded, if any, and `frame_title` its title.
+  def expand_wikitext(self, text, pagetitle, params=None, frame_title=None):
+    self.current_title = pagetitle
+    if params is not None:
+      def substitute_param(m):
+        name = m.group(1).strip()
+        key = int(name) if re.match("^[1-9][0-9]*$", name) else name
+        if key in params:
+          return params[key]
+        if m.group(2) is not None:
+          return m.group(2)
+        return m.group(0)
+      while True:
+        new_text = _template_param_re.sub(substitute_param, text)
+        if new_text == text:
+          break
+        text = new_text
+    out = []
+    i = 0
+    while True:
+      j = text.find("{{", i)
+      if j < 0:
+        out.append(text[i:])
+        break
+      out.append(text[i:j])
+      end = _find_template_end(text, j)
+      if end < 0:
+        out.append(text[j:])
+        break
+      out.append(self.expand_call(text[j + 2:end - 2], pagetitle, params, frame_title))
+      i = end
+    return "".join(out)
+
+  def expand_call(self, inner, pagetitle, params, frame_title):
+    parts = _split_template_parts(inner)
+    name = self.expand_wikitext(parts[0], pagetitle, params, frame_title).strip()
+    args = {}
+    position = 0
+    for part in parts[1:]:
+      argname, value = _split_named_arg(part)
+      if argname is None:
+        position += 1
+        args[position] = self.expand_wikitext(value, pagetitle, params, frame_title)
+      else:
+        argname = self.expand_wikitext(argname, pagetitle, params, frame_title).strip()
+        key = int(argname) if re.match("^[1-9][0-9]*$", argname) else argname
+        args[key] = self.expand_wikitext(value, pagetitle, params, frame_title).strip()
+    if name.startswith("#invoke:"):
+      module = name[len("#invoke:"):].strip()
+      if 1 not in args:
+        raise LocalExpansionUnsupported("No function name in: {{%s}}" % inner)
+      func = args.pop(1).strip()
+      invoke_args = {}
+      for key, value in args.items():
+        invoke_args[key - 1 if isinstance(key, int) else key] = value
+      return self.invoke(module, func, invoke_args, frame_title, params)
+    if name == "!":
+      return "|"
+    if name in ("PAGENAME", "FULLPAGENAME"):
+      ns, text = split_title_namespace(pagetitle)
+      return text if name == "PAGENAME" else pagetitle
+    if name.startswith("#") or ":" in name and not split_title_namespace(name)[0] or re.match("^[A-Z]+$", name):
+      raise LocalExpansionUnsupported("Parser functions and magic words not supported: {{%s}}" % name)
+    self.current_title = pagetitle
+    return self.expand_template(name, args)
+
+  # Expand `text` (normally a template call) on `pagetitle` as site.expand_text() would. Raise
+  # LocalExpansionUnsupported if this can't be done locally. Lua errors are returned as error text, as the server does.
+  def expand_text(self, text, pagetitle):
+    self.lua.globals().reset_state()
+    try:
+      result = self.expand_wikitext(text, pagetitle)
+    except LocalExpansionUnsupported:
+      self.stats["unsupported"] += 1
+      raise
+    except self.lupa.LuaError as e:
+      self.stats["errors"] += 1
+      message = str(e).split("\nstack traceback:")[0]
+      if "LocalExpansionUnsupported" in message:
+        raise LocalExpansionUnsupported(message)
+      return '<strong class="error"><span class="scribunto-error">Lua error: %s</span></strong>' % message
+    except LuaPatternError as e:
+      self.stats["errors"] += 1
+      return '<strong class="error"><span class="scribunto-error">Lua error: %s</span></strong>' % e
+    self.stats["local"] += 1
+    return result
+
+_lua_shim = r"""
+local loadstring = loadstring or load
+local unpack = unpack or table.unpack
+local py
+mw = {}
+local loaded = {}
+local current_frame
+
+local builtin_modules = {}
+
+builtin_modules["libraryUtil"] = function()
+  local libraryUtil = {}
+  local function generate_msg(name, argIdx, expectType, value)
+    return string.format("bad argument #%d to '%s' (%s expected, got %s)", argIdx, name, expectType, type(value))
+  end
+  function libraryUtil.checkType(name, argIdx, arg, expectType, nilOk)
+    if arg == nil and nilOk then return end
+    if type(arg) ~= expectType then error(generate_msg(name, argIdx, expectType, arg), 3) end
+  end
+  function libraryUtil.checkTypeMulti(name, argIdx, arg, expectTypes)
+    local argType = type(arg)
+    for _, expectType in ipairs(expectTypes) do
+      if argType == expectType then return end
+    end
+    error(generate_msg(name, argIdx, table.concat(expectTypes, " or "), arg), 3)
+  end
+  function libraryUtil.checkTypeForIndexedArgs(name, args, expectType, nilOk)
+    for k, v in pairs(args) do
+      if type(k) == "number" and not (v == nil and nilOk) and type(v) ~= expectType then
+        error(generate_msg(name, k, expectType, v), 3)
+      end
+    end
+  end
+  function libraryUtil.checkTypeForNamedArg(name, argName, arg, expectType, nilOk)
+    if arg == nil and nilOk then return end
+    if type(arg) ~= expectType then
+      error(string.format("bad named argument %s to '%s' (%s expected, got %s)", argName, name, expectType,
+        type(arg)), 3)
+    end
+  end
+  function libraryUtil.makeCheckSelfFunction(libraryName, varName, selfObj, selfObjDesc)
+    return function(self, method) end
+  end
+  return libraryUtil
+end
+builtin_modules["strict"] = function() return {} end
+
+function require(name)
+  if loaded[name] ~= nil then
+    return loaded[name]
+  end
+  if builtin_modules[name] then
+    loaded[name] = builtin_modules[name]()
+    return loaded[name]
+  end
+  local full_name = name
+  if not string.find(full_name, "^Module:") then
+    full_name = "Module:" .. full_name
+  end
+  if loaded[full_name] ~= nil then
+    return loaded[full_name]
+  end
+  local source = py.module_source(full_name)
+  local chunk, err = loadstring(source, "=" .. full_name)
+  if not chunk then
+    error(err, 0)
+  end
+  local result = chunk()
+  if result == nil then
+    result = true
+  end
+  loaded[full_name] = result
+  return result
+end
+
+local function make_frame(title, args, parent)
+  local frame = {args = args or {}, _title = title, _parent = parent}
+  function frame:getParent() return self._parent end
+  function frame:getTitle() return self._title end
+  function frame:newChild(o)
+    o = o or {}
+    return make_frame(o.title or self._title, o.args or {}, self)
+  end
+  function frame:preprocess(text)
+    if type(text) == "table" then text = text.text end
+    return py.preprocess(text)
+  end
+  function frame:expandTemplate(o) return py.expand_template(o.title, o.args or {}) end
+  function frame:getArgument(name)
+    local value = self.args[name]
+    if value == nil then return nil end
+    return {expand = function() return value end}
+  end
+  function frame:callParserFunction() error("LocalExpansionUnsupported: frame:callParserFunction()", 0) end
+  function frame:extensionTag() error("LocalExpansionUnsupported: frame:extensionTag()", 0) end
+  return frame
+end
+
+function invoke_module(module_name, func_name, args, parent_title, parent_args)
+  local mod = require(module_name)
+  local func = mod[func_name]
+  if type(func) ~= "function" then
+    error(string.format("The function you specified, %s, did not exist in %s", func_name, module_name), 0)
+  end
+  local parent = make_frame(parent_title, parent_args)
+  local frame = make_frame(module_name, args, parent)
+  local saved_frame = current_frame
+  current_frame = frame
+  local results = {func(frame)}
+  current_frame = saved_frame
+  local parts = {}
+  for i = 1, table.maxn(results) do
+    parts[i] = results[i] == nil and "" or tostring(results[i])
+  end
+  return table.concat(parts)
+end
+
+function reset_state()
+  current_frame = nil
+end
+
+function call_module_function(module_name, func_name, ...)
+  local mod = require(module_name)
+  return mod[func_name](...)
+end
+
+function setup_mw(helpers)
+  py = helpers
+  local u = {}
+  u.find = py.ufind
+  u.match = py.umatch
+  u.gmatch = py.ugmatch
+  u.gsub = py.ugsub
+  u.sub = py.usub
+  u.len = py.ulen
+  u.upper = py.uupper
+  u.lower = py.ulower
+  u.char = py.uchar
+  u.codepoint = py.ucodepoint
+  u.gcodepoint = py.ugcodepoint
+  u.rep = string.rep
+  u.format = string.format
+  u.byte = string.byte
+  u.isutf8 = function() return true end
+  u.toNFC = function(s) return py.unormalize("NFC", s) end
+  u.toNFD = function(s) return py.unormalize("NFD", s) end
+  u.toNFKC = function(s) return py.unormalize("NFKC", s) end
+  u.toNFKD = function(s) return py.unormalize("NFKD", s) end
+  u.maxPatternLength = math.huge
+  u.maxStringLength = math.huge
+  mw.ustring = u
+
+  local text = {}
+  function text.trim(s, charset)
+    charset = charset or "\t\r\n\f "
+    s = u.gsub(s, "^[" .. charset .. "]*(.-)[" .. charset .. "]*$", "%1")
+    return s
+  end
+  function text.gsplit(s, pattern, plain)
+    local pos = 1
+    local done = false
+    local len = u.len(s)
+    return function()
+      if done then return nil end
+      local first, last = u.find(s, pattern, pos, plain)
+      if first and last >= first then
+        local piece = u.sub(s, pos, first - 1)
+        pos = last + 1
+        return piece
+      elseif first and first <= len then
+        -- Empty match: split after the next character.
+        local piece = u.sub(s, pos, first)
+        pos = first + 1
+        if pos > len then done = true end
+        return piece
+      end
+      done = true
+      return u.sub(s, pos)
+    end
+  end
+  function text.split(s, pattern, plain)
+    local result = {}
+    for piece in text.gsplit(s, pattern, plain) do
+      table.insert(result, piece)
+    end
+    return result
+  end
+  function text.listToText(list, separator, conjunction)
+    separator = separator or ", "
+    conjunction = conjunction or " and "
+    local n = #list
+    if n == 0 then return "" end
+    if n == 1 then return list[1] end
+    return table.concat(list, separator, 1, n - 1) .. conjunction .. list[n]
+  end
+  function text.nowiki(s)
+    s = string.gsub(s, "[&\"'<=>%[%]{|}]", function(c) return "&#" .. string.byte(c) .. ";" end)
+    return s
+  end
+  function text.encode(s)
+    s = string.gsub(s, "[<>&\"\194]", {["<"] = "&lt;", [">"] = "&gt;", ["&"] = "&amp;", ['"'] = "&quot;"})
+    return s
+  end
+  function text.decode(s)
+    s = string.gsub(s, "&(%a+);", {lt = "<", gt = ">", amp = "&", quot = '"', nbsp = "\194\160"})
+    return s
+  end
+  function text.unstrip(s) return s end
+  function text.unstripNoWiki(s) return s end
+  function text.killMarkers(s) return s end
+  function text.tag(name, attrs, content)
+    local parts = {"<" .. name}
+    for k, v in pairs(attrs or {}) do
+      table.insert(parts, " " .. k .. '="' .. text.encode(tostring(v)) .. '"')
+    end
+    if content == nil or content == false then
+      return table.concat(parts) .. ">"
+    end
+    return table.concat(parts) .. ">" .. content .. "</" .. name .. ">"
+  end
+  text.jsonEncode = py.json_encode
+  text.jsonDecode = py.json_decode
+  mw.text = text
+
+  local function make_title(t)
+    if t == nil then return nil end
+    t.getContent = function(self) return py.title_content(self.fullText) end
+    setmetatable(t, {
+      __eq = function(a, b) return a.fullText == b.fullText end,
+      __tostring = function(self) return self.fullText end,
+    })
+    return t
+  end
+  mw.title = {}
+  function mw.title.new(text_or_id, namespace) return make_title(py.title_new(text_or_id, namespace)) end
+  function mw.title.makeTitle(namespace, title) return make_title(py.title_new(title, namespace)) end
+  function mw.title.getCurrentTitle() return make_title(py.title_current()) end
+
+  function mw.clone(value)
+    local seen = {}
+    local function clone(v)
+      if type(v) ~= "table" then return v end
+      if seen[v] then return seen[v] end
+      local copy = {}
+      seen[v] = copy
+      for k, val in pairs(v) do
+        copy[clone(k)] = clone(val)
+      end
+      return setmetatable(copy, getmetatable(v))
+    end
+    return clone(value)
+  end
+  mw.loadData = require
+  mw.loadJsonData = function(page) return py.json_decode(py.title_content(page)) end
+  mw.log = function() end
+  mw.logObject = function() end
+  mw.dumpObject = function(object) return tostring(object) end
+  mw.getCurrentFrame = function()
+    return current_frame or make_frame("Module:dummy", {})
+  end
+  mw.isSubsting = function() return false end
+  mw.addWarning = function() end
+  mw.allToString = function(...)
+    local parts = {}
+    for i = 1, select("#", ...) do parts[i] = tostring((select(i, ...))) end
+    return table.concat(parts, "\t")
+  end
+
+  local content_language = {}
+  function content_language:getCode() return "en" end
+  function content_language:lc(s) return u.lower(s) end
+  function content_language:uc(s) return u.upper(s) end
+  function content_language:lcfirst(s) return u.lower(u.sub(s, 1, 1)) .. u.sub(s, 2) end
+  function content_language:ucfirst(s) return u.upper(u.sub(s, 1, 1)) .. u.sub(s, 2) end
+  function content_language:formatNum(n) return tostring(n) end
+  mw.language = {getContentLanguage = function() return content_language end}
+  mw.getContentLanguage = mw.language.getContentLanguage
+
+  mw.uri = {encode = py.uri_encode, decode = py.uri_decode, anchorEncode = py.anchor_encode}
+  mw.hash = {hashValue = py.hash_value}
+  mw.site = {namespaces = {}}
+  mw.html = setmetatable({}, {__index = function(t, k)
+    error("LocalExpansionUnsupported: mw.html." .. tostring(k), 2)
+  end})
+end
+"""